@@ -1,9 +1,6 @@
 import logging
 from io import BytesIO
 import asyncio
-import requests
-from bs4 import BeautifulSoup
-from deep_translator import GoogleTranslator
 
 from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import (
@@ -15,12 +12,37 @@ from telegram.ext import (
 )
 
 from config import TELEGRAM_TOKEN
-from wallet.eth import create_wallet, get_wallet, send_eth
+from wallet.eth import (
+    GAS_PRICE_INTERVAL,
+    WalletBusyError,
+    create_wallet_async,
+    get_wallet_address_async,
+    get_wallet_async,
+    refresh_all_balances,
+    sample_gas_price,
+    send_eth_async,
+    sync_nonces,
+)
+from wallet.indexer import index_incoming
 import qrcode
 from apscheduler.schedulers.background import BackgroundScheduler
-from finance_ai.data_fetch import update_prices, update_news, backfill_prices
-from db.models import SessionLocal, Price, News, Forecast
-from finance_ai.analysis import analyze_unlabeled_news, build_forecast
+from finance_ai.data_fetch import (
+    backfill_prices,
+    enrich_article,
+    enrich_pending_news,
+    update_news,
+    update_prices,
+)
+from db.models import SessionLocal, News
+from bot.snapshots import forecast_text, rates_text, refresh_forecast, refresh_rates
+from finance_ai.stream import start_price_stream
+from finance_ai.rollups import compact_prices, rollup_prices
+from finance_ai.analysis import (
+    analyze_unlabeled_news,
+    build_forecasts,
+    start_model_loading,
+    wait_for_sentiment_model,
+)
 
 # Проверяем наличие обязательного токена
 if not TELEGRAM_TOKEN:
@@ -70,55 +92,12 @@ def get_wallet_keyboard() -> ReplyKeyboardMarkup:
 
 # ---------- Helper: parse & translate news ---------- #
 
-async def _fetch_and_translate(url: str, summary_en: str | None = None, max_chars: int = 400) -> tuple[str, str]:
-    """Скачивает статью, извлекает текст и переводит на русский.
+async def _fetch_and_translate(url: str, title_en: str | None = None, summary_en: str | None = None) -> tuple[str, str]:
+    """Скачивает статью, извлекает текст и переводит на русский (для новостей, ещё не обогащённых в фоне).
 
     Возвращает (title_ru, snippet_ru). При ошибке – пустые строки."""
 
-    def _worker() -> tuple[str, str]:
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
-            }
-            resp = requests.get(url, headers=headers, timeout=10)
-            resp.raise_for_status()
-
-            soup = BeautifulSoup(resp.text, "html.parser")
-
-            title_en = soup.title.string.strip() if soup.title and soup.title.string else ""
-
-            paragraphs = [p.get_text(" ", strip=True) for p in soup.find_all("p")]
-            body_en = " ".join(paragraphs) or (summary_en or "")
-            body_en = body_en[:max_chars]
-
-            translator = GoogleTranslator(source="auto", target="ru")
-
-            title_ru = translator.translate(title_en) if title_en else ""
-            snippet_ru = translator.translate(body_en) if body_en else ""
-
-            # Если не удалось получить текст статьи, используем summary
-            if not snippet_ru and summary_en:
-                try:
-                    translator = GoogleTranslator(source="auto", target="ru")
-                    snippet_ru = translator.translate(summary_en[:max_chars])
-                except Exception:
-                    pass
-
-            return title_ru, snippet_ru
-        except Exception as exc:
-            logger.exception("Ошибка парсинга/перевода новости %s: %s", url, exc)
-            # Пытаемся перевести summary_en даже при ошибке загрузки страницы
-            if summary_en:
-                try:
-                    translator = GoogleTranslator(source="auto", target="ru")
-                    snippet_ru = translator.translate(summary_en[:max_chars])
-                    return "", snippet_ru
-                except Exception:
-                    pass
-            return "", ""
-
-    return await asyncio.to_thread(_worker)
+    return await asyncio.to_thread(enrich_article, url, title_en, summary_en)
 
 
 # ---------- Handlers ---------- #
@@ -194,7 +173,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def create_wallet_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/createwallet <пароль> – генерирует новый кошелёк."""
-    if get_wallet(update.effective_user.id):
+    if await get_wallet_address_async(update.effective_user.id):
         await update.message.reply_text("Кошелёк уже существует. Используйте /wallet чтобы посмотреть баланс.")
         return
 
@@ -203,7 +182,11 @@ async def create_wallet_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     password = context.args[0]
-    info = create_wallet(update.effective_user.id, password)
+    try:
+        info = await create_wallet_async(update.effective_user.id, password)
+    except WalletBusyError as exc:
+        await update.message.reply_text(f"⏳ {exc}")
+        return
     await update.message.reply_text(
         f"✅ Кошелёк создан!\nАдрес: {info.address}\n" "Не забудьте сохранить пароль — он нужен для вывода средств."
     )
@@ -211,7 +194,7 @@ async def create_wallet_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def wallet_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/wallet – показать адрес и баланс."""
-    info = get_wallet(update.effective_user.id)
+    info = await get_wallet_async(update.effective_user.id)
     if not info:
         await update.message.reply_text(
             "Кошелёк не найден. Создайте его командой /createwallet <пароль>.",
@@ -227,16 +210,16 @@ async def wallet_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def deposit_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/deposit – отправляет QR-код адреса."""
-    info = get_wallet(update.effective_user.id)
-    if not info:
+    address = await get_wallet_address_async(update.effective_user.id)
+    if not address:
         await update.message.reply_text("Сначала создайте кошелёк: /createwallet <пароль>.")
         return
 
-    qr = qrcode.make(info.address)
+    qr = qrcode.make(address)
     bio = BytesIO()
     qr.save(bio, format="PNG")
     bio.seek(0)
-    await update.message.reply_photo(photo=bio, caption=f"Адрес для пополнения: {info.address}")
+    await update.message.reply_photo(photo=bio, caption=f"Адрес для пополнения: {address}")
 
 
 async def withdraw_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -253,8 +236,10 @@ async def withdraw_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        tx_hash = send_eth(update.effective_user.id, to_address, amount, password)
+        tx_hash = await send_eth_async(update.effective_user.id, to_address, amount, password)
         await update.message.reply_text(f"✅ Транзакция отправлена. Hash: {tx_hash}")
+    except WalletBusyError as exc:
+        await update.message.reply_text(f"⏳ {exc}")
     except Exception as exc:
         logger.exception("Ошибка вывода средств: %s", exc)
         await update.message.reply_text(f"⚠️ {exc}")
@@ -282,23 +267,12 @@ async def history_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def rates_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """/rates – показывает текущие цены BTC и ETH."""
-    with SessionLocal() as session:
-        lines = []
-        for coin in ["bitcoin", "ethereum"]:
-            latest = (
-                session.query(Price)
-                .filter(Price.coin == coin)
-                .order_by(Price.timestamp.desc())
-                .first()
-            )
-            if latest:
-                price_val = float(latest.price_usd)
-                lines.append(f"{coin.capitalize()}: ${price_val:.2f}")
-        if lines:
-            await update.message.reply_text("\n".join(lines))
-        else:
-            await update.message.reply_text("Цены ещё не загружены. Подождите пару минут…")
+    """/rates – показывает текущие цены BTC и ETH (из снимка, без запросов к БД)."""
+    text = rates_text()
+    if text:
+        await update.message.reply_text(text)
+    else:
+        await update.message.reply_text("Цены ещё не загружены. Подождите пару минут…")
 
 
 async def news_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -318,58 +292,51 @@ async def news_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Новости ещё не загружены. Попробуйте позже.")
         return
 
-    messages: list[str] = []
+    picked = []
     seen_titles: set[str] = set()
-
     for n in items:
         if n.title in seen_titles:
             continue
+        picked.append(n)
+        seen_titles.add(n.title)
+        if len(picked) == 3:
+            break
+
+    # Обычно перевод уже сделан фоновой задачей; иначе переводим недостающие статьи параллельно
+    missing = [n for n in picked if n.title_ru is None]
+    fetched = await asyncio.gather(*(_fetch_and_translate(n.url, n.title, n.summary) for n in missing))
+    translations = dict(zip((n.id for n in missing), fetched))
 
-        title_ru, snippet_ru = await _fetch_and_translate(n.url, n.summary)
+    messages: list[str] = []
+    for n in picked:
+        title_ru, snippet_ru = translations.get(n.id, (n.title_ru, n.snippet_ru))
         if not title_ru:
             title_ru = n.title  # fallback
 
         msg_parts = [title_ru]
         if snippet_ru:
             msg_parts.append(snippet_ru)
-
         messages.append("\n\n".join(msg_parts))
-        seen_titles.add(n.title)
-
-        if len(messages) == 3:
-            break
 
     await update.message.reply_text("\n\n― ― ―\n\n".join(messages))
 
 
 async def forecast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """/forecast – показывает прогноз на 7 дней для BTC и ETH."""
-    with SessionLocal() as session:
-        coins = ["bitcoin", "ethereum"]
-        lines = []
-        for coin in coins:
-            forecasts = (
-                session.query(Forecast)
-                .filter(Forecast.coin == coin)
-                .order_by(Forecast.target_date)
-                .all()
-            )
-            if not forecasts:
-                continue
-            lines.append(f"Прогноз {coin.capitalize()}:")
-            for fc in forecasts:
-                lines.append(f"{fc.target_date}: ${float(fc.price_usd):.2f}")
-            lines.append("")
-        if lines:
-            await update.message.reply_text("\n".join(lines))
-        else:
-            await update.message.reply_text("Прогнозы ещё не готовы. Подождите…")
+    """/forecast – показывает прогноз на 7 дней для BTC и ETH (из снимка, без запросов к БД)."""
+    text = forecast_text()
+    if text:
+        await update.message.reply_text(text)
+    else:
+        await update.message.reply_text("Прогнозы ещё не готовы. Подождите…")
 
 
 # ---------- Application bootstrap ---------- #
 
 def run_bot() -> None:
     """Создание и запуск Telegram-приложения."""
+    # finBERT грузится в фоне, пока бот уже отвечает на команды
+    start_model_loading()
+
     app = Application.builder().token(TELEGRAM_TOKEN).build()
 
     # Command handlers
@@ -394,46 +361,91 @@ def run_bot() -> None:
         logger.debug("Запуск задачи prices_job")
         with SessionLocal() as session:
             update_prices(session)
+            rollup_prices(session)
+            refresh_rates(session)
         logger.debug("prices_job завершена")
 
+    def compact_job():
+        logger.debug("Запуск задачи compact_job")
+        with SessionLocal() as session:
+            compact_prices(session)
+        logger.debug("compact_job завершена")
+
     def news_job():
         logger.debug("Запуск задачи news_job")
         with SessionLocal() as session:
             update_news(session)
         logger.debug("news_job завершена")
 
+    def enrich_job():
+        logger.debug("Запуск задачи enrich_job")
+        with SessionLocal() as session:
+            enrich_pending_news(session)
+        logger.debug("enrich_job завершена")
+
     def sentiment_job():
         logger.debug("Запуск задачи sentiment_job")
         with SessionLocal() as session:
             analyze_unlabeled_news(session)
         logger.debug("sentiment_job завершена")
 
+    def balances_job():
+        logger.debug("Запуск задачи balances_job")
+        refresh_all_balances()
+        logger.debug("balances_job завершена")
+
+    def indexer_job():
+        logger.debug("Запуск задачи indexer_job")
+        with SessionLocal() as session:
+            index_incoming(session)
+        logger.debug("indexer_job завершена")
+
     def forecast_job():
         logger.debug("Запуск задачи forecast_job")
         with SessionLocal() as session:
-            for coin in ["bitcoin", "ethereum"]:
-                build_forecast(session, coin)
+            build_forecasts(session, ["bitcoin", "ethereum"])
+            refresh_forecast(session)
         logger.debug("forecast_job завершена")
 
-    # --- подгружаем 90-дневную историю цен и немедленно выполняем задачи ---
-    with SessionLocal() as s:
-        for coin in ["bitcoin", "ethereum"]:
-            backfill_prices(s, coin)
+    def warmup_job():
+        """Подгружает 90-дневную историю цен и сразу прогоняет все задачи."""
+        with SessionLocal() as s:
+            # Снимки из того, что уже есть в БД, — /rates и /forecast отвечают сразу
+            refresh_rates(s)
+            refresh_forecast(s)
+            for coin in ["bitcoin", "ethereum"]:
+                backfill_prices(s, coin)
+        prices_job()
+        news_job()
+        enrich_job()
+        forecast_job()
+        if wait_for_sentiment_model():
+            sentiment_job()
 
-    # --- немедленный прогон при старте ---
-    prices_job()
-    news_job()
-    sentiment_job()
-    forecast_job()
+    # --- немедленный прогон при старте: в потоке планировщика, не задерживая polling ---
+    scheduler.add_job(warmup_job, misfire_grace_time=None)
 
     # Укороченные интервалы для оперативного наполнения данных
     scheduler.add_job(prices_job, "interval", minutes=2)
     scheduler.add_job(news_job, "interval", minutes=10)
+    scheduler.add_job(enrich_job, "interval", minutes=2, max_instances=1)
     scheduler.add_job(sentiment_job, "interval", minutes=10)
+    scheduler.add_job(balances_job, "interval", minutes=5)
+    scheduler.add_job(indexer_job, "interval", minutes=1, max_instances=1)
+    scheduler.add_job(sample_gas_price, "interval", seconds=GAS_PRICE_INTERVAL)
+    scheduler.add_job(sync_nonces, "interval", seconds=GAS_PRICE_INTERVAL, max_instances=1)
     scheduler.add_job(forecast_job, "cron", minute=0)  # каждый час в 00 минут
+    scheduler.add_job(compact_job, "cron", hour=3, minute=30)  # сырые цены → бары раз в сутки
 
     scheduler.start()
 
+    # Опциональный поток тиков биржи (PRICE_STREAM_URL): /rates обновляется при каждой записи баров
+    def stream_flushed():
+        with SessionLocal() as session:
+            refresh_rates(session)
+
+    start_price_stream(on_flush=stream_flushed)
+
     logger.info("Бот запущен и ожидает события…")
     app.run_polling()
 
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import logging
+from typing import List
+
+from sqlalchemy import func, select, union_all
+
+from db.models import SessionLocal, PriceBar1m, Forecast
+
+logger = logging.getLogger(__name__)
+
+# Монеты, которые показывают /rates и /forecast
+SNAPSHOT_COINS = ["bitcoin", "ethereum"]
+
+# Готовый текст ответов. Задачи планировщика пересобирают его целиком и подменяют
+# одной операцией присваивания, так что обработчики видят либо старый, либо новый снимок.
+_snapshots: dict[str, str | None] = {"rates": None, "forecast": None}
+
+
+def _format_rates(prices: dict[str, float], coins: List[str] = SNAPSHOT_COINS) -> str | None:
+    lines = [f"{coin.capitalize()}: ${prices[coin]:.2f}" for coin in coins if coin in prices]
+    return "\n".join(lines) or None
+
+
+def latest_prices(session: SessionLocal, coins: List[str] = SNAPSHOT_COINS) -> dict[str, float]:
+    """Последняя цена каждой монеты одним запросом: закрытие последнего минутного бара.
+
+    max(start) считается отдельно по каждой монете (UNION ALL): такой max SQLite берёт
+    прямо из индекса (coin, start), а GROUP BY по IN (...) прошёл бы все бары монет."""
+
+    if not coins:
+        return {}
+    latest = union_all(
+        *(select(PriceBar1m.coin, func.max(PriceBar1m.start).label("start")).where(PriceBar1m.coin == c) for c in coins)
+    ).subquery()
+    rows = dict(
+        session.query(PriceBar1m.coin, PriceBar1m.close)
+        .join(latest, (PriceBar1m.coin == latest.c.coin) & (PriceBar1m.start == latest.c.start))
+        .all()
+    )
+    return {coin: float(price) for coin, price in rows.items()}
+
+
+def render_rates(session: SessionLocal, coins: List[str] = SNAPSHOT_COINS) -> str | None:
+    """Текст /rates из последних цен в БД."""
+    return _format_rates(latest_prices(session, coins), coins)
+
+
+def render_forecast(session: SessionLocal, coins: List[str] = SNAPSHOT_COINS) -> str | None:
+    """Текст /forecast: прогнозы всех монет одним запросом."""
+
+    forecasts = (
+        session.query(Forecast.coin, Forecast.target_date, Forecast.price_usd)
+        .filter(Forecast.coin.in_(coins))
+        .order_by(Forecast.coin, Forecast.target_date)  # порядок индекса (coin, target_date)
+        .all()
+    )
+    lines = []
+    for coin in coins:
+        rows = [(day, price) for c, day, price in forecasts if c == coin]
+        if not rows:
+            continue
+        lines.append(f"Прогноз {coin.capitalize()}:")
+        lines.extend(f"{day}: ${float(price):.2f}" for day, price in rows)
+        lines.append("")
+    return "\n".join(lines) or None
+
+
+def refresh_rates(session: SessionLocal) -> None:
+    """Пересобирает /rates из минутных баров: туда пишут и опрос CoinGecko, и поток тиков,
+    а слияние баров по closed_at оставляет самую свежую цену, откуда бы она ни пришла."""
+    _snapshots["rates"] = render_rates(session)
+
+
+def refresh_forecast(session: SessionLocal) -> None:
+    _snapshots["forecast"] = render_forecast(session)
+
+
+def rates_text() -> str | None:
+    """Готовый ответ /rates или None, если цен ещё нет."""
+    return _snapshots["rates"]
+
+
+def forecast_text() -> str | None:
+    """Готовый ответ /forecast или None, если прогнозов ещё нет."""
+    return _snapshots["forecast"]
@@ -1 +1 @@
-from .models import SessionLocal, User, Transaction, engine, Base  # noqa 
\ No newline at end of file
+from .models import SessionLocal, User, Transaction, Checkpoint, engine, Base, insert_ignore  # noqa 
\ No newline at end of file
@@ -2,16 +2,21 @@ from __future__ import annotations
 
 import datetime as dt
 import os
-from typing import Optional
+from typing import Iterable, Optional
 
 from sqlalchemy import (
     Column,
+    Float,
+    Index,
     Integer,
     String,
+    Text,
     LargeBinary,
     DateTime,
     Numeric,
     create_engine,
+    inspect,
+    text,
 )
 from sqlalchemy.orm import declarative_base, sessionmaker
 
@@ -41,10 +46,16 @@ class User(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # история пользователя: WHERE user_id = ? ORDER BY timestamp DESC LIMIT n
+        Index("ix_transactions_user_id_timestamp", "user_id", "timestamp"),
+        # перевод между двумя кошельками бота — это 'out' отправителя и 'in' получателя с одним хэшем
+        Index("uq_transactions_tx_hash_user_id_direction", "tx_hash", "user_id", "direction", unique=True),
+    )
 
     id: int = Column(Integer, primary_key=True)
-    user_id: int = Column(Integer, index=True)
-    tx_hash: str = Column(String, unique=True)
+    user_id: int = Column(Integer)
+    tx_hash: str = Column(String)  # 0x + 64 hex, см. wallet.eth.normalize_tx_hash
     direction: str = Column(String)  # 'in' / 'out'
     amount_eth: float = Column(Numeric(precision=18, scale=8))
     timestamp: dt.datetime = Column(DateTime, default=dt.datetime.utcnow)
@@ -53,20 +64,95 @@ class Transaction(Base):
         return f"<Tx {self.tx_hash[:10]}… {self.amount_eth} ETH>"
 
 
+class Checkpoint(Base):
+    """Позиция фоновых задач (например, последний обработанный блок)."""
+
+    __tablename__ = "checkpoints"
+
+    name: str = Column(String, primary_key=True)
+    value: int = Column(Integer, nullable=False)
+    updated_at: dt.datetime = Column(DateTime, default=dt.datetime.utcnow, onupdate=dt.datetime.utcnow)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<Checkpoint {self.name}={self.value}>"
+
+
 class Price(Base):
     __tablename__ = "prices"
+    __table_args__ = (
+        # одна точка на монету и момент времени — основа для INSERT … ON CONFLICT
+        Index("uq_prices_coin_timestamp", "coin", "timestamp", unique=True),
+    )
 
     id: int = Column(Integer, primary_key=True)
-    coin: str = Column(String, index=True)
+    # отдельный индекс по coin не нужен — его покрывает префикс uq_prices_coin_timestamp
+    coin: str = Column(String)
     price_usd: float = Column(Numeric(precision=18, scale=8))
+    # индекс по времени — для компактизации старых цен (finance_ai.rollups)
     timestamp: dt.datetime = Column(DateTime, default=dt.datetime.utcnow, index=True)
 
     def __repr__(self) -> str:  # pragma: no cover
         return f"<Price {self.coin} {self.price_usd} USD>"
 
 
+class _OHLCBar:
+    """Общие колонки OHLC-баров; start — начало интервала (UTC).
+
+    opened_at / closed_at — время первой и последней цены в баре: по ним
+    сливаются бары, пришедшие не по порядку (см. finance_ai.rollups)."""
+
+    id = Column(Integer, primary_key=True)
+    coin = Column(String, nullable=False)
+    start = Column(DateTime, nullable=False)
+    open = Column(Numeric(precision=18, scale=8))
+    high = Column(Numeric(precision=18, scale=8))
+    low = Column(Numeric(precision=18, scale=8))
+    close = Column(Numeric(precision=18, scale=8))
+    # Сколько цен (тиков) попало в бар
+    ticks = Column(Integer, default=0)
+    opened_at = Column(DateTime)
+    closed_at = Column(DateTime)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<{type(self).__name__} {self.coin} {self.start} {self.close}>"
+
+
+class PriceBar1m(_OHLCBar, Base):
+    """Минутные бары: из потока тикеров биржи и из таблицы prices."""
+
+    __tablename__ = "price_bars_1m"
+    __table_args__ = (Index("uq_price_bars_1m_coin_start", "coin", "start", unique=True),)
+
+
+class PriceBar1h(_OHLCBar, Base):
+    __tablename__ = "price_bars_1h"
+    __table_args__ = (Index("uq_price_bars_1h_coin_start", "coin", "start", unique=True),)
+
+
+class PriceBar1d(_OHLCBar, Base):
+    __tablename__ = "price_bars_1d"
+    __table_args__ = (Index("uq_price_bars_1d_coin_start", "coin", "start", unique=True),)
+
+
 class News(Base):
     __tablename__ = "news"
+    __table_args__ = (
+        # лента /news: ORDER BY published_at DESC LIMIT n
+        Index("ix_news_published_at", "published_at"),
+        # частичные индексы очередей: только строки, которые ещё ждут обработки
+        Index(
+            "ix_news_unlabeled",
+            "id",
+            sqlite_where=text("sentiment IS NULL"),
+            postgresql_where=text("sentiment IS NULL"),
+        ),
+        Index(
+            "ix_news_untranslated",
+            "published_at",
+            sqlite_where=text("title_ru IS NULL"),
+            postgresql_where=text("title_ru IS NULL"),
+        ),
+    )
 
     id: int = Column(Integer, primary_key=True)
     title: str = Column(String)
@@ -74,16 +160,50 @@ class News(Base):
     published_at: dt.datetime = Column(DateTime)
     summary: str | None = Column(String)
     sentiment: str | None = Column(String)
+    # Уверенность finBERT для sentiment (0…1)
+    sentiment_score: float | None = Column(Float)
+    # Заголовок и начало статьи на русском (заполняет фоновое обогащение)
+    title_ru: str | None = Column(Text)
+    snippet_ru: str | None = Column(Text)
 
     def __repr__(self):  # pragma: no cover
         return f"<News {self.title[:30]}…>"
 
 
+class SentimentCache(Base):
+    """Результат finBERT по SHA-256 нормализованного заголовка."""
+
+    __tablename__ = "sentiment_cache"
+
+    title_hash: str = Column(String(64), primary_key=True)
+    label: str = Column(String, nullable=False)
+    score: float = Column(Float, nullable=False)
+    created_at: dt.datetime = Column(DateTime, default=dt.datetime.utcnow)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<SentimentCache {self.title_hash[:10]}… {self.label} {self.score:.2f}>"
+
+
+class TranslationCache(Base):
+    """Перевод по SHA-256 исходного текста и целевому языку."""
+
+    __tablename__ = "translation_cache"
+
+    text_hash: str = Column(String(64), primary_key=True)
+    target: str = Column(String(8), primary_key=True)
+    translated: str = Column(Text, nullable=False)
+    created_at: dt.datetime = Column(DateTime, default=dt.datetime.utcnow)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<TranslationCache {self.text_hash[:10]}… → {self.target}>"
+
+
 class Forecast(Base):
     __tablename__ = "forecasts"
+    __table_args__ = (Index("ix_forecasts_coin_target_date", "coin", "target_date"),)
 
     id: int = Column(Integer, primary_key=True)
-    coin: str = Column(String, index=True)
+    coin: str = Column(String)
     target_date: dt.date = Column(DateTime)
     price_usd: float = Column(Numeric(precision=18, scale=8))
     created_at: dt.datetime = Column(DateTime, default=dt.datetime.utcnow)
@@ -92,5 +212,88 @@ class Forecast(Base):
         return f"<Forecast {self.coin} {self.target_date} {self.price_usd}>"
 
 
+class ForecastModel(Base):
+    """Сериализованная модель Prophet (prophet.serialize) для warm start."""
+
+    __tablename__ = "forecast_models"
+
+    coin: str = Column(String, primary_key=True)
+    model_json: str = Column(Text, nullable=False)
+    fitted_at: dt.datetime = Column(DateTime, nullable=False)
+    # Время последнего обучения с нуля
+    full_fit_at: dt.datetime = Column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"<ForecastModel {self.coin} {self.fitted_at}>"
+
+
+def insert_ignore(session, model, rows: Iterable[dict]) -> int:
+    """Массовая вставка с INSERT … ON CONFLICT DO NOTHING (SQLite / PostgreSQL).
+
+    Строки, нарушающие уникальные ограничения, молча пропускаются.
+    Возвращает число вставленных строк (если драйвер его сообщает)."""
+
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    result = session.connection().execute(insert(model).on_conflict_do_nothing(), rows)
+    return max(result.rowcount, 0)
+
+
 # Создаём таблицы при первом запуске
-Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+Base.metadata.create_all(bind=engine)
+
+# create_all не трогает существующие таблицы — новые колонки и индексы добавляем отдельно
+def _add_missing_columns() -> None:
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {col_type}'))
+
+
+# Раньше tx_hash был уникален сам по себе; снимаем это ограничение, а хэши без 0x
+# (HexBytes.hex() в web3 7) приводим к общему виду
+def _migrate_transactions_unique() -> None:
+    table = Transaction.__table__
+    legacy = [
+        uc for uc in inspect(engine).get_unique_constraints(table.name) if uc["column_names"] == ["tx_hash"]
+    ]
+    with engine.begin() as conn:
+        conn.execute(text(f"UPDATE {table.name} SET tx_hash = '0x' || tx_hash WHERE tx_hash NOT LIKE '0x%'"))
+        if not legacy:
+            return
+        if engine.dialect.name == "postgresql":
+            for uc in legacy:
+                conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT "{uc["name"]}"'))
+            return
+        # SQLite не умеет удалять ограничение колонки — пересоздаём таблицу
+        columns = ", ".join(f'"{c.name}"' for c in table.columns)
+        for index in inspect(engine).get_indexes(table.name):
+            conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+        conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}_legacy"))
+        table.create(bind=conn)
+        conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_legacy"))
+        conn.execute(text(f"DROP TABLE {table.name}_legacy"))
+
+
+_add_missing_columns()
+_migrate_transactions_unique()
+for _table in Base.metadata.sorted_tables:
+    for _index in _table.indexes:
+        _index.create(bind=engine, checkfirst=True)
+
+# Прежние одноколоночные индексы: их покрывает левый префикс составных, а держать их — лишняя запись
+_REDUNDANT_INDEXES = ("ix_prices_coin", "ix_transactions_user_id", "ix_forecasts_coin")
+with engine.begin() as _conn:
+    for _name in _REDUNDANT_INDEXES:
+        _conn.execute(text(f"DROP INDEX IF EXISTS {_name}")) 
\ No newline at end of file
@@ -1,87 +1,482 @@
 from __future__ import annotations
 
+import abc
 import datetime as dt
+import hashlib
 import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
 from typing import List
 
+import numpy as np
 import pandas as pd
 from prophet import Prophet
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+from prophet.serialize import model_from_json, model_to_json
+from sqlalchemy import select
 
-from db.models import SessionLocal, News, Price, Forecast
+from db.models import SessionLocal, News, Price, Forecast, ForecastModel, SentimentCache, insert_ignore
+from finance_ai import rollups
 
 logger = logging.getLogger(__name__)
 
 # -------- finBERT -------- #
 
-try:
-    _TOKENIZER = AutoTokenizer.from_pretrained("ProsusAI/finbert")
-    _MODEL = AutoModelForSequenceClassification.from_pretrained("ProsusAI/finbert")
-    _SENTIMENT_PIPE = pipeline("sentiment-analysis", model=_MODEL, tokenizer=_TOKENIZER)
-    logger.info("finBERT loaded")
-except Exception as exc:
-    logger.exception("Cannot load finBERT: %s", exc)
-    _SENTIMENT_PIPE = None  # type: ignore
+# Модель грузится лениво в фоновом потоке, чтобы импорт модуля (и старт бота)
+# не ждал torch и весов. Состояния: not_loaded → loading → ready | failed.
+FINBERT_MODEL = "ProsusAI/finbert"
+# Бэкенд инференса: torch (fp32), int8 (динамическая квантизация torch)
+# или onnx (экспорт в ONNX Runtime, нужен пакет optimum[onnxruntime])
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "torch")
+SENTIMENT_BACKENDS = ("torch", "int8", "onnx")
+# Куда сохраняется экспортированная ONNX-модель: экспорт (с загрузкой torch-весов) — только при первом запуске
+SENTIMENT_ONNX_DIR = os.getenv("SENTIMENT_ONNX_DIR", os.path.join("models", "finbert-onnx"))
+_SENTIMENT_PIPE = None
+_model_state = "not_loaded"
+_model_lock = threading.Lock()
+_model_ready = threading.Event()
 
 
-def analyze_unlabeled_news(session: SessionLocal) -> None:
-    """Проставляет сентимент тем новостям, у которых он ещё None."""
+def build_sentiment_pipeline(backend: str = SENTIMENT_BACKEND):
+    """Создаёт pipeline finBERT на выбранном бэкенде."""
 
-    if _SENTIMENT_PIPE is None:
-        return
+    if backend not in SENTIMENT_BACKENDS:
+        raise ValueError(f"Unknown sentiment backend {backend!r}, expected one of {SENTIMENT_BACKENDS}")
 
-    unlabeled = session.query(News).filter(News.sentiment.is_(None)).limit(20).all()
-    for news in unlabeled:
-        try:
-            result = _SENTIMENT_PIPE(news.title[:512])[0]
-            news.sentiment = result.get("label", "neutral").lower()
-        except Exception as exc:
-            logger.warning("Sentiment failed for %s: %s", news.url, exc)
-    if unlabeled:
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+
+    if backend == "onnx":
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+
+        if os.path.exists(os.path.join(SENTIMENT_ONNX_DIR, "model.onnx")):
+            model = ORTModelForSequenceClassification.from_pretrained(SENTIMENT_ONNX_DIR)
+            tokenizer = AutoTokenizer.from_pretrained(SENTIMENT_ONNX_DIR)
+        else:
+            model = ORTModelForSequenceClassification.from_pretrained(FINBERT_MODEL, export=True)
+            tokenizer = AutoTokenizer.from_pretrained(FINBERT_MODEL)
+            model.save_pretrained(SENTIMENT_ONNX_DIR)
+            tokenizer.save_pretrained(SENTIMENT_ONNX_DIR)
+            logger.info("finBERT экспортирован в ONNX: %s", SENTIMENT_ONNX_DIR)
+        return pipeline("sentiment-analysis", model=model, tokenizer=tokenizer)
+
+    tokenizer = AutoTokenizer.from_pretrained(FINBERT_MODEL)
+    model = AutoModelForSequenceClassification.from_pretrained(FINBERT_MODEL)
+    if backend == "int8":
+        import torch
+
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("sentiment-analysis", model=model, tokenizer=tokenizer)
+
+
+def _load_finbert() -> None:
+    global _SENTIMENT_PIPE, _model_state
+    try:
+        _SENTIMENT_PIPE = build_sentiment_pipeline()
+        _model_state = "ready"
+        logger.info("finBERT loaded (%s backend)", SENTIMENT_BACKEND)
+    except Exception as exc:
+        logger.exception("Cannot load finBERT: %s", exc)
+        _model_state = "failed"
+    finally:
+        _model_ready.set()
+
+
+def start_model_loading() -> None:
+    """Запускает загрузку finBERT в фоне. Повторные вызовы ничего не делают."""
+    global _model_state
+    with _model_lock:
+        if _model_state != "not_loaded":
+            return
+        _model_state = "loading"
+    threading.Thread(target=_load_finbert, name="finbert-loader", daemon=True).start()
+
+
+def sentiment_model_state() -> str:
+    """Текущее состояние finBERT: not_loaded / loading / ready / failed."""
+    return _model_state
+
+
+def wait_for_sentiment_model(timeout: float | None = None) -> bool:
+    """Блокирует до окончания загрузки (для скриптов и тестов). True — модель готова."""
+    start_model_loading()
+    _model_ready.wait(timeout)
+    return _model_state == "ready"
+
+
+# Размер батча для finBERT, сколько строк берём из БД за раз
+# и сколько секунд один прогон может разбирать очередь
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "32"))
+SENTIMENT_FETCH_SIZE = int(os.getenv("SENTIMENT_FETCH_SIZE", "512"))
+SENTIMENT_TIME_BUDGET = float(os.getenv("SENTIMENT_TIME_BUDGET", "300"))
+# Метка новости, которую модель не смогла разобрать даже по одной: так она уходит из очереди
+SENTIMENT_FAILED = "unknown"
+
+
+def title_hash(title: str) -> str:
+    """SHA-256 нормализованного заголовка: регистр, пунктуация и пробелы не важны."""
+    normalized = re.sub(r"[\W_]+", " ", title.lower()).strip()
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def analyze_unlabeled_news(
+    session: SessionLocal,
+    batch_size: int = SENTIMENT_BATCH_SIZE,
+    time_budget: float = SENTIMENT_TIME_BUDGET,
+) -> int:
+    """Проставляет сентимент новостям, у которых он ещё None.
+
+    Разбирает очередь батчами, пока она не опустеет или не выйдет time_budget.
+    Одинаковые (после нормализации) заголовки берутся из таблицы sentiment_cache
+    и прогоняются через модель один раз. Заголовки сортируются по длине, чтобы
+    в батч попадали близкие по длине строки и паддинг был минимальным. При ошибке
+    инференса (например, нехватке памяти) размер батча уменьшается вдвое; заголовок,
+    на котором падает и батч из одной строки, получает метку SENTIMENT_FAILED,
+    после чего размер батча возвращается к исходному.
+    Возвращает число размеченных новостей."""
+
+    if _model_state != "ready":
+        start_model_loading()
+        logger.debug("finBERT ещё не готов (%s), разметка пропущена", _model_state)
+        return 0
+
+    deadline = time.monotonic() + time_budget
+    size = batch_size
+    labeled = 0
+
+    while time.monotonic() < deadline:
+        pending = (
+            session.query(News).filter(News.sentiment.is_(None)).order_by(News.id).limit(SENTIMENT_FETCH_SIZE).all()
+        )
+        if not pending:
+            break
+
+        groups: dict[str, list[News]] = {}
+        for news in pending:
+            groups.setdefault(title_hash(news.title or ""), []).append(news)
+
+        cached = session.query(SentimentCache).filter(SentimentCache.title_hash.in_(groups))
+        for hit in cached:
+            for news in groups.pop(hit.title_hash):
+                news.sentiment, news.sentiment_score = hit.label, hit.score
+                labeled += 1
+
+        todo = sorted(groups, key=lambda h: len(groups[h][0].title or ""))
+        new_cache: list[dict] = []
+        start = 0
+        while start < len(todo) and time.monotonic() < deadline:
+            batch = todo[start : start + size]
+            try:
+                results = _SENTIMENT_PIPE(
+                    [(groups[h][0].title or "")[:512] for h in batch], batch_size=len(batch), truncation=True
+                )
+            except Exception as exc:
+                if size > 1:
+                    size //= 2
+                    logger.warning("Sentiment batch failed (%s), batch_size -> %d", exc, size)
+                    continue
+                logger.warning("Sentiment failed for %s: %s", groups[batch[0]][0].url, exc)
+                for news in groups[batch[0]]:
+                    news.sentiment, news.sentiment_score = SENTIMENT_FAILED, None
+                start += 1
+                size = batch_size  # плохая строка найдена — остальные снова полными батчами
+                continue
+
+            for h, result in zip(batch, results):
+                label, score = result.get("label", "neutral").lower(), float(result.get("score", 0.0))
+                new_cache.append({"title_hash": h, "label": label, "score": score})
+                for news in groups[h]:
+                    news.sentiment, news.sentiment_score = label, score
+                    labeled += 1
+            start += len(batch)
+
+        insert_ignore(session, SentimentCache, new_cache)
         session.commit()
-        logger.info("Sentiment updated for %d news items", len(unlabeled))
+
+    if labeled:
+        logger.info("Sentiment updated for %d news items", labeled)
+    return labeled
 
 
 # -------- Prophet Forecast -------- #
 
 LOOKBACK_DAYS = 90
 FORECAST_DAYS = 7
+# Сколько монет обучаем параллельно (по умолчанию — по числу ядер)
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", str(os.cpu_count() or 1)))
+MIN_POINTS = 30
+# Шаг баров, к которому приводим историю перед обучением (pandas offset, "" — без ресемплинга)
+FORECAST_BAR = os.getenv("FORECAST_BAR", "1h")
+# Полное переобучение не реже раза в FORECAST_FULL_REFIT_HOURS, в остальное время —
+# warm start от прошлой модели, если её ошибка на новых ценах не выше FORECAST_DRIFT_MAPE
+FORECAST_FULL_REFIT_HOURS = float(os.getenv("FORECAST_FULL_REFIT_HOURS", "24"))
+FORECAST_DRIFT_MAPE = float(os.getenv("FORECAST_DRIFT_MAPE", "0.05"))
+# Движок прогнозов: prophet (по монете, warm start) или linear (все монеты одной матрицей)
+FORECAST_ENGINE = os.getenv("FORECAST_ENGINE", "prophet")
+# Окно, на котором linear оценивает тренд: короче LOOKBACK_DAYS, чтобы тренд был локальным
+FORECAST_LINEAR_WINDOW_DAYS = int(os.getenv("FORECAST_LINEAR_WINDOW_DAYS", "30"))
+# Сезонности linear: (период в часах, число гармоник Фурье) — суточная и недельная
+LINEAR_SEASONALITIES = ((24.0, 3), (168.0, 2))
 
 
-def build_forecast(session: SessionLocal, coin: str) -> None:
-    """Строит прогноз на FORECAST_DAYS для coin и записывает в БД."""
+def _load_series(session: SessionLocal, coin: str, bar: str = FORECAST_BAR) -> tuple[np.ndarray, np.ndarray]:
+    """История цен coin за LOOKBACK_DAYS как пара массивов (ds: datetime64[ns], y: float64).
+
+    Колонки читаются прямо в pandas без ORM-объектов. Если шаг bar собирается из готовых
+    баров (1m/1h/1d, см. finance_ai.rollups), читаются цены закрытия этих баров, иначе —
+    сырые цены (они хранятся только PRICE_RAW_RETENTION_DAYS). Затем ряд сворачивается
+    в бары шага bar (цена закрытия бара)."""
 
-    # собираем исторические данные
     since = dt.datetime.utcnow() - dt.timedelta(days=LOOKBACK_DAYS)
-    prices = (
-        session.query(Price)
-        .filter(Price.coin == coin, Price.timestamp >= since)
-        .order_by(Price.timestamp)
-        .all()
-    )
-    if len(prices) < 30:  # мало данных
-        logger.info("Недостаточно цен для прогноза %s", coin)
-        return
+    res = rollups.resolution_for(pd.Timedelta(bar).to_pytimedelta()) if bar else None
+    if res is None:
+        query = (
+            select(Price.timestamp.label("ds"), Price.price_usd.label("y"))
+            .where(Price.coin == coin, Price.timestamp >= since)
+            .order_by(Price.timestamp)
+        )
+    else:
+        model = res.model
+        query = (
+            select(model.start.label("ds"), model.close.label("y"))
+            .where(model.coin == coin, model.start >= res.floor(since))
+            .order_by(model.start)
+        )
+    df = pd.read_sql_query(query, session.connection(), parse_dates=["ds"])
+    series = df.set_index("ds")["y"].astype(np.float64)
+    if bar and not series.empty:
+        series = series.resample(bar).last().dropna()
+    return series.index.values.astype("datetime64[ns]"), series.to_numpy()
+
+
+@dataclass
+class FitResult:
+    rows: list[tuple[dt.date, float]]  # [(дата, yhat), ...]
+    model_json: str | None  # None — движок не хранит модель между запусками
+    warm: bool  # True — дообучение от параметров прошлой модели
+
+
+def _new_prophet() -> Prophet:
+    # Используем только yhat, интервалы не нужны — без сэмплирования predict в разы дешевле
+    return Prophet(daily_seasonality=True, uncertainty_samples=0)
+
 
-    df = pd.DataFrame({"ds": [p.timestamp for p in prices], "y": [float(p.price_usd) for p in prices]})
+def _stan_init(model: Prophet) -> dict:
+    """Параметры обученной модели как начальная точка для следующего fit."""
+    init = {name: model.params[name][0][0] for name in ("k", "m", "sigma_obs")}
+    init.update({name: model.params[name][0] for name in ("delta", "beta")})
+    return init
 
-    model = Prophet(daily_seasonality=True)
-    model.fit(df)
+
+def _drifted(prev: Prophet, ds: np.ndarray, y: np.ndarray) -> bool:
+    """Сравнивает прогноз прошлой модели с ценами, пришедшими после её обучения."""
+    fresh = ds > prev.history["ds"].max().to_datetime64()
+    if not fresh.any():
+        return False
+    predicted = prev.predict(pd.DataFrame({"ds": ds[fresh]}))["yhat"].to_numpy()
+    mape = float(np.mean(np.abs(predicted - y[fresh]) / np.abs(y[fresh])))
+    return mape > FORECAST_DRIFT_MAPE
+
+
+def _fit_forecast(ds: np.ndarray, y: np.ndarray, prev_json: str | None = None) -> FitResult:
+    """Обучает Prophet и возвращает прогноз на FORECAST_DAYS вперёд и сериализованную модель.
+
+    Если передана прошлая модель и дрейфа нет, fit стартует с её параметров.
+    Работает только с массивами и строками, поэтому может выполняться в отдельном процессе."""
+
+    df = pd.DataFrame({"ds": ds, "y": y})
+    model, warm = None, False
+    if prev_json:
+        try:
+            prev = model_from_json(prev_json)
+            if not _drifted(prev, ds, y):
+                model = _new_prophet()
+                model.fit(df, init=_stan_init(prev))
+                warm = True
+        except Exception as exc:
+            logger.warning("Warm start failed, full refit: %s", exc)
+            model, warm = None, False
+    if model is None:
+        model = _new_prophet()
+        model.fit(df)
 
     future = model.make_future_dataframe(periods=FORECAST_DAYS)
-    forecast = model.predict(future)
-    future_rows = forecast.tail(FORECAST_DAYS)
-
-    # чистим старые прогнозы, добавляем новые
-    session.query(Forecast).filter(Forecast.coin == coin).delete()
-
-    for _, row in future_rows.iterrows():
-        session.add(
-            Forecast(
-                coin=coin,
-                target_date=row["ds"].date(),
-                price_usd=float(row["yhat"]),
-            )
-        )
+    forecast = model.predict(future).tail(FORECAST_DAYS)
+    rows = [(ts.date(), float(yhat)) for ts, yhat in zip(forecast["ds"], forecast["yhat"])]
+    return FitResult(rows=rows, model_json=model_to_json(model), warm=warm)
+
+
+def _previous_model(session: SessionLocal, coin: str) -> str | None:
+    """Сохранённая модель coin, если её полный fit был не раньше FORECAST_FULL_REFIT_HOURS назад."""
+    stored = session.get(ForecastModel, coin)
+    if stored is None:
+        return None
+    if dt.datetime.utcnow() - stored.full_fit_at > dt.timedelta(hours=FORECAST_FULL_REFIT_HOURS):
+        return None
+    return stored.model_json
+
+
+def _store_forecasts(session: SessionLocal, results: dict[str, FitResult]) -> None:
+    """Заменяет прогнозы и модели всех монет из results одной транзакцией."""
+
+    now = dt.datetime.utcnow()
+    for coin, result in results.items():
+        session.query(Forecast).filter(Forecast.coin == coin).delete()
+        session.add_all(Forecast(coin=coin, target_date=day, price_usd=yhat) for day, yhat in result.rows)
+        if result.model_json is None:
+            continue
+
+        stored = session.get(ForecastModel, coin) or ForecastModel(coin=coin)
+        stored.model_json = result.model_json
+        stored.fitted_at = now
+        if not result.warm or stored.full_fit_at is None:
+            stored.full_fit_at = now
+        session.add(stored)
     session.commit()
-    logger.info("Forecast updated for %s", coin) 
\ No newline at end of file
+
+
+def _fourier_features(hours: np.ndarray, origin: float) -> np.ndarray:
+    """Матрица признаков linear: константа, тренд (в днях от origin) и гармоники сезонностей.
+
+    hours — время в часах от эпохи, так что фаза гармоник привязана к часу суток и дню недели."""
+
+    columns = [np.ones_like(hours), (hours - origin) / 24]
+    for period, order in LINEAR_SEASONALITIES:
+        angle = 2 * np.pi * hours[:, None] * np.arange(1, order + 1) / period
+        columns.extend(np.sin(angle).T)
+        columns.extend(np.cos(angle).T)
+    return np.column_stack(columns)
+
+
+def _hours(ds: np.ndarray) -> np.ndarray:
+    return ds.astype("datetime64[s]").astype(np.float64) / 3600
+
+
+class Forecaster(abc.ABC):
+    """Движок прогнозов: по рядам цен монет строит прогноз на FORECAST_DAYS вперёд.
+
+    Получает только массивы (ds, y) и JSON прошлых моделей, с БД не работает."""
+
+    name = ""
+    uses_models = False  # нужны ли модели прошлого запуска (previous в fit_predict)
+
+    def __init__(self, workers: int = FORECAST_WORKERS):
+        self.workers = workers
+
+    @abc.abstractmethod
+    def fit_predict(
+        self,
+        series: dict[str, tuple[np.ndarray, np.ndarray]],
+        previous: dict[str, str | None] | None = None,
+    ) -> dict[str, FitResult]:
+        """{coin: FitResult} по рядам series; previous — JSON моделей прошлого запуска."""
+
+
+class ProphetForecaster(Forecaster):
+    """Prophet по каждой монете отдельно, в пуле из workers процессов, с warm start."""
+
+    name = "prophet"
+    uses_models = True
+
+    def fit_predict(self, series, previous=None):
+        previous = previous or {}
+        results: dict[str, FitResult] = {}
+        workers = max(1, min(self.workers, len(series)))
+        if workers == 1:
+            for coin, (ds, y) in series.items():
+                try:
+                    results[coin] = _fit_forecast(ds, y, previous.get(coin))
+                except Exception as exc:
+                    logger.exception("Forecast failed for %s: %s", coin, exc)
+            return results
+
+        # forkserver: fork из многопоточного процесса бота может унаследовать захваченную
+        # блокировку (например, logging) и повиснуть; воркерам нужны только массивы и строки
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+            futures = {
+                pool.submit(_fit_forecast, ds, y, previous.get(coin)): coin for coin, (ds, y) in series.items()
+            }
+            for future in as_completed(futures):
+                coin = futures[future]
+                try:
+                    results[coin] = future.result()
+                except Exception as exc:
+                    logger.exception("Forecast failed for %s: %s", coin, exc)
+        return results
+
+
+class LinearForecaster(Forecaster):
+    """Линейный тренд + суточная и недельная сезонность в логарифме цены.
+
+    Ряды всех монет выравниваются на общую сетку баров в матрицу (бары × монеты)
+    и решаются одним вызовом np.linalg.lstsq — матрица признаков у всех монет общая."""
+
+    name = "linear"
+
+    def fit_predict(self, series, previous=None):
+        bar = FORECAST_BAR or "1h"
+        frame = pd.concat(
+            {coin: pd.Series(y, index=pd.DatetimeIndex(ds)) for coin, (ds, y) in series.items()}, axis=1
+        ).sort_index()
+        frame = frame.resample(bar).last()
+        frame = frame[frame.index > frame.index[-1] - pd.Timedelta(days=FORECAST_LINEAR_WINDOW_DAYS)]
+        frame = frame.dropna(axis=1, how="all").ffill().bfill()
+        for coin in series.keys() - set(frame.columns):
+            logger.info("Нет цен %s в окне linear-прогноза", coin)
+
+        hours = _hours(frame.index.values)
+        origin = hours[-1]
+        X = _fourier_features(hours, origin)
+        beta, *_ = np.linalg.lstsq(X, np.log(frame.to_numpy()), rcond=None)
+
+        last = frame.index[-1]
+        future = pd.DatetimeIndex([last + pd.Timedelta(days=d) for d in range(1, FORECAST_DAYS + 1)])
+        yhat = np.exp(_fourier_features(_hours(future.values), origin) @ beta)  # (дни × монеты)
+
+        days = [ts.date() for ts in future]
+        return {
+            coin: FitResult(rows=list(zip(days, map(float, yhat[:, i]))), model_json=None, warm=False)
+            for i, coin in enumerate(frame.columns)
+        }
+
+
+FORECASTERS = {cls.name: cls for cls in (ProphetForecaster, LinearForecaster)}
+
+
+def get_forecaster(engine: str = FORECAST_ENGINE, workers: int = FORECAST_WORKERS) -> Forecaster:
+    if engine not in FORECASTERS:
+        raise ValueError(f"Unknown forecast engine {engine!r}, expected one of {tuple(FORECASTERS)}")
+    return FORECASTERS[engine](workers=workers)
+
+
+def build_forecast(session: SessionLocal, coin: str, engine: str = FORECAST_ENGINE) -> None:
+    """Строит прогноз на FORECAST_DAYS для coin и записывает в БД."""
+
+    build_forecasts(session, [coin], workers=1, engine=engine)
+
+
+def build_forecasts(
+    session: SessionLocal,
+    coins: List[str],
+    workers: int = FORECAST_WORKERS,
+    engine: str = FORECAST_ENGINE,
+) -> None:
+    """Строит прогнозы для нескольких монет выбранным движком и пишет их одной транзакцией."""
+
+    forecaster = get_forecaster(engine, workers)
+    series = {coin: _load_series(session, coin) for coin in coins}
+    for coin in [c for c, (_, y) in series.items() if len(y) < MIN_POINTS]:
+        logger.info("Недостаточно цен для прогноза %s", coin)
+        del series[coin]
+    if not series:
+        return
+
+    previous = {coin: _previous_model(session, coin) for coin in series} if forecaster.uses_models else None
+    results = forecaster.fit_predict(series, previous)
+
+    _store_forecasts(session, results)
+    warm = sum(r.warm for r in results.values())
+    logger.info("Forecast (%s) updated for %d coins (%d warm-started)", forecaster.name, len(results), warm)
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Iterable, List
+from urllib.parse import quote, urlencode
+
+import http_client
+
+logger = logging.getLogger(__name__)
+
+COINGECKO_BASE_URL = os.getenv("COINGECKO_BASE_URL", "https://api.coingecko.com/api/v3")
+# Бесплатный тариф: ~10–30 запросов в минуту. Bucket пропускает COINGECKO_RATE_PER_MIN
+# в минуту и всплеск до COINGECKO_BURST подряд, т.е. не больше RATE + BURST за любую минуту.
+COINGECKO_RATE_PER_MIN = float(os.getenv("COINGECKO_RATE_PER_MIN", "10"))
+COINGECKO_BURST = int(os.getenv("COINGECKO_BURST", "2"))
+# Сколько раз повторяем запрос после 429/5xx (все вызовы ждут паузу вместе)
+COINGECKO_RETRIES = int(os.getenv("COINGECKO_RETRIES", "4"))
+# Максимальная длина URL simple/price: монеты делятся на несколько запросов
+COINGECKO_MAX_URL = int(os.getenv("COINGECKO_MAX_URL", "2000"))
+# Время жизни ответов в кэше (с): цены короче интервала prices_job, графики дольше
+COINGECKO_PRICE_TTL = float(os.getenv("COINGECKO_PRICE_TTL", "30"))
+COINGECKO_CHART_TTL = float(os.getenv("COINGECKO_CHART_TTL", "300"))
+
+SIMPLE_PRICE_PATH = "/simple/price"
+# Тот же график, что market_chart, но за произвольный интервал (from/to в unix-секундах)
+CHART_RANGE_PATH = "/coins/{coin}/market_chart/range"
+
+# Счётчики для оценки: запросов к API, ответов из кэша, присоединившихся к чужому запросу, 429/5xx
+stats = {"requests": 0, "cache_hits": 0, "coalesced": 0, "throttled": 0}
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate токенов в секунду, не больше capacity в запасе.
+
+    pause() обнуляет запас и задерживает всех ожидающих — так 429 замедляет
+    сразу все задачи, а не только ту, что его получила."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Берёт токен, при необходимости ожидая. Возвращает время ожидания (с)."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+_bucket = TokenBucket(COINGECKO_RATE_PER_MIN / 60, COINGECKO_BURST)
+# Кэш ответов {ключ: (истекает, данные)} и запросы в полёте {ключ: Future}
+_cache: dict[tuple, tuple[float, Any]] = {}
+_inflight: dict[tuple, Future] = {}
+_cache_lock = threading.Lock()
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def _request(path: str, params: dict) -> Any:
+    """GET к CoinGecko через общий bucket; 429/5xx ставят на паузу все запросы."""
+
+    for attempt in range(COINGECKO_RETRIES + 1):
+        _bucket.acquire()
+        stats["requests"] += 1
+        resp = http_client.get(COINGECKO_BASE_URL + path, params=params, timeout=30, retry=False)
+        if resp.status_code in http_client.RETRY_STATUSES and attempt < COINGECKO_RETRIES:
+            delay = http_client.retry_delay(attempt, resp.headers.get("Retry-After"))
+            stats["throttled"] += 1
+            logger.warning("CoinGecko %s: HTTP %d, пауза %.1f c", path, resp.status_code, delay)
+            _bucket.pause(delay)
+            continue
+        resp.raise_for_status()
+        return resp.json()
+    raise AssertionError("unreachable")
+
+
+def _cached_get(path: str, params: dict, ttl: float) -> Any:
+    """Ответ из кэша, из уже идущего такого же запроса или новым запросом."""
+
+    key = (path, tuple(sorted(params.items())))
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] > time.monotonic():
+            stats["cache_hits"] += 1
+            return hit[1]
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+        else:
+            stats["coalesced"] += 1
+    if not owner:
+        return future.result()
+
+    try:
+        data = _request(path, params)
+    except BaseException as exc:
+        with _cache_lock:
+            del _inflight[key]
+        future.set_exception(exc)
+        raise
+    with _cache_lock:
+        now = time.monotonic()
+        for stale in [k for k, (expires, _) in _cache.items() if expires <= now]:
+            del _cache[stale]
+        _cache[key] = (now + ttl, data)
+        del _inflight[key]
+    future.set_result(data)
+    return data
+
+
+def _id_groups(coins: Iterable[str], vs_currency: str) -> List[List[str]]:
+    """Делит монеты на группы, чтобы URL simple/price не превышал COINGECKO_MAX_URL."""
+
+    base = len(COINGECKO_BASE_URL + SIMPLE_PRICE_PATH + "?ids=&" + urlencode({"vs_currencies": vs_currency}))
+    groups: list[list[str]] = []
+    size = base
+    for coin in coins:
+        length = len(quote(coin, safe="")) + 3  # запятая кодируется как %2C
+        if groups and size + length <= COINGECKO_MAX_URL:
+            groups[-1].append(coin)
+            size += length
+        else:
+            groups.append([coin])
+            size = base + length
+    return groups
+
+
+def simple_prices(coins: Iterable[str], vs_currency: str = "usd") -> dict[str, dict]:
+    """Текущие цены монет как в ответе simple/price: {coin: {vs_currency: price}}.
+
+    Все монеты без свежего кэша запрашиваются вместе — одним вызовом на группу,
+    ограниченную длиной URL. Монеты, которых CoinGecko не знает, в ответ не попадают."""
+
+    coins = sorted(set(coins))
+    result: dict[str, dict] = {}
+    missing = []
+    with _cache_lock:
+        now = time.monotonic()
+        for coin in coins:
+            hit = _cache.get(("price", coin, vs_currency))
+            if hit is not None and hit[0] > now:
+                result[coin] = hit[1]
+                stats["cache_hits"] += 1
+            else:
+                missing.append(coin)
+
+    for group in _id_groups(missing, vs_currency):
+        params = {"ids": ",".join(group), "vs_currencies": vs_currency}
+        data = _cached_get(SIMPLE_PRICE_PATH, params, COINGECKO_PRICE_TTL)
+        with _cache_lock:
+            expires = time.monotonic() + COINGECKO_PRICE_TTL
+            for coin in group:
+                if coin in data:
+                    result[coin] = data[coin]
+                    _cache[("price", coin, vs_currency)] = (expires, data[coin])
+    return result
+
+
+def market_chart_range(coin: str, start: int, end: int, vs_currency: str = "usd") -> List[list]:
+    """Точки [[ts_ms, price], ...] монеты за [start, end] (unix-секунды).
+
+    Границы округляются вниз до минуты, чтобы пересекающиеся задачи попадали в один ключ кэша."""
+
+    params = {"vs_currency": vs_currency, "from": start - start % 60, "to": end - end % 60}
+    data = _cached_get(CHART_RANGE_PATH.format(coin=coin), params, COINGECKO_CHART_TTL)
+    return data.get("prices", [])
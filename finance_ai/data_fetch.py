@@ -2,25 +2,56 @@ from __future__ import annotations
 
 import datetime as dt
 import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
+from urllib.parse import urlsplit
 
-import requests
 import feedparser
+from bs4 import BeautifulSoup
+from sqlalchemy import func
 
-from db.models import Price, News, SessionLocal
+import http_client
+from db.models import Price, PriceBar1h, News, SessionLocal, insert_ignore
+from finance_ai import coingecko
+from finance_ai.translation import translate_texts
 
 logger = logging.getLogger(__name__)
 
-# CoinGecko simple price endpoint
-COINGECKO_API = "https://api.coingecko.com/api/v3/simple/price"
 # Список монет CoinGecko IDs, которые отслеживаем
 TRACKED_COINS = ["bitcoin", "ethereum"]
 
 # RSS лента новостей (Cointelegraph)
 NEWS_FEED_URL = "https://cointelegraph.com/rss"
+# Все опрашиваемые ленты (через запятую в NEWS_FEED_URLS)
+DEFAULT_NEWS_FEEDS = [
+    NEWS_FEED_URL,
+    "https://www.coindesk.com/arc/outboundfeeds/rss/",
+    "https://decrypt.co/feed",
+    "https://bitcoinmagazine.com/.rss/full/",
+    "https://cryptoslate.com/feed/",
+]
+NEWS_FEED_URLS = [u.strip() for u in os.getenv("NEWS_FEED_URLS", ",".join(DEFAULT_NEWS_FEEDS)).split(",") if u.strip()]
+# Таймаут на ленту, общее число потоков и параллельных запросов к одному хосту
+FEED_TIMEOUT = float(os.getenv("FEED_TIMEOUT", "10"))
+FEED_WORKERS = int(os.getenv("FEED_WORKERS", "16"))
+FEED_PER_HOST = int(os.getenv("FEED_PER_HOST", "2"))
+# ETag / Last-Modified последнего ответа каждой ленты — для условного GET
+_feed_validators: dict[str, tuple[str | None, str | None]] = {}
 
-# Endpoint для исторических данных (цены за N дней, шаг ~час)
-COINGECKO_CHART = "https://api.coingecko.com/api/v3/coins/{coin}/market_chart"
+# Обогащение новостей: статей за прогон, параллельных загрузок страниц и длина сниппета
+NEWS_ENRICH_BATCH = int(os.getenv("NEWS_ENRICH_BATCH", "30"))
+NEWS_ENRICH_WORKERS = int(os.getenv("NEWS_ENRICH_WORKERS", "4"))
+NEWS_SNIPPET_CHARS = 400
+ARTICLE_TIMEOUT = float(os.getenv("ARTICLE_TIMEOUT", "10"))
+ARTICLE_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+}
+
+# Пропуски короче двух шагов почасового графика не докачиваем
+BACKFILL_MIN_GAP = dt.timedelta(hours=2)
 
 
 def update_prices(session: SessionLocal, coins: List[str] | None = None) -> None:
@@ -28,13 +59,8 @@ def update_prices(session: SessionLocal, coins: List[str] | None = None) -> None
 
     symbols = coins or TRACKED_COINS
     try:
-        response = requests.get(
-            COINGECKO_API,
-            params={"ids": ",".join(symbols), "vs_currencies": "usd"},
-            timeout=30,
-        )
-        response.raise_for_status()
-        data = response.json()
+        # Один запрос simple/price на все монеты (с учётом лимита CoinGecko и кэша)
+        data = coingecko.simple_prices(symbols)
 
         now = dt.datetime.utcnow()
         for coin in symbols:
@@ -48,61 +74,222 @@ def update_prices(session: SessionLocal, coins: List[str] | None = None) -> None
         logger.exception("Не удалось получить цены: %s", exc)
 
 
-def update_news(session: SessionLocal, feed_url: str = NEWS_FEED_URL) -> None:
-    """Парсит RSS-ленту, сохраняет новые статьи."""
+def _fetch_feed(feed_url: str, host_limit: threading.Semaphore):
+    """Скачивает ленту условным GET. Возвращает (entries, validators) или None, если не изменилась."""
 
-    try:
-        parsed = feedparser.parse(feed_url)
-        new_count = 0
-        for entry in parsed.entries:
-            url = entry.link
-            # Существуют ли уже
-            exists = session.query(News).filter(News.url == url).first()
-            if exists:
+    etag, modified = _feed_validators.get(feed_url, (None, None))
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+
+    with host_limit:
+        # без повторов: ленту всё равно перечитаем следующим прогоном, а повторы одной
+        # недоступной ленты задержали бы запись всех остальных
+        resp = http_client.get(feed_url, headers=headers, timeout=FEED_TIMEOUT, retry=False)
+    if resp.status_code == 304:
+        return None
+    resp.raise_for_status()
+
+    parsed = feedparser.parse(resp.content)
+    return parsed.entries, (resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+
+
+def update_news(session: SessionLocal, feed_urls: List[str] | str | None = None) -> None:
+    """Параллельно опрашивает RSS-ленты и сохраняет новые статьи одной пачкой.
+
+    Запросы к одному хосту ограничены FEED_PER_HOST, у каждой ленты свой таймаут,
+    так что медленная лента не задерживает остальные дольше FEED_TIMEOUT."""
+
+    feeds = [feed_urls] if isinstance(feed_urls, str) else (feed_urls or NEWS_FEED_URLS)
+    if not feeds:
+        return
+    host_limits = {urlsplit(url).netloc: threading.BoundedSemaphore(FEED_PER_HOST) for url in feeds}
+
+    entries: list = []
+    validators: dict[str, tuple[str | None, str | None]] = {}
+    with ThreadPoolExecutor(max_workers=min(FEED_WORKERS, len(feeds)), thread_name_prefix="feed") as pool:
+        futures = {pool.submit(_fetch_feed, url, host_limits[urlsplit(url).netloc]): url for url in feeds}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                logger.warning("Не удалось получить ленту %s: %s", url, exc)
+                continue
+            if result is None:
+                logger.debug("Лента %s не изменилась", url)
                 continue
-            published = dt.datetime(*entry.published_parsed[:6]) if entry.get("published_parsed") else dt.datetime.utcnow()
-            news_item = News(
-                title=entry.title,
-                url=url,
-                published_at=published,
-                summary=entry.get("summary", ""),
-            )
-            session.add(news_item)
-            new_count += 1
+            entries.extend(result[0])
+            validators[url] = result[1]
+
+    try:
+        new_count = save_news_entries(session, entries)
+        # Валидаторы запоминаем только после успешной записи, иначе 304 скроет пропущенные статьи
+        _feed_validators.update(validators)
         if new_count:
-            session.commit()
             logger.info("Добавлено %d новостных записей", new_count)
     except Exception as exc:
         logger.exception("Ошибка обновления новостей: %s", exc)
 
 
+def _missing_ranges(
+    session: SessionLocal, coin: str, since: dt.datetime, now: dt.datetime
+) -> List[tuple[dt.datetime, dt.datetime]]:
+    """Интервалы внутри [since, now], которых нет в БД: до самой старой и после самой новой точки.
+
+    Старые сырые цены удаляет компактизация, поэтому учитываются и часовые бары."""
+
+    raw = (
+        session.query(func.min(Price.timestamp), func.max(Price.timestamp))
+        .filter(Price.coin == coin, Price.timestamp >= since)
+        .one()
+    )
+    bars = (
+        session.query(func.min(PriceBar1h.opened_at), func.max(PriceBar1h.closed_at))
+        .filter(PriceBar1h.coin == coin, PriceBar1h.closed_at >= since)
+        .one()
+    )
+    known = [ts for ts in (*raw, *bars) if ts is not None]
+    if not known:
+        return [(since, now)]
+    oldest, newest = min(known), max(known)
+
+    gaps = [(since, oldest), (newest, now)]
+    return [(start, end) for start, end in gaps if end - start >= BACKFILL_MIN_GAP]
+
+
+def _unix(ts: dt.datetime) -> int:
+    return int(ts.replace(tzinfo=dt.timezone.utc).timestamp())
+
+
+def save_news_entries(session: SessionLocal, entries: List[dict]) -> int:
+    """Сохраняет новые записи RSS: один SELECT … IN по ссылкам и INSERT … ON CONFLICT DO NOTHING."""
+
+    entries = [e for e in entries if e.get("link")]
+    if not entries:
+        return 0
+
+    known = {url for (url,) in session.query(News.url).filter(News.url.in_({e.link for e in entries}))}
+    rows = []
+    for entry in entries:
+        if entry.link in known:
+            continue
+        known.add(entry.link)  # одна и та же ссылка может встретиться в нескольких лентах
+        published = dt.datetime(*entry.published_parsed[:6]) if entry.get("published_parsed") else dt.datetime.utcnow()
+        rows.append(
+            {
+                "title": entry.title,
+                "url": entry.link,
+                "published_at": published,
+                "summary": entry.get("summary", ""),
+            }
+        )
+
+    new_count = insert_ignore(session, News, rows)
+    session.commit()
+    return new_count
+
+
 def backfill_prices(session: SessionLocal, coin: str, days: int = 90) -> None:
-    """Скачивает историю цен за *days* и добивает недостающие точки в таблицу."""
+    """Добивает в таблицу историю цен за *days*, скачивая только недостающие интервалы."""
 
     try:
-        resp = requests.get(
-            COINGECKO_CHART.format(coin=coin),
-            params={"vs_currency": "usd", "days": days},
-            timeout=30,
-        )
-        resp.raise_for_status()
-        entries = resp.json().get("prices", [])  # [[ts_ms, price], ...]
+        now = dt.datetime.utcnow()
+        gaps = _missing_ranges(session, coin, now - dt.timedelta(days=days), now)
+        if not gaps:
+            logger.info("History for %s is up to date, backfill skipped", coin)
+            return
 
         added = 0
-        for ts_ms, price in entries:
-            ts = dt.datetime.utcfromtimestamp(ts_ms / 1000)
-            exists = (
-                session.query(Price)
-                .filter(Price.coin == coin, Price.timestamp == ts)
-                .first()
-            )
-            if exists:
-                continue
-            session.add(Price(coin=coin, price_usd=float(price), timestamp=ts))
-            added += 1
-
-        if added:
-            session.commit()
+        for start, end in gaps:
+            entries = coingecko.market_chart_range(coin, _unix(start), _unix(end))  # [[ts_ms, price], ...]
+            added += save_price_points(session, coin, entries)
         logger.info("Backfilled %d rows for %s", added, coin)
     except Exception as exc:
-        logger.exception("Backfill error for %s: %s", coin, exc) 
\ No newline at end of file
+        logger.exception("Backfill error for %s: %s", coin, exc) 
+
+
+def save_price_points(session: SessionLocal, coin: str, entries: List[list]) -> int:
+    """Сохраняет точки [[ts_ms, price], ...] одним INSERT … ON CONFLICT DO NOTHING.
+
+    Уже существующие (coin, timestamp) пропускаются. Возвращает число новых строк."""
+
+    rows = [
+        {"coin": coin, "price_usd": float(price), "timestamp": dt.datetime.utcfromtimestamp(ts_ms / 1000)}
+        for ts_ms, price in entries
+    ]
+    added = insert_ignore(session, Price, rows)
+    session.commit()
+    return added
+
+
+def extract_article(url: str, summary_en: str | None = None, max_chars: int = NEWS_SNIPPET_CHARS) -> tuple[str, str]:
+    """Скачивает статью и возвращает (title_en, snippet_en).
+
+    Если страница недоступна или в ней нет абзацев, сниппетом служит summary из ленты."""
+
+    try:
+        # без повторов: при промахе кэша /news ждёт этот запрос
+        resp = http_client.get(url, headers=ARTICLE_HEADERS, timeout=ARTICLE_TIMEOUT, retry=False)
+        resp.raise_for_status()
+        soup = BeautifulSoup(resp.text, "html.parser")
+        title_en = soup.title.string.strip() if soup.title and soup.title.string else ""
+        paragraphs = [p.get_text(" ", strip=True) for p in soup.find_all("p")]
+        return title_en, (" ".join(paragraphs) or (summary_en or ""))[:max_chars]
+    except Exception as exc:
+        logger.warning("Не удалось загрузить статью %s: %s", url, exc)
+        return "", (summary_en or "")[:max_chars]
+
+
+def enrich_article(url: str, title_en: str | None = None, summary_en: str | None = None) -> tuple[str, str]:
+    """Загружает и переводит одну статью: (title_ru, snippet_ru). При ошибке перевода — пустые строки."""
+
+    page_title, snippet_en = extract_article(url, summary_en)
+    try:
+        title_ru, snippet_ru = translate_texts([page_title or title_en or "", snippet_en])
+        return title_ru, snippet_ru
+    except Exception as exc:
+        logger.exception("Ошибка перевода новости %s: %s", url, exc)
+        return "", ""
+
+
+def enrich_pending_news(
+    session: SessionLocal, limit: int = NEWS_ENRICH_BATCH, workers: int = NEWS_ENRICH_WORKERS
+) -> int:
+    """Заполняет title_ru / snippet_ru у свежих новостей без перевода.
+
+    Страницы качаются не более чем в workers потоков, все заголовки и сниппеты
+    переводятся одним batch-запросом. Возвращает число обработанных новостей."""
+
+    items = (
+        session.query(News)
+        .filter(News.title_ru.is_(None))
+        .order_by(News.published_at.desc())
+        .limit(limit)
+        .all()
+    )
+    if not items:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items)))) as pool:
+        pages = list(pool.map(lambda n: extract_article(n.url, n.summary), items))
+
+    texts: list[str] = []
+    for item, (page_title, snippet_en) in zip(items, pages):
+        texts += [page_title or item.title or "", snippet_en]
+    try:
+        translated = translate_texts(texts, session=session)
+    except Exception as exc:
+        # Переводчик недоступен — новости останутся в очереди до следующего прогона
+        session.rollback()
+        logger.exception("Ошибка перевода новостей: %s", exc)
+        return 0
+
+    for i, item in enumerate(items):
+        item.title_ru = translated[2 * i] or item.title
+        item.snippet_ru = translated[2 * i + 1]
+    session.commit()
+    logger.info("Обогащено новостей: %d", len(items))
+    return len(items)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Iterable
+
+from sqlalchemy import case, select
+
+from db.models import Checkpoint, Price, PriceBar1d, PriceBar1h, PriceBar1m, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "price_rollup_id"
+# Сколько строк prices сворачиваем за одну транзакцию
+ROLLUP_BATCH = int(os.getenv("ROLLUP_BATCH", "50000"))
+# Сколько дней храним сырые цены; более старые остаются только в барах
+PRICE_RAW_RETENTION_DAYS = int(os.getenv("PRICE_RAW_RETENTION_DAYS", "7"))
+# Сколько дней храним бары каждого шага (0 — бессрочно)
+BAR_RETENTION_DAYS = {
+    "1m": int(os.getenv("BAR_1M_RETENTION_DAYS", "7")),
+    "1h": int(os.getenv("BAR_1H_RETENTION_DAYS", "400")),
+    "1d": int(os.getenv("BAR_1D_RETENTION_DAYS", "0")),
+}
+
+_EPOCH = dt.datetime(1970, 1, 1)
+# prices_job, compact_job и warmup_job крутятся в пуле планировщика и могут совпасть:
+# два прохода от одного checkpoint свернули бы одни и те же цены дважды
+_rollup_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Resolution:
+    name: str
+    model: type
+    step: dt.timedelta
+
+    def floor(self, ts: dt.datetime) -> dt.datetime:
+        return ts - (ts - _EPOCH) % self.step
+
+
+RESOLUTIONS = (
+    Resolution("1m", PriceBar1m, dt.timedelta(minutes=1)),
+    Resolution("1h", PriceBar1h, dt.timedelta(hours=1)),
+    Resolution("1d", PriceBar1d, dt.timedelta(days=1)),
+)
+
+
+def resolution_for(step: dt.timedelta) -> Resolution | None:
+    """Самые крупные бары, из которых собирается шаг step (step кратен их шагу), или None."""
+
+    for res in reversed(RESOLUTIONS):
+        if step >= res.step and step % res.step == dt.timedelta(0):
+            return res
+    return None
+
+
+def _fold(bars: Iterable[dict], res: Resolution) -> list[dict]:
+    """Сводит бары (или отдельные цены) в бары шага res, по одному на (coin, start)."""
+
+    merged: dict[tuple, dict] = {}
+    for bar in bars:
+        key = (bar["coin"], res.floor(bar["opened_at"]))
+        acc = merged.get(key)
+        if acc is None:
+            merged[key] = {**bar, "start": key[1]}
+            continue
+        if bar["opened_at"] < acc["opened_at"]:
+            acc["open"], acc["opened_at"] = bar["open"], bar["opened_at"]
+        if bar["closed_at"] >= acc["closed_at"]:
+            acc["close"], acc["closed_at"] = bar["close"], bar["closed_at"]
+        acc["high"] = max(acc["high"], bar["high"])
+        acc["low"] = min(acc["low"], bar["low"])
+        acc["ticks"] += bar["ticks"]
+    return list(merged.values())
+
+
+def _upsert(session: SessionLocal, model: type, rows: list[dict]) -> None:
+    """INSERT … ON CONFLICT (coin, start) DO UPDATE со слиянием OHLC с уже записанным баром."""
+
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    table = model.__table__
+    stmt = insert(model)
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["coin", "start"],
+        set_={
+            "open": case((new.opened_at < table.c.opened_at, new.open), else_=table.c.open),
+            "opened_at": case((new.opened_at < table.c.opened_at, new.opened_at), else_=table.c.opened_at),
+            "close": case((new.closed_at >= table.c.closed_at, new.close), else_=table.c.close),
+            "closed_at": case((new.closed_at >= table.c.closed_at, new.closed_at), else_=table.c.closed_at),
+            "high": case((new.high > table.c.high, new.high), else_=table.c.high),
+            "low": case((new.low < table.c.low, new.low), else_=table.c.low),
+            "ticks": table.c.ticks + new.ticks,
+        },
+    )
+    session.connection().execute(stmt, rows)
+
+
+def _point_bar(coin: str, ts: dt.datetime, price: float) -> dict:
+    return {"coin": coin, "opened_at": ts, "closed_at": ts, "open": price, "high": price, "low": price, "close": price, "ticks": 1}
+
+
+def merge_bars(session: SessionLocal, bars: list[dict]) -> None:
+    """Вливает бары (coin, opened_at, closed_at, open, high, low, close, ticks) во все шаги.
+
+    Бары должны целиком лежать внутри минуты — как минутные бары потока или отдельные цены.
+    Коммит — за вызывающим."""
+
+    for res in RESOLUTIONS:
+        rows = _fold(bars, res)
+        if rows:
+            _upsert(session, res.model, rows)
+
+
+def rollup_prices(session: SessionLocal, batch: int = ROLLUP_BATCH) -> int:
+    """Сворачивает в бары новые строки prices (после checkpoint по id). Возвращает их число.
+
+    Бары и checkpoint пишутся одной транзакцией, поэтому повторный запуск ничего не удвоит;
+    одновременные вызовы выполняются по очереди.
+    Поздно докачанная история получает новые id и тоже попадает в бары."""
+
+    total = 0
+    with _rollup_lock:
+        while True:
+            # FOR UPDATE — от параллельного свёртывания в другом процессе (PostgreSQL)
+            checkpoint = session.get(Checkpoint, CHECKPOINT_NAME, with_for_update=True)
+            if checkpoint is None:
+                checkpoint = Checkpoint(name=CHECKPOINT_NAME, value=0)
+                session.add(checkpoint)
+            rows = session.execute(
+                select(Price.id, Price.coin, Price.timestamp, Price.price_usd)
+                .where(Price.id > checkpoint.value)
+                .order_by(Price.id)
+                .limit(batch)
+            ).all()
+            if not rows:
+                break
+            merge_bars(session, [_point_bar(coin, ts, float(price)) for _, coin, ts, price in rows])
+            checkpoint.value = rows[-1].id
+            session.commit()
+            total += len(rows)
+        session.commit()
+
+    if total:
+        logger.info("В бары свёрнуто %d цен", total)
+    return total
+
+
+def compact_prices(session: SessionLocal, now: dt.datetime | None = None) -> dict[str, int]:
+    """Удаляет сырые цены старше PRICE_RAW_RETENTION_DAYS (только уже свёрнутые в бары)
+    и бары старше срока хранения их шага. Возвращает {таблица: удалено строк}."""
+
+    now = now or dt.datetime.utcnow()
+    rollup_prices(session)
+    checkpoint = session.get(Checkpoint, CHECKPOINT_NAME)
+
+    deleted = {
+        Price.__tablename__: session.query(Price)
+        .filter(
+            Price.timestamp < now - dt.timedelta(days=PRICE_RAW_RETENTION_DAYS),
+            # строку с id checkpoint не трогаем: SQLite без AUTOINCREMENT
+            # иначе может выдать новым ценам уже пройденные id
+            Price.id < checkpoint.value,
+        )
+        .delete(synchronize_session=False)
+    }
+    for res in RESOLUTIONS:
+        days = BAR_RETENTION_DAYS[res.name]
+        if days:
+            model = res.model
+            deleted[model.__tablename__] = (
+                session.query(model)
+                .filter(model.start < now - dt.timedelta(days=days))
+                .delete(synchronize_session=False)
+            )
+    session.commit()
+    logger.info("Компактизация цен: %s", deleted)
+    return deleted
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+from db.models import SessionLocal
+from finance_ai.rollups import merge_bars
+
+logger = logging.getLogger(__name__)
+
+# Потоковый режим цен включается, только если задан PRICE_STREAM_URL
+# (например, wss://stream.binance.com:9443/stream?streams=btcusdt@ticker/ethusdt@ticker)
+PRICE_STREAM_URL = os.getenv("PRICE_STREAM_URL", "")
+# Соответствие id CoinGecko → символ биржи: "bitcoin:BTCUSDT,ethereum:ETHUSDT"
+PRICE_STREAM_SYMBOLS = {
+    coin.strip(): symbol.strip().upper()
+    for coin, symbol in (
+        pair.split(":") for pair in os.getenv("PRICE_STREAM_SYMBOLS", "bitcoin:BTCUSDT,ethereum:ETHUSDT").split(",") if pair
+    )
+}
+# Сколько последних тиков держим на монету и как часто пишем закрытые бары в БД (с)
+TICK_BUFFER_SIZE = int(os.getenv("TICK_BUFFER_SIZE", "4096"))
+BAR_FLUSH_INTERVAL = float(os.getenv("BAR_FLUSH_INTERVAL", "10"))
+
+
+@dataclass(frozen=True)
+class Tick:
+    ts: dt.datetime
+    price: float
+
+
+@dataclass
+class _Bar:
+    start: dt.datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    opened_at: dt.datetime
+    closed_at: dt.datetime
+    ticks: int = 1
+
+    def row(self, coin: str) -> dict:
+        return {
+            "coin": coin,
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "opened_at": self.opened_at,
+            "closed_at": self.closed_at,
+            "ticks": self.ticks,
+        }
+
+
+class TickStore:
+    """Последние тики по монетам в кольцевых буферах фиксированного размера
+    и сборка минутных OHLC-баров, которые пачкой сбрасываются в БД (1m/1h/1d)."""
+
+    def __init__(self, size: int = TICK_BUFFER_SIZE):
+        self.size = size
+        self._ticks: dict[str, deque[Tick]] = {}
+        self._open_bars: dict[str, _Bar] = {}
+        self._closed: list[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, coin: str, ts: dt.datetime, price: float) -> None:
+        minute = ts.replace(second=0, microsecond=0)
+        with self._lock:
+            ticks = self._ticks.get(coin)
+            if ticks is None:
+                ticks = self._ticks[coin] = deque(maxlen=self.size)
+            ticks.append(Tick(ts, price))
+
+            bar = self._open_bars.get(coin)
+            if bar is None or minute > bar.start:
+                if bar is not None:
+                    self._closed.append(bar.row(coin))
+                self._open_bars[coin] = _Bar(minute, price, price, price, price, ts, ts)
+            elif minute == bar.start:
+                bar.high = max(bar.high, price)
+                bar.low = min(bar.low, price)
+                bar.close = price
+                bar.closed_at = ts
+                bar.ticks += 1
+            # тик из уже закрытой минуты (пришёл с опозданием) в бары не попадает
+
+    def latest(self, coin: str) -> Tick | None:
+        with self._lock:
+            ticks = self._ticks.get(coin)
+            return ticks[-1] if ticks else None
+
+    def latest_prices(self) -> dict[str, float]:
+        with self._lock:
+            return {coin: ticks[-1].price for coin, ticks in self._ticks.items() if ticks}
+
+    def ticks(self, coin: str) -> list[Tick]:
+        with self._lock:
+            return list(self._ticks.get(coin, ()))
+
+    def flush(self, session: SessionLocal, close_open: bool = False) -> int:
+        """Вливает закрытые минутные бары в бары всех шагов (merge_bars). Возвращает число баров.
+
+        close_open=True закрывает и текущие бары (при остановке потока)."""
+
+        with self._lock:
+            rows, self._closed = self._closed, []
+            if close_open:
+                rows += [bar.row(coin) for coin, bar in self._open_bars.items()]
+                self._open_bars.clear()
+        if not rows:
+            return 0
+        try:
+            merge_bars(session, rows)
+            session.commit()
+        except Exception:
+            session.rollback()
+            with self._lock:
+                self._closed[:0] = rows  # вернём в очередь до следующей попытки
+            raise
+        return len(rows)
+
+
+def parse_ticker(message: str | bytes, symbols: dict[str, str]) -> tuple[str, dt.datetime, float] | None:
+    """(coin, время, цена) из сообщения Binance ticker/trade (в т.ч. combined stream) или None."""
+
+    data = json.loads(message)
+    data = data.get("data", data)
+    coin = symbols.get(str(data.get("s", "")).upper())
+    price = data.get("c", data.get("p"))
+    ts_ms = data.get("T", data.get("E"))
+    if coin is None or price is None or ts_ms is None:
+        return None
+    return coin, dt.datetime.utcfromtimestamp(ts_ms / 1000), float(price)
+
+
+async def _flush_loop(store: TickStore, interval: float, on_flush: Callable[[], None] | None) -> None:
+    def flush() -> int:
+        with SessionLocal() as session:
+            return store.flush(session)
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # on_flush — только когда в БД появились новые бары: пока поток
+            # переподключается, старые цены из буфера никуда не публикуются
+            if await asyncio.to_thread(flush) and on_flush is not None:
+                await asyncio.to_thread(on_flush)  # on_flush ходит в БД — не держим им чтение сокета
+        except Exception as exc:
+            logger.exception("Не удалось записать минутные бары: %s", exc)
+
+
+async def stream_prices(
+    store: TickStore,
+    url: str = PRICE_STREAM_URL,
+    symbols: dict[str, str] = PRICE_STREAM_SYMBOLS,
+    flush_interval: float = BAR_FLUSH_INTERVAL,
+    on_flush: Callable[[], None] | None = None,
+) -> None:
+    """Читает тикеры из WebSocket, переподключаясь при обрывах, и раз в flush_interval пишет бары."""
+
+    import websockets
+
+    by_symbol = {symbol: coin for coin, symbol in symbols.items()}
+    flusher = asyncio.create_task(_flush_loop(store, flush_interval, on_flush))
+    try:
+        async for ws in websockets.connect(url):
+            logger.info("Подключен поток цен %s", url)
+            try:
+                async for message in ws:
+                    try:
+                        tick = parse_ticker(message, by_symbol)
+                        if tick is not None:
+                            store.add(*tick)
+                    except Exception as exc:
+                        # одно битое сообщение не должно останавливать поток
+                        logger.warning("Не удалось разобрать сообщение потока цен: %s (%.200r)", exc, message)
+            except websockets.ConnectionClosed as exc:
+                logger.warning("Поток цен закрыт (%s), переподключение", exc)
+    finally:
+        flusher.cancel()
+        with SessionLocal() as session:
+            store.flush(session, close_open=True)
+
+
+# Общее хранилище тиков процесса (заполняется, если поток запущен)
+tick_store = TickStore()
+
+
+def start_price_stream(on_flush: Callable[[], None] | None = None) -> threading.Thread | None:
+    """Запускает stream_prices в отдельном потоке со своим event loop. Без PRICE_STREAM_URL — ничего."""
+
+    if not PRICE_STREAM_URL:
+        return None
+    thread = threading.Thread(
+        target=lambda: asyncio.run(stream_prices(tick_store, on_flush=on_flush)),
+        name="price-stream",
+        daemon=True,
+    )
+    thread.start()
+    return thread
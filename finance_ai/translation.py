@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import abc
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+from db.models import SessionLocal, TranslationCache, insert_ignore
+
+logger = logging.getLogger(__name__)
+
+# Сколько переводов держим в памяти процесса (LRU), остальное — в таблице translation_cache
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "10000"))
+# Google Translate принимает до 5000 символов за запрос — упаковываем строки с запасом
+TRANSLATE_CHUNK_CHARS = int(os.getenv("TRANSLATE_CHUNK_CHARS", "4500"))
+
+_memory: OrderedDict[tuple[str, str], str] = OrderedDict()
+_memory_lock = threading.Lock()
+# Откуда пришли переводы: для оценки hit rate
+translation_stats = {"memory": 0, "db": 0, "translated": 0}
+
+
+class Translator(abc.ABC):
+    """Переводит список строк на язык target. В тестах подменяется заглушкой через set_translator."""
+
+    @abc.abstractmethod
+    def translate_batch(self, texts: List[str], target: str) -> List[str]:
+        """Переводы texts в том же порядке."""
+
+
+class GoogleBatchTranslator(Translator):
+    """deep-translator GoogleTranslator с упаковкой нескольких строк в один запрос.
+
+    translate_batch самой библиотеки делает по запросу на строку, поэтому строки
+    склеиваются через перевод строки в куски до TRANSLATE_CHUNK_CHARS и делятся обратно.
+    Если число строк в ответе не совпало, кусок переводится построчно."""
+
+    def translate_batch(self, texts, target):
+        from deep_translator import GoogleTranslator
+
+        translator = GoogleTranslator(source="auto", target=target)
+        lines = [" ".join(t.split()) for t in texts]
+        result: list[str] = []
+        for chunk in self._chunks(lines):
+            joined = translator.translate("\n".join(chunk))
+            parts = joined.split("\n") if joined else []
+            if len(parts) != len(chunk):
+                parts = translator.translate_batch(chunk)
+            result.extend(p.strip() for p in parts)
+        return result
+
+    @staticmethod
+    def _chunks(lines: List[str]) -> List[List[str]]:
+        chunks, current, size = [], [], 0
+        for line in lines:
+            if current and size + len(line) + 1 > TRANSLATE_CHUNK_CHARS:
+                chunks.append(current)
+                current, size = [], 0
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            chunks.append(current)
+        return chunks
+
+
+_translator: Translator = GoogleBatchTranslator()
+
+
+def set_translator(translator: Translator) -> Translator:
+    """Подменяет движок перевода; возвращает прежний."""
+    global _translator
+    previous, _translator = _translator, translator
+    return previous
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _remember(key: tuple[str, str], translated: str) -> None:
+    with _memory_lock:
+        _memory[key] = translated
+        _memory.move_to_end(key)
+        while len(_memory) > TRANSLATION_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def clear_memory_cache() -> None:
+    with _memory_lock:
+        _memory.clear()
+
+
+def translate_texts(texts: List[str], target: str = "ru", session: SessionLocal | None = None) -> List[str]:
+    """Переводит texts с кэшем по (SHA-256 текста, язык): память → БД → один batch-запрос.
+
+    Пустые строки остаются пустыми. Новые переводы сохраняются в translation_cache."""
+
+    hashes = [text_hash(t) if t and t.strip() else None for t in texts]
+    found: dict[str, str] = {}
+    pending: dict[str, str] = {}
+    with _memory_lock:
+        for h, t in zip(hashes, texts):
+            if h is None or h in found or h in pending:
+                continue
+            cached = _memory.get((h, target))
+            if cached is None:
+                pending[h] = t
+            else:
+                _memory.move_to_end((h, target))
+                found[h] = cached
+                translation_stats["memory"] += 1
+
+    if pending:
+        own_session = session is None
+        session = session or SessionLocal()
+        try:
+            rows = session.query(TranslationCache.text_hash, TranslationCache.translated).filter(
+                TranslationCache.target == target, TranslationCache.text_hash.in_(list(pending))
+            )
+            for h, translated in rows:
+                found[h] = translated
+                del pending[h]
+                _remember((h, target), translated)
+                translation_stats["db"] += 1
+
+            if pending:
+                translated = _translator.translate_batch(list(pending.values()), target)
+                insert_ignore(
+                    session,
+                    TranslationCache,
+                    ({"text_hash": h, "target": target, "translated": tr} for h, tr in zip(pending, translated)),
+                )
+                session.commit()
+                for h, tr in zip(pending, translated):
+                    found[h] = tr
+                    _remember((h, target), tr)
+                translation_stats["translated"] += len(pending)
+                logger.debug("Переведено строк: %d", len(pending))
+        finally:
+            if own_session:
+                session.close()
+
+    return [found.get(h, "") if h else "" for h in hashes]
@@ -0,0 +1,159 @@
+"""Общий HTTP-клиент для исходящих запросов (CoinGecko, RSS, статьи, Ethereum RPC).
+
+Синхронная часть — один requests.Session на процесс, асинхронная — httpx.AsyncClient
+на event loop. Оба держат keep-alive соединения, ограничивают число соединений
+к одному хосту и повторяют запрос с экспоненциальной паузой при 429/5xx и обрывах соединения.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Соединений к одному хосту (лишние запросы ждут свободного) и хостов в пуле
+HTTP_PER_HOST = int(os.getenv("HTTP_PER_HOST", "10"))
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "32"))
+# Повторы при 429/5xx и ошибках соединения: пауза HTTP_BACKOFF * 2**попытка (или Retry-After).
+# Таймауты (чтения и соединения) не повторяем — медленный или недоступный сервер
+# иначе задержал бы вызов в разы дольше timeout
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+HTTP_MAX_BACKOFF = float(os.getenv("HTTP_MAX_BACKOFF", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Без явного retry повторяем только запросы, которые безопасно отправить дважды
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+# httpx.AsyncClient привязан к event loop, поэтому у каждого loop — свой клиент и семафоры хостов
+_async_state: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_session() -> requests.Session:
+    """Общий requests.Session с пулом соединений (создаётся при первом обращении)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_PER_HOST, pool_block=True)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def retry_delay(attempt: int, retry_after: str | None) -> float:
+    """Пауза перед повтором: Retry-After сервера или экспоненциальная, не больше HTTP_MAX_BACKOFF."""
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_MAX_BACKOFF)
+        except ValueError:
+            pass  # дата HTTP вместо секунд — считаем паузу сами
+    return min(HTTP_BACKOFF * 2**attempt, HTTP_MAX_BACKOFF)
+
+
+def request(method: str, url: str, *, retry: bool | None = None, **kwargs) -> requests.Response:
+    """Запрос через общий Session с повторами.
+
+    retry=None — повторять только идемпотентные методы; True/False — явно.
+    После исчерпания попыток возвращается последний ответ (raise_for_status — за вызывающим)."""
+
+    method = method.upper()
+    retry = method in IDEMPOTENT_METHODS if retry is None else retry
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    attempts = HTTP_RETRIES + 1 if retry else 1
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        try:
+            resp = get_session().request(method, url, **kwargs)
+        except requests.ConnectTimeout:
+            raise  # подкласс ConnectionError, но хост не ответил за timeout — не ждём его ещё раз
+        except requests.ConnectionError as exc:
+            if last:
+                raise
+            delay = retry_delay(attempt, None)
+            logger.warning("%s %s: %s, повтор через %.1f c", method, url, exc, delay)
+        else:
+            if resp.status_code not in RETRY_STATUSES or last:
+                return resp
+            delay = retry_delay(attempt, resp.headers.get("Retry-After"))
+            logger.warning("%s %s: HTTP %d, повтор через %.1f c", method, url, resp.status_code, delay)
+            resp.close()
+        time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def _loop_state() -> tuple[httpx.AsyncClient, defaultdict]:
+    loop = asyncio.get_running_loop()
+    state = _async_state.get(loop)
+    if state is None:
+        client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=HTTP_PER_HOST * HTTP_POOL_HOSTS, max_keepalive_connections=HTTP_POOL_HOSTS),
+        )
+        state = (client, defaultdict(lambda: asyncio.Semaphore(HTTP_PER_HOST)))
+        _async_state[loop] = state
+    return state
+
+
+async def arequest(method: str, url: str, *, retry: bool | None = None, **kwargs) -> httpx.Response:
+    """Асинхронный аналог request поверх httpx.AsyncClient текущего event loop."""
+
+    method = method.upper()
+    retry = method in IDEMPOTENT_METHODS if retry is None else retry
+    client, host_limits = _loop_state()
+    attempts = HTTP_RETRIES + 1 if retry else 1
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        try:
+            async with host_limits[urlsplit(url).netloc]:
+                resp = await client.request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.RemoteProtocolError) as exc:
+            if last:
+                raise
+            delay = retry_delay(attempt, None)
+            logger.warning("%s %s: %s, повтор через %.1f c", method, url, exc, delay)
+        else:
+            if resp.status_code not in RETRY_STATUSES or last:
+                return resp
+            delay = retry_delay(attempt, resp.headers.get("Retry-After"))
+            logger.warning("%s %s: HTTP %d, повтор через %.1f c", method, url, resp.status_code, delay)
+        await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+async def aget(url: str, **kwargs) -> httpx.Response:
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url: str, **kwargs) -> httpx.Response:
+    return await arequest("POST", url, **kwargs)
+
+
+async def aclose() -> None:
+    """Закрывает httpx-клиент текущего event loop (при остановке бота)."""
+    state = _async_state.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state[0].aclose()
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Лимит заглушки: не больше SERVER_LIMIT запросов за секунду, длиннее MAX_URL — 414
+SERVER_LIMIT = 5
+MAX_URL = 2048
+COINS = 30
+
+
+class FakeCoinGecko(BaseHTTPRequestHandler):
+    """Заглушка CoinGecko: simple/price и market_chart/range с лимитом запросов."""
+
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    recent: deque = deque()
+    lock = threading.Lock()
+    served = 0
+    rejected = 0
+
+    def _send(self, status: int, body: dict | None = None, headers: dict | None = None):
+        payload = json.dumps(body or {}).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if len(self.path) > MAX_URL:
+            return self._send(414)
+        with FakeCoinGecko.lock:
+            now = time.monotonic()
+            while FakeCoinGecko.recent and now - FakeCoinGecko.recent[0] > 1:
+                FakeCoinGecko.recent.popleft()
+            if len(FakeCoinGecko.recent) >= SERVER_LIMIT:
+                FakeCoinGecko.rejected += 1
+                return self._send(429, {"status": {"error_code": 429}}, {"Retry-After": "1"})
+            FakeCoinGecko.recent.append(now)
+            FakeCoinGecko.served += 1
+
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path.endswith("/simple/price"):
+            body = {coin: {"usd": 100.0 + i} for i, coin in enumerate(query["ids"].split(","))}
+        else:
+            start, end = int(query["from"]), int(query["to"])
+            body = {"prices": [[ts * 1000, 100.0] for ts in range(start, end, 3600)]}
+        self._send(200, body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCoinGecko)
+threading.Thread(target=_server.serve_forever, daemon=True).start()
+os.environ["COINGECKO_BASE_URL"] = f"http://127.0.0.1:{_server.server_port}/api/v3"
+# Bucket чуть ниже лимита заглушки: RATE + BURST за секунду не больше SERVER_LIMIT
+os.environ.setdefault("COINGECKO_RATE_PER_MIN", str((SERVER_LIMIT - 1) * 60))
+os.environ.setdefault("COINGECKO_BURST", "1")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'coingecko.db')}")
+
+import http_client  # noqa: E402
+from finance_ai import coingecko  # noqa: E402
+
+logging.getLogger("http_client").setLevel(logging.ERROR)
+
+
+def reset() -> None:
+    coingecko.clear_cache()
+    time.sleep(1.1)  # окно лимита заглушки
+    FakeCoinGecko.served = FakeCoinGecko.rejected = 0
+    for key in coingecko.stats:
+        coingecko.stats[key] = 0
+
+
+def test_simple_price_split_by_url_length():
+    reset()
+    coins = [f"some-long-coingecko-token-identifier-{i}" for i in range(300)]
+    prices = coingecko.simple_prices(coins)
+    assert set(prices) == set(coins)
+    groups = coingecko._id_groups(sorted(coins), "usd")
+    assert len(groups) > 1
+    assert FakeCoinGecko.served == len(groups) and FakeCoinGecko.rejected == 0
+
+
+def test_concurrent_callers_coalesce_and_cache():
+    reset()
+    coins = [f"coin-{i}" for i in range(COINS)]
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        results = list(pool.map(lambda _: coingecko.simple_prices(coins), range(20)))
+    assert all(r == results[0] for r in results)
+    assert FakeCoinGecko.served == 1  # один simple/price на всех
+    # подмножество монет в пределах TTL — из кэша, без запросов
+    assert coingecko.simple_prices(coins[:2]) == {c: results[0][c] for c in coins[:2]}
+    assert FakeCoinGecko.served == 1
+
+
+def legacy_chart(coin: str, start: int, end: int):
+    """Прежний бэкфилл: запрос без учёта лимита, ошибка — и данные монеты потеряны."""
+    resp = http_client.get(
+        coingecko.COINGECKO_BASE_URL + coingecko.CHART_RANGE_PATH.format(coin=coin),
+        params={"vs_currency": "usd", "from": start, "to": end},
+        retry=False,
+    )
+    resp.raise_for_status()
+    return resp.json()["prices"]
+
+
+def _backfill(fetch, coins: list[str], end: int) -> tuple[int, float]:
+    """Параллельный бэкфилл (как при старте нескольких задач): (монет без данных, время)."""
+
+    def one(coin):
+        try:
+            return bool(fetch(coin, end - 86_400, end))
+        except Exception:
+            return False
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        ok = list(pool.map(one, coins))
+    return ok.count(False), time.perf_counter() - started
+
+
+def benchmark_backfill_under_rate_limit():
+    coins = [f"coin-{i}" for i in range(COINS)]
+    end = int(time.time())
+
+    reset()
+    lost, legacy_time = _backfill(legacy_chart, coins, end)
+    legacy_429 = FakeCoinGecko.rejected
+
+    reset()
+    lost_new, new_time = _backfill(coingecko.market_chart_range, coins, end)
+    assert lost_new == 0
+    logger.info(
+        "%d графиков при лимите %d/с: без планировщика потеряно %d монет (%d ответов 429) за %.1f c; "
+        "token bucket — потеряно %d (%d ответов 429) за %.1f c",
+        COINS, SERVER_LIMIT, lost, legacy_429, legacy_time, lost_new, FakeCoinGecko.rejected, new_time,
+    )
+
+    # Повтор тех же графиков (например, рестарт задачи) — из кэша
+    served = FakeCoinGecko.served
+    _backfill(coingecko.market_chart_range, coins, end)
+    logger.info("Повторный бэкфилл: %d запросов к API, статистика %s", FakeCoinGecko.served - served, coingecko.stats)
+
+
+if __name__ == "__main__":
+    test_simple_price_split_by_url_length()
+    test_concurrent_callers_coalesce_and_cache()
+    benchmark_backfill_under_rate_limit()
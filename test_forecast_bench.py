@@ -0,0 +1,200 @@
+import datetime as dt
+import logging
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logging.getLogger("cmdstanpy").setLevel(logging.WARNING)
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'forecast.db')}")
+
+from db.models import Forecast, ForecastModel, Price, SessionLocal, insert_ignore  # noqa: E402
+from finance_ai import analysis, rollups  # noqa: E402
+
+COINS = [f"coin{i}" for i in range(8)]
+# Шаг цен как у prices_job (2 минуты) за LOOKBACK_DAYS
+STEP_MINUTES = 2
+
+
+def seed_prices(coins: list[str], days: int = analysis.LOOKBACK_DAYS, step_minutes: int = STEP_MINUTES) -> None:
+    """Синтетические цены: тренд + суточная сезонность + шум."""
+    rnd = np.random.default_rng(0)
+    now = dt.datetime.utcnow().replace(second=0, microsecond=0)
+    points = days * 24 * 60 // step_minutes
+    t = np.arange(points)
+    with SessionLocal() as session:
+        for i, coin in enumerate(coins):
+            base = 100 * (i + 1)
+            y = base + 0.001 * t + 5 * np.sin(2 * np.pi * t * step_minutes / 1440) + rnd.normal(0, 1, points)
+            insert_ignore(
+                session,
+                Price,
+                (
+                    {"coin": coin, "price_usd": float(v), "timestamp": now - dt.timedelta(minutes=step_minutes * (points - k))}
+                    for k, v in enumerate(y)
+                ),
+            )
+        session.commit()
+        rollups.rollup_prices(session)
+
+
+def test_linear_engine_fits_all_coins():
+    seed_prices(COINS[2:5], days=10, step_minutes=60)
+    with SessionLocal() as session:
+        analysis.build_forecasts(session, COINS[2:5], engine="linear")
+        for coin in COINS[2:5]:
+            rows = session.query(Forecast).filter(Forecast.coin == coin).all()
+            assert len(rows) == analysis.FORECAST_DAYS
+            assert all(r.price_usd > 0 for r in rows)
+            # linear не хранит модель между запусками
+            assert session.get(ForecastModel, coin) is None
+
+
+def test_parallel_forecasts_written():
+    seed_prices(COINS[:2], days=5, step_minutes=60)
+    with SessionLocal() as session:
+        analysis.build_forecasts(session, COINS[:2])
+        for coin in COINS[:2]:
+            assert session.query(Forecast).filter(Forecast.coin == coin).count() == analysis.FORECAST_DAYS
+
+
+def benchmark_forecast_job():
+    seed_prices(COINS)
+    with SessionLocal() as session:
+        started = time.perf_counter()
+        for coin in COINS:
+            analysis.build_forecast(session, coin)
+        sequential = time.perf_counter() - started
+
+        started = time.perf_counter()
+        analysis.build_forecasts(session, COINS)
+        parallel = time.perf_counter() - started
+    logger.info(
+        "%d монет: последовательно %.1f c, пул из %d процессов %.1f c",
+        len(COINS), sequential, analysis.FORECAST_WORKERS, parallel,
+    )
+
+
+def legacy_fit(session, coin: str) -> list:
+    """Прежний путь build_forecast: ORM-объекты Price и обучение на сырых точках."""
+    from prophet import Prophet
+
+    since = dt.datetime.utcnow() - dt.timedelta(days=analysis.LOOKBACK_DAYS)
+    prices = session.query(Price).filter(Price.coin == coin, Price.timestamp >= since).order_by(Price.timestamp).all()
+    df = pd.DataFrame({"ds": [p.timestamp for p in prices], "y": [float(p.price_usd) for p in prices]})
+    model = Prophet(daily_seasonality=True)
+    model.fit(df)
+    return model.predict(model.make_future_dataframe(periods=analysis.FORECAST_DAYS)).tail(analysis.FORECAST_DAYS)
+
+
+def _measure(func, *args) -> tuple[float, float]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def benchmark_resampled_fit():
+    """Время обучения и пик памяти Python: сырые ORM-строки против часовых баров."""
+    coin = COINS[0]
+    with SessionLocal() as session:
+        raw_time, raw_peak = _measure(legacy_fit, session, coin)
+        bar_time, bar_peak = _measure(lambda: analysis._fit_forecast(*analysis._load_series(session, coin)))
+        points = session.query(Price).filter(Price.coin == coin).count()
+    logger.info(
+        "%d точек: ORM + сырые точки %.1f c / %.0f МБ, бары %s %.1f c / %.0f МБ",
+        points, raw_time, raw_peak, analysis.FORECAST_BAR, bar_time, bar_peak,
+    )
+
+
+def _cpu_seconds() -> float:
+    """CPU основного процесса и дочерних (Stan запускается отдельным процессом)."""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def benchmark_warm_start(rounds: int = 5):
+    """CPU на почасовой refit: обучение с нуля против warm start от прошлой модели."""
+    coin = COINS[1]
+    cold = warm = 0.0
+    with SessionLocal() as session:
+        ds, y = analysis._load_series(session, coin)
+        base = analysis._fit_forecast(ds[:-1], y[:-1])  # модель часом раньше
+
+        for _ in range(rounds):
+            started = _cpu_seconds()
+            analysis._fit_forecast(ds, y)
+            cold += _cpu_seconds() - started
+
+            started = _cpu_seconds()
+            result = analysis._fit_forecast(ds, y, base.model_json)
+            warm += _cpu_seconds() - started
+            assert result.warm
+    logger.info(
+        "Refit %s (%d баров): с нуля %.2f CPU-c, warm start %.2f CPU-c (экономия %.0f%%)",
+        coin, len(y), cold / rounds, warm / rounds, (1 - warm / cold) * 100,
+    )
+
+
+def _split_holdout(ds: np.ndarray, y: np.ndarray, days: int) -> tuple[tuple, np.datetime64]:
+    """Отрезает последние days суток истории; возвращает обучающую часть и её конец."""
+    cutoff = ds[-1] - np.timedelta64(days, "D")
+    train = ds <= cutoff
+    return (ds[train], y[train]), ds[train][-1]
+
+
+def backtest_engines(coins: list[str] | None = None, engines=tuple(analysis.FORECASTERS)):
+    """Бэктест движков на таблице prices: каждый прогнозирует последние FORECAST_DAYS
+    суток по истории до них, сравниваем MAPE по дням и время обучения всех монет.
+
+    Работает с БД из DATABASE_URL; если цен нет — засевает синтетические."""
+
+    with SessionLocal() as session:
+        if coins is None:
+            coins = [c for (c,) in session.query(Price.coin).distinct()]
+        if not coins:
+            coins = COINS
+            seed_prices(coins)
+        full = {coin: analysis._load_series(session, coin) for coin in coins}
+
+    train, actual = {}, {}
+    for coin, (ds, y) in full.items():
+        if len(y) < analysis.MIN_POINTS + analysis.FORECAST_DAYS * 24:
+            continue
+        train[coin], last = _split_holdout(ds, y, analysis.FORECAST_DAYS)
+        truth = pd.Series(y, index=pd.DatetimeIndex(ds))
+        targets = [pd.Timestamp(last) + pd.Timedelta(days=d) for d in range(1, analysis.FORECAST_DAYS + 1)]
+        actual[coin] = np.array([truth.asof(t) for t in targets])
+
+    for engine in engines:
+        started = time.perf_counter()
+        results = analysis.get_forecaster(engine).fit_predict(train)
+        elapsed = time.perf_counter() - started
+        errors = [
+            np.mean(np.abs(np.array([yhat for _, yhat in results[coin].rows]) - actual[coin]) / actual[coin])
+            for coin in results
+        ]
+        logger.info(
+            "%-8s %d монет: MAPE %.2f%%, обучение %.2f c",
+            engine, len(results), float(np.mean(errors)) * 100, elapsed,
+        )
+
+
+if __name__ == "__main__":
+    test_linear_engine_fits_all_coins()
+    test_parallel_forecasts_written()
+    benchmark_forecast_job()
+    benchmark_resampled_fit()
+    benchmark_warm_start()
+    backtest_engines(COINS)
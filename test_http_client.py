@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("http_client").setLevel(logging.ERROR)
+
+os.environ.setdefault("HTTP_BACKOFF", "0.01")
+
+import httpx  # noqa: E402
+import requests  # noqa: E402
+
+import http_client  # noqa: E402
+
+REQUESTS = 2_000
+THREADS = 8
+# Клиент на каждый запрос создаётся медленно (SSL-контекст), поэтому async-прогон короче
+ASYNC_REQUESTS = 500
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Отвечает коротким JSON; считает TCP-соединения и запросы. /flaky/N — первые N раз 429."""
+
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело одним сегментом, иначе keep-alive упирается в Nagle + delayed ACK (~40 мс)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    connections = 0
+    hits: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with KeepAliveHandler.lock:
+            KeepAliveHandler.connections += 1
+
+    def _answer(self):
+        with KeepAliveHandler.lock:
+            hits = KeepAliveHandler.hits[self.path] = KeepAliveHandler.hits.get(self.path, 0) + 1
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        if self.path.startswith("/flaky/") and hits <= int(self.path.rsplit("/", 1)[-1]):
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        payload = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+_server: ThreadingHTTPServer | None = None
+
+
+def base_url() -> str:
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        _server.request_queue_size = 128
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{_server.server_port}"
+
+
+def test_retry_on_429():
+    url = f"{base_url()}/flaky/2"
+    resp = http_client.get(url)
+    assert resp.status_code == 200
+    assert KeepAliveHandler.hits["/flaky/2"] == 3
+
+    # POST по умолчанию не повторяется — может быть неидемпотентным
+    resp = http_client.post(f"{base_url()}/flaky/1")
+    assert resp.status_code == 429
+    assert http_client.post(f"{base_url()}/flaky/1", retry=True).status_code == 200
+
+
+def test_async_retry_on_429():
+    async def run():
+        resp = await http_client.aget(f"{base_url()}/flaky/3")
+        await http_client.aclose()
+        return resp
+
+    assert asyncio.run(run()).status_code == 200
+    assert KeepAliveHandler.hits["/flaky/3"] == 4
+
+
+def _rate(func, threads: int) -> tuple[float, int]:
+    """Запросов в секунду и новых TCP-соединений за REQUESTS вызовов func."""
+    url = f"{base_url()}/ping"
+    before = KeepAliveHandler.connections
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for resp in pool.map(lambda _: func(url), range(REQUESTS)):
+            assert resp.status_code == 200
+    return REQUESTS / (time.perf_counter() - started), KeepAliveHandler.connections - before
+
+
+def benchmark_sync_pooling():
+    for threads in (1, THREADS):
+        fresh, fresh_conns = _rate(lambda url: requests.get(url, timeout=10), threads)
+        pooled, pooled_conns = _rate(http_client.get, threads)
+        logger.info(
+            "sync, %d потоков: без пула %.0f req/s (%d соединений), общий Session %.0f req/s (%d соединений) — x%.1f",
+            threads, fresh, fresh_conns, pooled, pooled_conns, pooled / fresh,
+        )
+
+
+def benchmark_async_pooling(concurrency: int = 32):
+    url = f"{base_url()}/ping"
+
+    async def fresh_client(_):
+        async with httpx.AsyncClient() as client:
+            return await client.get(url)
+
+    async def run(func):
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with sem:
+                return await func(i)
+
+        before = KeepAliveHandler.connections
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(one(i) for i in range(ASYNC_REQUESTS)))
+        elapsed = time.perf_counter() - started
+        await http_client.aclose()
+        assert all(r.status_code == 200 for r in responses)
+        return ASYNC_REQUESTS / elapsed, KeepAliveHandler.connections - before
+
+    fresh, fresh_conns = asyncio.run(run(fresh_client))
+    pooled, pooled_conns = asyncio.run(run(lambda _: http_client.aget(url)))
+    logger.info(
+        "async, %d одновременно: клиент на запрос %.0f req/s (%d соединений), общий клиент %.0f req/s (%d соединений) — x%.1f",
+        concurrency, fresh, fresh_conns, pooled, pooled_conns, pooled / fresh,
+    )
+
+
+if __name__ == "__main__":
+    test_retry_on_429()
+    test_async_retry_on_429()
+    benchmark_sync_pooling()
+    benchmark_async_pooling()
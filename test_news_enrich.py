@@ -0,0 +1,190 @@
+import asyncio
+import datetime as dt
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'enrich.db')}")
+
+from db.models import News, SessionLocal  # noqa: E402
+import bot.main as bot_main  # noqa: E402
+from finance_ai import translation  # noqa: E402
+from finance_ai.data_fetch import enrich_pending_news, extract_article  # noqa: E402
+
+# bot.main включает DEBUG для всего процесса
+logging.getLogger().setLevel(logging.INFO)
+
+# Задержка страницы статьи и одного запроса к переводчику
+ARTICLE_DELAY = 0.3
+TRANSLATE_DELAY = 0.2
+USERS = 100
+
+
+class ArticleHandler(BaseHTTPRequestHandler):
+    hits = 0
+
+    def do_GET(self):
+        ArticleHandler.hits += 1
+        time.sleep(ARTICLE_DELAY)
+        payload = (
+            f"<html><head><title>Bitcoin story {self.path}</title></head>"
+            f"<body><p>Paragraph one of story {self.path}.</p><p>Paragraph two.</p></body></html>"
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubTranslator(translation.Translator):
+    """Локальный «переводчик» с задержкой на запрос и счётчиками."""
+
+    def __init__(self):
+        self.calls = 0
+        self.strings = 0
+
+    def translate_batch(self, texts, target):
+        self.calls += 1
+        self.strings += len(texts)
+        time.sleep(TRANSLATE_DELAY)
+        return [f"[{target}] {t}" for t in texts]
+
+
+_server: ThreadingHTTPServer | None = None
+
+
+def base_url() -> str:
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer(("127.0.0.1", 0), ArticleHandler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{_server.server_port}"
+
+
+_published = dt.datetime(2025, 1, 1)
+
+
+def seed_news(prefix: str, count: int) -> None:
+    """count новостей, каждая свежее всех ранее добавленных."""
+    global _published
+    with SessionLocal() as session:
+        session.add_all(
+            News(
+                title=f"{prefix} headline {i}",
+                url=f"{base_url()}/{prefix}/{i}",
+                published_at=_published + dt.timedelta(minutes=i + 1),
+                summary=f"{prefix} summary {i}",
+            )
+            for i in range(count)
+        )
+        session.commit()
+    _published += dt.timedelta(minutes=count)
+
+
+def ask_news() -> str:
+    replies: list[str] = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    update = SimpleNamespace(message=SimpleNamespace(reply_text=reply_text))
+    asyncio.run(bot_main.news_cmd(update, None))
+    return replies[0]
+
+
+def legacy_news(stub: StubTranslator, items: list[News]) -> list[str]:
+    """Прежний /news: статья за статьёй, по запросу к переводчику на заголовок и на сниппет."""
+    messages = []
+    for n in items:
+        title_en, body_en = extract_article(n.url, n.summary)
+        messages.append("\n\n".join(stub.translate_batch([t], "ru")[0] for t in (title_en, body_en)))
+    return messages
+
+
+def test_translation_cache_layers():
+    stub = StubTranslator()
+    translation.set_translator(stub)
+    texts = ["cache one", "cache two", "cache one", ""]
+
+    assert translation.translate_texts(texts) == ["[ru] cache one", "[ru] cache two", "[ru] cache one", ""]
+    assert (stub.calls, stub.strings) == (1, 2)  # дубликаты и пустые строки не переводятся
+
+    translation.translate_texts(texts)
+    translation.clear_memory_cache()
+    translation.translate_texts(texts)  # после рестарта — из таблицы translation_cache
+    assert stub.calls == 1
+    # другой язык — другой ключ кэша
+    assert translation.translate_texts(["cache one"], target="en") == ["[en] cache one"]
+
+
+def test_news_reads_enriched_rows():
+    stub = StubTranslator()
+    translation.set_translator(stub)
+    seed_news("warm", 5)
+    with SessionLocal() as session:
+        assert enrich_pending_news(session) == 5
+        assert enrich_pending_news(session) == 0
+    assert stub.calls == 1  # все заголовки и сниппеты — одним batch
+
+    hits, calls = ArticleHandler.hits, stub.calls
+    reply = ask_news()
+    assert "[ru] Bitcoin story /warm/4" in reply
+    # /news не ходит ни на сайты, ни в переводчик
+    assert (ArticleHandler.hits, stub.calls) == (hits, calls)
+
+
+def benchmark_news_latency():
+    """Время /news: прежний последовательный путь, холодный промах и обогащённые строки."""
+    stub = StubTranslator()
+    translation.set_translator(stub)
+    translation.clear_memory_cache()
+    seed_news("bench", 3)
+
+    with SessionLocal() as session:
+        items = session.query(News).order_by(News.published_at.desc()).limit(3).all()
+    started = time.perf_counter()
+    legacy_news(stub, items)
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    ask_news()  # холодный промах: три статьи параллельно
+    cold = time.perf_counter() - started
+
+    # Фоновая задача переводит те же статьи — всё берётся из кэша, переводчик не нужен
+    stub.calls = 0
+    stats = dict(translation.translation_stats)
+    with SessionLocal() as session:
+        enrich_pending_news(session)
+    served = {k: translation.translation_stats[k] - stats[k] for k in stats}
+    assert stub.calls == 0
+
+    started = time.perf_counter()
+    for _ in range(USERS):
+        ask_news()
+    warm = (time.perf_counter() - started) / USERS
+    assert stub.calls == 0
+
+    logger.info(
+        "/news: последовательно %.2f c, холодный промах %.2f c, из БД %.1f мс (среднее за %d запросов); "
+        "переводы при обогащении после промаха: %s",
+        legacy, cold, warm * 1000, USERS, served,
+    )
+
+
+if __name__ == "__main__":
+    test_translation_cache_layers()
+    test_news_reads_enriched_rows()
+    benchmark_news_latency()
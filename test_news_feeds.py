@@ -0,0 +1,153 @@
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'news.db')}")
+
+import finance_ai.data_fetch as data_fetch  # noqa: E402
+from db.models import News, SessionLocal  # noqa: E402
+
+# Задержка ответа каждой ленты, «зависшая» лента и размеры прогонов
+FEED_DELAY = 0.2
+ENTRIES_PER_FEED = 30
+FEED_COUNTS = [1, 5, 20, 50]
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Отдаёт RSS по пути /feed/<n>; /slow/<n> отвечает дольше таймаута."""
+
+    def do_GET(self):
+        kind, n = self.path.strip("/").split("/")
+        if self.headers.get("If-None-Match") == f'"{n}"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        time.sleep(FEED_DELAY if kind == "feed" else data_fetch.FEED_TIMEOUT * 3)
+        if kind == "slow":
+            return  # клиент к этому моменту уже отвалился по таймауту
+        items = "".join(
+            f"<item><title>Feed {n} item {i}</title><link>http://news.local/{n}/{i}</link></item>"
+            for i in range(ENTRIES_PER_FEED)
+        )
+        body = f'<?xml version="1.0"?><rss version="2.0"><channel><title>{n}</title>{items}</channel></rss>'.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("ETag", f'"{n}"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedServer(ThreadingHTTPServer):
+    request_queue_size = 128  # иначе при 50 лентах теряются SYN и замер искажается
+
+
+def start_feed_server() -> ThreadingHTTPServer:
+    server = FeedServer(("0.0.0.0", 0), FeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def feed_urls(server: ThreadingHTTPServer, count: int, offset: int = 0, kind: str = "feed") -> list[str]:
+    # Каждая лента на своём loopback-адресе, чтобы лимит на хост не мешал замеру
+    return [f"http://127.0.0.{2 + (i % 250)}:{server.server_port}/{kind}/{offset + i}" for i in range(count)]
+
+
+def start_blackhole() -> tuple[str, list[socket.socket]]:
+    """Адрес, где TCP-соединение не устанавливается: очередь accept заполнена, новые SYN
+    отбрасываются — клиент получает таймаут соединения, как от недоступного хоста."""
+
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(0)
+    port = server.getsockname()[1]
+    sockets = [server]
+    for _ in range(3):
+        sock = socket.socket()
+        sock.setblocking(False)
+        try:
+            sock.connect(("127.0.0.1", port))
+        except BlockingIOError:
+            pass
+        sockets.append(sock)
+    time.sleep(0.1)
+    return f"http://127.0.0.1:{port}", sockets
+
+
+def test_slow_feed_does_not_block_others():
+    server = start_feed_server()
+    default_timeout, data_fetch.FEED_TIMEOUT = data_fetch.FEED_TIMEOUT, 1
+    urls = feed_urls(server, 3, offset=1000) + feed_urls(server, 1, offset=2000, kind="slow")
+
+    with SessionLocal() as session:
+        started = time.perf_counter()
+        data_fetch.update_news(session, urls)
+        elapsed = time.perf_counter() - started
+        stored = session.query(News).filter(News.url.like("http://news.local/100_/%")).count()
+
+    assert stored == 3 * ENTRIES_PER_FEED
+    assert elapsed < data_fetch.FEED_TIMEOUT * 2
+    data_fetch.FEED_TIMEOUT = default_timeout
+
+
+def test_unreachable_feed_does_not_block_others():
+    server = start_feed_server()
+    blackhole, sockets = start_blackhole()
+    default_timeout, data_fetch.FEED_TIMEOUT = data_fetch.FEED_TIMEOUT, 1
+    default_article_timeout, data_fetch.ARTICLE_TIMEOUT = data_fetch.ARTICLE_TIMEOUT, 1
+    try:
+        with SessionLocal() as session:
+            started = time.perf_counter()
+            data_fetch.update_news(session, feed_urls(server, 3, offset=3000) + [f"{blackhole}/feed/dead"])
+            elapsed = time.perf_counter() - started
+            stored = session.query(News).filter(News.url.like("http://news.local/300_/%")).count()
+        assert stored == 3 * ENTRIES_PER_FEED
+        # таймаут соединения не повторяется: одна попытка, а не HTTP_RETRIES + 1 с паузами
+        assert elapsed < data_fetch.FEED_TIMEOUT * 2, elapsed
+
+        # промах кэша /news на недоступной статье — тот же один таймаут, дальше summary ленты
+        started = time.perf_counter()
+        assert data_fetch.extract_article(f"{blackhole}/article", "Summary") == ("", "Summary")
+        assert time.perf_counter() - started < data_fetch.ARTICLE_TIMEOUT * 2
+    finally:
+        data_fetch.FEED_TIMEOUT, data_fetch.ARTICLE_TIMEOUT = default_timeout, default_article_timeout
+        for sock in sockets:
+            sock.close()
+
+
+def benchmark_news_cycle():
+    server = start_feed_server()
+    offset = 0
+    for count in FEED_COUNTS:
+        urls = feed_urls(server, count, offset)
+        offset += count
+        with SessionLocal() as session:
+            started = time.perf_counter()
+            data_fetch.update_news(session, urls)
+            cold = time.perf_counter() - started
+
+            started = time.perf_counter()
+            data_fetch.update_news(session, urls)  # все ленты отвечают 304
+            warm = time.perf_counter() - started
+        logger.info(
+            "%2d лент: цикл %.2f c (последовательно ~%.1f c), повтор с 304 — %.2f c",
+            count, cold, count * FEED_DELAY, warm,
+        )
+
+
+if __name__ == "__main__":
+    test_slow_feed_does_not_block_others()
+    test_unreachable_feed_does_not_block_others()
+    benchmark_news_cycle()
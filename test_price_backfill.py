@@ -0,0 +1,94 @@
+import datetime as dt
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'backfill.db')}")
+
+from db.models import Price, SessionLocal, insert_ignore  # noqa: E402
+from finance_ai import coingecko, data_fetch  # noqa: E402
+
+DAYS = 90
+# Допуск на секунды между «сейчас» теста и «сейчас» backfill_prices
+CLOCK_SLACK = 60
+
+
+@contextmanager
+def stub_chart():
+    """Подменяет coingecko.market_chart_range: почасовые точки на [start, end], запросы — в список."""
+
+    calls: list[tuple[int, int]] = []
+
+    def chart(coin, start, end, vs_currency="usd"):
+        calls.append((start, end))
+        return [[ts * 1000, 100.0] for ts in range(start, end + 1, 3600)]
+
+    original, coingecko.market_chart_range = coingecko.market_chart_range, chart
+    try:
+        yield calls
+    finally:
+        coingecko.market_chart_range = original
+
+
+def seed(coin: str, first: dt.datetime, last: dt.datetime) -> None:
+    """Почасовые цены монеты на [first, last]."""
+    rows, ts = [], first
+    while ts <= last:
+        rows.append({"coin": coin, "price_usd": 100.0, "timestamp": ts})
+        ts += dt.timedelta(hours=1)
+    with SessionLocal() as session:
+        insert_ignore(session, Price, rows)
+        session.commit()
+
+
+def test_backfill_requests_only_head_and_tail():
+    coin = "backfill-middle"
+    now = dt.datetime.utcnow().replace(microsecond=0)
+    oldest, newest = now - dt.timedelta(days=60), now - dt.timedelta(days=3)
+    seed(coin, oldest, newest)
+
+    with SessionLocal() as session, stub_chart() as calls:
+        data_fetch.backfill_prices(session, coin, days=DAYS)
+        # середина истории уже есть — запрашиваются только начало и хвост
+        assert len(calls) == 2, calls
+        (head_start, head_end), (tail_start, tail_end) = calls
+        assert abs(head_start - data_fetch._unix(now - dt.timedelta(days=DAYS))) < CLOCK_SLACK
+        assert head_end == data_fetch._unix(oldest)
+        assert tail_start == data_fetch._unix(newest)
+        assert abs(tail_end - data_fetch._unix(now)) < CLOCK_SLACK
+
+        # история полная — в сеть не ходим
+        calls.clear()
+        data_fetch.backfill_prices(session, coin, days=DAYS)
+        assert calls == []
+
+
+def test_short_gaps_are_skipped():
+    coin = "backfill-short-gaps"
+    now = dt.datetime.utcnow().replace(microsecond=0)
+    short = data_fetch.BACKFILL_MIN_GAP / 2
+    # до начала истории — меньше BACKFILL_MIN_GAP, после конца — больше
+    newest = now - data_fetch.BACKFILL_MIN_GAP * 3
+    seed(coin, now - dt.timedelta(days=DAYS) + short, newest)
+
+    with SessionLocal() as session, stub_chart() as calls:
+        data_fetch.backfill_prices(session, coin, days=DAYS)
+        assert len(calls) == 1, calls
+        assert calls[0][0] == data_fetch._unix(newest)
+
+    # пустой промежуток короче BACKFILL_MIN_GAP с обеих сторон — запросов нет
+    coin = "backfill-complete"
+    seed(coin, now - dt.timedelta(days=DAYS) + short, now - short)
+    with SessionLocal() as session, stub_chart() as calls:
+        data_fetch.backfill_prices(session, coin, days=DAYS)
+        assert calls == []
+
+
+if __name__ == "__main__":
+    test_backfill_requests_only_head_and_tail()
+    test_short_gaps_are_skipped()
@@ -0,0 +1,255 @@
+import datetime as dt
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'rollups.db')}")
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from sqlalchemy import func, select, text  # noqa: E402
+
+from db.models import Price, PriceBar1d, PriceBar1h, PriceBar1m, SessionLocal, engine, insert_ignore  # noqa: E402
+from finance_ai import analysis, rollups  # noqa: E402
+from finance_ai.data_fetch import _missing_ranges  # noqa: E402
+from bot.snapshots import latest_prices  # noqa: E402
+
+# Год цен с шагом prices_job (2 минуты) по двум монетам
+YEAR_COINS = ["bitcoin", "ethereum"]
+STEP_MINUTES = 2
+
+
+def random_points(coin: str, days: int, seed: int) -> list[dict]:
+    """Цены в случайные моменты (в среднем раз в 2 минуты) за последние days дней."""
+    rnd = random.Random(seed)
+    now = dt.datetime.utcnow().replace(microsecond=0)
+    ts, price, rows = now - dt.timedelta(days=days), 100.0, []
+    while ts < now:
+        price *= 1 + rnd.gauss(0, 0.002)
+        rows.append({"coin": coin, "price_usd": round(price, 6), "timestamp": ts})
+        ts += dt.timedelta(seconds=rnd.randint(1, 240))
+    return rows
+
+
+def expected_bars(rows: list[dict], rule: str) -> pd.DataFrame:
+    df = pd.DataFrame(rows).set_index("timestamp").sort_index()["price_usd"]
+    bars = df.resample(rule).ohlc()
+    bars["ticks"] = df.resample(rule).count()
+    return bars[bars["ticks"] > 0]
+
+
+def stored_bars(session, model, coin: str) -> pd.DataFrame:
+    query = (
+        select(model.start, model.open, model.high, model.low, model.close, model.ticks)
+        .where(model.coin == coin)
+        .order_by(model.start)
+    )
+    return pd.read_sql_query(query, session.connection(), parse_dates=["start"], index_col="start")
+
+
+def test_rollup_matches_resample_out_of_order():
+    rows = random_points("rollup-coin", days=3, seed=1)
+    # сначала свежая половина, потом «поздно докачанная» история вперемешку
+    half = len(rows) // 2
+    late = rows[:half]
+    random.Random(2).shuffle(late)
+    with SessionLocal() as session:
+        insert_ignore(session, Price, rows[half:])
+        session.commit()
+        rollups.rollup_prices(session)
+        insert_ignore(session, Price, late)
+        session.commit()
+        assert rollups.rollup_prices(session) == len(late)
+        assert rollups.rollup_prices(session) == 0  # повторный запуск ничего не удваивает
+
+        for model, rule in ((PriceBar1m, "1min"), (PriceBar1h, "1h"), (PriceBar1d, "1D")):
+            expected = expected_bars(rows, rule)
+            stored = stored_bars(session, model, "rollup-coin")
+            assert list(stored.index) == list(expected.index)
+            for column in ("open", "high", "low", "close"):
+                assert np.allclose(stored[column].astype(float), expected[column])
+            assert list(stored["ticks"]) == list(expected["ticks"])
+
+
+def test_concurrent_rollups_count_each_price_once():
+    coin = "concurrent-coin"
+    rows = random_points(coin, days=1, seed=4)
+    with SessionLocal() as session:
+        rollups.rollup_prices(session)  # очередь других тестов
+        insert_ignore(session, Price, rows)
+        session.commit()
+
+    # prices_job, compact_job и warmup_job в пуле планировщика стартуют одновременно
+    barrier = threading.Barrier(3)
+    results, errors = [], []
+
+    def job():
+        barrier.wait()
+        try:
+            with SessionLocal() as session:
+                results.append(rollups.rollup_prices(session, batch=50))
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=job) for _ in range(barrier.parties)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors
+    assert sum(results) == len(rows)
+    with SessionLocal() as session:
+        for model in (PriceBar1m, PriceBar1h, PriceBar1d):
+            ticks = session.query(func.sum(model.ticks)).filter(model.coin == coin).scalar()
+            assert ticks == len(rows), model.__tablename__
+
+
+def test_compaction_keeps_history_readable():
+    coin = "compact-coin"
+    rows = random_points(coin, days=analysis.LOOKBACK_DAYS, seed=3)
+    with SessionLocal() as session:
+        insert_ignore(session, Price, rows)
+        session.commit()
+        rollups.rollup_prices(session)
+        before = analysis._load_series(session, coin)
+        # закрытия часовых баров совпадают с ресемплингом сырых цен (кроме первого, неполного часа)
+        legacy = legacy_load_series(session, coin)
+        assert np.array_equal(before[0][1:], legacy[0][-len(before[0]) + 1:])
+        assert np.allclose(before[1][1:], legacy[1][-len(before[1]) + 1:])
+        rates_before = latest_prices(session, [coin])
+
+        rollups.compact_prices(session)
+        cutoff = dt.datetime.utcnow() - dt.timedelta(days=rollups.PRICE_RAW_RETENTION_DAYS)
+        raw = session.query(Price).filter(Price.coin == coin)
+        assert raw.filter(Price.timestamp < cutoff).count() <= 1  # строка checkpoint
+        assert raw.filter(Price.timestamp >= cutoff).count() == sum(r["timestamp"] >= cutoff for r in rows)
+
+        # прогноз и /rates читают бары и видят ту же историю
+        after = analysis._load_series(session, coin)
+        assert np.array_equal(before[0], after[0]) and np.allclose(before[1], after[1])
+        assert latest_prices(session, [coin]) == rates_before
+        # удалённые сырые цены не считаются пропуском для бэкфилла
+        now = dt.datetime.utcnow()
+        assert _missing_ranges(session, coin, now - dt.timedelta(days=analysis.LOOKBACK_DAYS), now) == []
+
+
+def legacy_load_series(session, coin: str, bar: str = analysis.FORECAST_BAR):
+    """Прежний _load_series: сырые цены за LOOKBACK_DAYS и ресемплинг в pandas."""
+    since = dt.datetime.utcnow() - dt.timedelta(days=analysis.LOOKBACK_DAYS)
+    query = (
+        select(Price.timestamp.label("ds"), Price.price_usd.label("y"))
+        .where(Price.coin == coin, Price.timestamp >= since)
+        .order_by(Price.timestamp)
+    )
+    df = pd.read_sql_query(query, session.connection(), parse_dates=["ds"])
+    series = df.set_index("ds")["y"].astype(np.float64).resample(bar).last().dropna()
+    return series.index.values, series.to_numpy()
+
+
+def legacy_latest_prices(session, coins: list[str]) -> dict[str, float]:
+    """Прежний /rates: последняя сырая цена по каждой монете."""
+    prices = {}
+    for coin in coins:
+        latest = session.query(Price).filter(Price.coin == coin).order_by(Price.timestamp.desc()).first()
+        prices[coin] = float(latest.price_usd)
+    return prices
+
+
+def _median_ms(func, *args, runs: int = 7) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def _db_size_mb() -> float:
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+    return os.path.getsize(engine.url.database) / 2**20
+
+
+def _latencies(session) -> tuple[float, float, float, float]:
+    coin = YEAR_COINS[0]
+    return (
+        _median_ms(legacy_load_series, session, coin),
+        _median_ms(analysis._load_series, session, coin),
+        _median_ms(legacy_latest_prices, session, YEAR_COINS),
+        _median_ms(latest_prices, session, YEAR_COINS),
+    )
+
+
+def benchmark_simulated_year():
+    now = dt.datetime.utcnow().replace(second=0, microsecond=0)
+    points = 365 * 24 * 60 // STEP_MINUTES
+    rnd = np.random.default_rng(0)
+    with SessionLocal() as session:
+        for i, coin in enumerate(YEAR_COINS):
+            y = 100 * (i + 1) * np.exp(np.cumsum(rnd.normal(0, 0.001, points)))
+            start = now - dt.timedelta(minutes=STEP_MINUTES * points)
+            insert_ignore(
+                session,
+                Price,
+                (
+                    {"coin": coin, "price_usd": float(v), "timestamp": start + dt.timedelta(minutes=STEP_MINUTES * k)}
+                    for k, v in enumerate(y)
+                ),
+            )
+        session.commit()
+
+        started = time.perf_counter()
+        rolled = rollups.rollup_prices(session)
+        rollup_time = time.perf_counter() - started
+
+        # очередной prices_job: две новые цены
+        insert_ignore(session, Price, [{"coin": c, "price_usd": 1.0, "timestamp": now} for c in YEAR_COINS])
+        session.commit()
+        started = time.perf_counter()
+        rollups.rollup_prices(session)
+        incremental_ms = (time.perf_counter() - started) * 1000
+
+        raw_before = session.query(Price).count()
+        size_before = _db_size_mb()
+        legacy_fc, bars_fc, legacy_rates, bars_rates = _latencies(session)
+
+        started = time.perf_counter()
+        deleted = rollups.compact_prices(session)
+        compact_time = time.perf_counter() - started
+        size_after = _db_size_mb()
+        _, bars_fc_after, _, bars_rates_after = _latencies(session)
+
+        counts = {m.__tablename__: session.query(m).count() for m in (Price, PriceBar1m, PriceBar1h, PriceBar1d)}
+
+    logger.info(
+        "Год цен: %d строк prices свёрнуты за %.1f c, очередные 2 цены — за %.1f мс",
+        rolled, rollup_time, incremental_ms,
+    )
+    logger.info(
+        "История для прогноза (%d дн.): сырые цены %.1f мс, часовые бары %.1f мс (после компактизации %.1f мс)",
+        analysis.LOOKBACK_DAYS, legacy_fc, bars_fc, bars_fc_after,
+    )
+    logger.info(
+        "/rates: сырые цены %.2f мс, минутные бары %.2f мс (после компактизации %.2f мс)",
+        legacy_rates, bars_rates, bars_rates_after,
+    )
+    logger.info(
+        "Компактизация за %.1f c, удалено %s; строк сейчас %s; размер БД %.1f МБ → %.1f МБ (%d сырых строк было)",
+        compact_time, deleted, counts, size_before, size_after, raw_before,
+    )
+
+
+if __name__ == "__main__":
+    test_rollup_matches_resample_out_of_order()
+    test_concurrent_rollups_count_each_price_once()
+    test_compaction_keeps_history_readable()
+    benchmark_simulated_year()
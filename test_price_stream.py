@@ -0,0 +1,212 @@
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stream.db')}")
+
+import websockets  # noqa: E402
+
+from bot import snapshots  # noqa: E402
+from db.models import Price, PriceBar1m, SessionLocal, insert_ignore  # noqa: E402
+from finance_ai import rollups, stream  # noqa: E402
+
+# Свои id монет: под pytest БД общая, и цены bitcoin/ethereum пишут другие тесты
+SYMBOLS = {"stream-bitcoin": "BTCUSDT", "stream-ethereum": "ETHUSDT"}
+# Тиков на монету: по одному в 50 мс биржевого времени, т.е. ~20 минут торгов
+TICKS = 25_000
+START = dt.datetime(2025, 1, 1, 12, 0, 0)
+
+
+def synthetic_ticks(coin_index: int) -> list[tuple[int, float]]:
+    """[(ts_ms, price), ...] — случайное блуждание цены."""
+    rnd = random.Random(coin_index)
+    price = 100.0 * (coin_index + 1)
+    start_ms = int(START.replace(tzinfo=dt.timezone.utc).timestamp() * 1000)
+    ticks = []
+    for i in range(TICKS):
+        price *= 1 + rnd.gauss(0, 0.0005)
+        ticks.append((start_ms + i * 50, round(price, 4)))
+    return ticks
+
+
+def expected_bars(ticks: list[tuple[int, float]]) -> dict[dt.datetime, tuple[float, float, float, float, int]]:
+    bars: dict[dt.datetime, list] = {}
+    for ts_ms, price in ticks:
+        minute = dt.datetime.utcfromtimestamp(ts_ms / 1000).replace(second=0, microsecond=0)
+        bar = bars.get(minute)
+        if bar is None:
+            bars[minute] = [price, price, price, price, 1]
+        else:
+            bar[1], bar[2], bar[3], bar[4] = max(bar[1], price), min(bar[2], price), price, bar[4] + 1
+    return {k: tuple(v) for k, v in bars.items()}
+
+
+async def run_stream(ticks: dict[str, list[tuple[int, float]]], store: stream.TickStore) -> float:
+    """Поднимает локальный WebSocket (формат Binance combined stream) и читает его stream_prices.
+
+    Первое подключение обрывается на середине — клиент должен переподключиться."""
+
+    messages = []
+    for coin, series in ticks.items():
+        symbol = SYMBOLS[coin]
+        for ts_ms, price in series:
+            messages.append((ts_ms, json.dumps(
+                {"stream": f"{symbol.lower()}@ticker", "data": {"e": "24hrTicker", "E": ts_ms, "s": symbol, "c": str(price)}}
+            )))
+    messages = [m for _, m in sorted(messages)]
+    sent = 0
+    done = asyncio.Event()
+
+    async def handler(ws):
+        nonlocal sent
+        stop = len(messages) // 2 if sent == 0 else len(messages)
+        while sent < stop:
+            await ws.send(messages[sent])
+            sent += 1
+        if sent == len(messages):
+            done.set()
+            await ws.wait_closed()  # держим соединение открытым до остановки сервера
+        # первое соединение просто закрывается — обрыв посреди потока
+
+    async with websockets.serve(handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        started = time.perf_counter()
+        task = asyncio.create_task(
+            stream.stream_prices(store, url=f"ws://127.0.0.1:{port}", symbols=SYMBOLS, flush_interval=0.5)
+        )
+        await done.wait()
+        last = {coin: series[-1][1] for coin, series in ticks.items()}
+        while {coin: getattr(store.latest(coin), "price", None) for coin in ticks} != last:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    return elapsed
+
+
+def test_stream_writes_minute_bars():
+    ticks = {coin: synthetic_ticks(i) for i, coin in enumerate(SYMBOLS)}
+    store = stream.TickStore(size=1_000)
+    elapsed = asyncio.run(run_stream(ticks, store))
+
+    for coin, series in ticks.items():
+        # кольцевой буфер хранит только последние size тиков
+        kept = store.ticks(coin)
+        assert len(kept) == store.size
+        assert kept[-1].price == series[-1][1]
+
+        expected = expected_bars(series)
+        with SessionLocal() as session:
+            bars = session.query(PriceBar1m).filter(PriceBar1m.coin == coin).order_by(PriceBar1m.start).all()
+        assert [b.start for b in bars] == sorted(expected)
+        for bar in bars:
+            o, h, l, c, n = expected[bar.start]
+            assert (float(bar.open), float(bar.high), float(bar.low), float(bar.close), bar.ticks) == (o, h, l, c, n)
+
+    total = TICKS * len(ticks)
+    with SessionLocal() as session:
+        bars = session.query(PriceBar1m).filter(PriceBar1m.coin.in_(SYMBOLS)).count()
+        assert session.query(Price).filter(Price.coin.in_(SYMBOLS)).count() == 0
+    logger.info(
+        "%d тиков за %.2f c (%.0f тиков/с), в БД %d минутных баров вместо %d строк prices",
+        total, elapsed, total / elapsed, bars, total,
+    )
+
+
+def test_bad_messages_do_not_stop_stream():
+    symbol = SYMBOLS["stream-bitcoin"]
+    ts_ms = int(time.time() * 1000)
+    good = [
+        json.dumps({"data": {"s": symbol, "E": ts_ms + i * 60_000, "c": str(100 + i)}}) for i in range(2)
+    ]
+    # не JSON, JSON-массив, data-массив, цена не числом — и только потом нормальные тикеры
+    frames = ["not json", "[1, 2]", '{"data": [1]}', json.dumps({"s": symbol, "E": ts_ms, "c": "n/a"}), *good]
+    flush_threads: list[int] = []
+
+    async def run():
+        async def handler(ws):
+            for frame in frames:
+                await ws.send(frame)
+            await ws.wait_closed()
+
+        store = stream.TickStore()
+        async with websockets.serve(handler, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            task = asyncio.create_task(
+                stream.stream_prices(
+                    store,
+                    url=f"ws://127.0.0.1:{port}",
+                    symbols={"stream-bitcoin": symbol},
+                    flush_interval=0.05,
+                    on_flush=lambda: flush_threads.append(threading.get_ident()),
+                )
+            )
+            deadline = time.monotonic() + 5
+            while not flush_threads and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        return store, threading.get_ident()
+
+    store, loop_thread = asyncio.run(run())
+    assert store.latest("stream-bitcoin").price == 101.0
+    # закрытый бар первой минуты записан, on_flush вызван не в потоке event loop
+    assert flush_threads and loop_thread not in flush_threads
+
+
+def test_rates_follow_newest_price():
+    coin = "rates-coin"
+    now = dt.datetime.utcnow().replace(microsecond=0)
+    store = stream.TickStore()
+    store.add(coin, now - dt.timedelta(minutes=10), 100.0)
+    store.add(coin, now - dt.timedelta(minutes=9), 101.0)
+
+    async def run_flush_loop() -> int:
+        calls = 0
+
+        def on_flush():
+            nonlocal calls
+            calls += 1
+
+        task = asyncio.create_task(stream._flush_loop(store, 0.05, on_flush))
+        await asyncio.sleep(0.3)  # первый бар записан один раз, дальше новых тиков нет
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return calls
+
+    # поток оборвался: буфер с последними тиками остаётся, но никуда не публикуется
+    assert asyncio.run(run_flush_loop()) == 1
+    with SessionLocal() as session:
+        store.flush(session, close_open=True)
+        assert snapshots.latest_prices(session, [coin]) == {coin: 101.0}
+
+        # опрос CoinGecko после обрыва потока: /rates показывает более свежую цену
+        insert_ignore(session, Price, [{"coin": coin, "price_usd": 120.0, "timestamp": now - dt.timedelta(minutes=1)}])
+        session.commit()
+        rollups.rollup_prices(session)
+        assert snapshots.latest_prices(session, [coin]) == {coin: 120.0}
+
+
+if __name__ == "__main__":
+    test_stream_writes_minute_bars()
+    test_bad_messages_do_not_stop_stream()
+    test_rates_follow_newest_price()
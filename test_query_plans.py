@@ -0,0 +1,300 @@
+import asyncio
+import datetime as dt
+import logging
+import os
+import re
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}")
+
+from sqlalchemy import event  # noqa: E402
+
+from db.models import Base, Forecast, News, Price, SessionLocal, Transaction, engine, insert_ignore  # noqa: E402
+import bot.main as bot_main  # noqa: E402
+from bot import snapshots  # noqa: E402
+from finance_ai import analysis, rollups  # noqa: E402
+from finance_ai.data_fetch import _missing_ranges, enrich_pending_news  # noqa: E402
+
+# bot.main включает DEBUG для всего процесса
+logging.getLogger().setLevel(logging.INFO)
+
+# Бенчмарк: монет × точек на монету (шаг 2 минуты, как у prices_job)
+BENCH_COINS = 20
+BENCH_POINTS_PER_COIN = 100_000
+BENCH_USERS = 10_000
+BENCH_TX_PER_USER = 20
+
+
+@contextmanager
+def captured_statements():
+    """Собирает SQL (SELECT/UPDATE/DELETE) с параметрами, выполненные внутри блока."""
+
+    statements: list[tuple[str, tuple]] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def query_plan(statements: list[tuple[str, tuple]]) -> list[str]:
+    with engine.connect() as conn:
+        return [
+            row[3]
+            for statement, parameters in statements
+            for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        ]
+
+
+def assert_plan(plan: list[str], *indexes: str, full_scans: bool = False) -> None:
+    """В плане есть каждый из indexes; нет сортировки во временном B-tree и (если не
+    разрешено) полного прохода по таблице."""
+
+    for index in indexes:
+        assert any(re.search(rf"INDEX {index}\b", line) for line in plan), (index, plan)
+    assert not any("TEMP B-TREE FOR ORDER BY" in line for line in plan), plan
+    if not full_scans:
+        scans = [line for line in plan if re.fullmatch(r"SCAN (\w+)", line) and line.split()[1] in Base.metadata.tables]
+        assert not scans, plan
+
+
+def fake_update(replies: list[str], user_id: int = 1) -> SimpleNamespace:
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    return SimpleNamespace(message=SimpleNamespace(reply_text=reply_text), effective_user=SimpleNamespace(id=user_id))
+
+
+def seed() -> None:
+    now = dt.datetime.utcnow()
+    with SessionLocal() as session:
+        insert_ignore(
+            session,
+            Price,
+            (
+                {"coin": coin, "price_usd": 100.0 + i, "timestamp": now - dt.timedelta(minutes=2 * i)}
+                for coin in snapshots.SNAPSHOT_COINS
+                for i in range(2_000)
+            ),
+        )
+        session.add_all(
+            Forecast(coin=coin, target_date=now.date() + dt.timedelta(days=d), price_usd=200 + d)
+            for coin in snapshots.SNAPSHOT_COINS
+            for d in range(1, 8)
+        )
+        session.add_all(
+            Transaction(user_id=1, tx_hash=f"0x{i:064x}", direction="in", amount_eth=0.1, timestamp=now - dt.timedelta(hours=i))
+            for i in range(20)
+        )
+        session.add_all(
+            News(
+                title=f"Headline {i}",
+                url=f"http://news.local/plan/{i}",
+                published_at=now - dt.timedelta(minutes=i),
+                title_ru=f"Заголовок {i}",
+                snippet_ru="",
+                sentiment="neutral",
+            )
+            for i in range(20)
+        )
+        session.commit()
+        rollups.rollup_prices(session)
+
+
+def test_hot_paths_use_indexes():
+    seed()
+    coin = snapshots.SNAPSHOT_COINS[0]
+    now = dt.datetime.utcnow()
+
+    with captured_statements() as statements:
+        asyncio.run(bot_main.history_cmd(fake_update([]), None))
+    assert_plan(query_plan(statements), "ix_transactions_user_id_timestamp")
+
+    with captured_statements() as statements:
+        asyncio.run(bot_main.news_cmd(fake_update([]), None))
+    assert_plan(query_plan(statements), "ix_news_published_at")
+
+    with SessionLocal() as session:
+        with captured_statements() as statements:
+            snapshots.render_forecast(session)
+        assert_plan(query_plan(statements), "ix_forecasts_coin_target_date")
+
+        with captured_statements() as statements:
+            snapshots.latest_prices(session)
+        assert_plan(query_plan(statements), "uq_price_bars_1m_coin_start")
+
+        with captured_statements() as statements:
+            analysis._load_series(session, coin)
+        assert_plan(query_plan(statements), "uq_price_bars_1h_coin_start")
+
+        with captured_statements() as statements:
+            analysis._load_series(session, coin, bar="")
+        assert_plan(query_plan(statements), "uq_prices_coin_timestamp")
+
+        with captured_statements() as statements:
+            _missing_ranges(session, coin, now - dt.timedelta(days=90), now)
+        assert_plan(query_plan(statements), "uq_prices_coin_timestamp", "uq_price_bars_1h_coin_start")
+
+        # очереди обработки — по частичным индексам
+        with captured_statements() as statements:
+            enrich_pending_news(session)
+        assert_plan(query_plan(statements), "ix_news_untranslated")
+
+        session.add_all(News(title=f"Unlabeled {i}", url=f"http://news.local/unlabeled/{i}", published_at=now) for i in range(5))
+        session.commit()
+        # под pytest в общей БД может остаться очередь других тестов
+        pending = session.query(News).filter(News.sentiment.is_(None)).count()
+        state, pipe = analysis._model_state, analysis._SENTIMENT_PIPE
+        analysis._model_state = "ready"
+        analysis._SENTIMENT_PIPE = lambda texts, **kwargs: [{"label": "neutral", "score": 0.5} for _ in texts]
+        try:
+            with captured_statements() as statements:
+                assert analysis.analyze_unlabeled_news(session) == pending
+        finally:
+            analysis._model_state, analysis._SENTIMENT_PIPE = state, pipe
+        assert_plan(query_plan(statements), "ix_news_unlabeled")
+
+        # ежедневная компактизация удаляет старые цены по индексу времени (бары — полным проходом)
+        with captured_statements() as statements:
+            rollups.compact_prices(session)
+        assert_plan(query_plan(statements), "ix_prices_timestamp", full_scans=True)
+
+
+def test_redundant_indexes_dropped():
+    with engine.connect() as conn:
+        names = {name for (name,) in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert not names & {"ix_prices_coin", "ix_transactions_user_id", "ix_forecasts_coin"}
+
+
+# ---------- бенчмарк ---------- #
+
+# Схемы индексов до и после: (удалить, создать)
+PRICE_LAYOUTS = {
+    "single-column": (
+        ["uq_prices_coin_timestamp"],
+        ["CREATE INDEX ix_prices_coin ON prices (coin)"],
+    ),
+    "composite": (
+        ["ix_prices_coin"],
+        ["CREATE UNIQUE INDEX uq_prices_coin_timestamp ON prices (coin, timestamp)"],
+    ),
+}
+TX_LAYOUTS = {
+    "single-column": (
+        ["ix_transactions_user_id_timestamp"],
+        ["CREATE INDEX ix_transactions_user_id ON transactions (user_id)"],
+    ),
+    "composite": (
+        ["ix_transactions_user_id"],
+        ["CREATE INDEX ix_transactions_user_id_timestamp ON transactions (user_id, timestamp)"],
+    ),
+}
+
+
+def _apply_layout(layout: tuple[list[str], list[str]]) -> None:
+    drop, create = layout
+    with engine.begin() as conn:
+        for name in drop:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+        for ddl in create:
+            conn.exec_driver_sql(ddl.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS").replace(
+                "CREATE UNIQUE INDEX", "CREATE UNIQUE INDEX IF NOT EXISTS"
+            ))
+
+
+def _median_ms(func, runs: int = 5) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def _bulk_seed() -> None:
+    """Миллионы строк prices и транзакций напрямую через executemany драйвера."""
+
+    fmt = "%Y-%m-%d %H:%M:%S.%f"
+    now = dt.datetime.utcnow().replace(second=0, microsecond=0)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM prices")
+        conn.exec_driver_sql("DELETE FROM transactions")
+        cursor = conn.connection.cursor()
+        cursor.executemany(
+            "INSERT INTO prices (coin, price_usd, timestamp) VALUES (?, ?, ?)",
+            (
+                (f"bench{c}", 100.0 + i % 1000, (now - dt.timedelta(minutes=2 * i)).strftime(fmt))
+                for i in range(BENCH_POINTS_PER_COIN)
+                for c in range(BENCH_COINS)
+            ),
+        )
+        cursor.executemany(
+            "INSERT INTO transactions (user_id, tx_hash, direction, amount_eth, timestamp) VALUES (?, ?, 'in', 0.1, ?)",
+            (
+                (u, f"0xbench{u}-{i}", (now - dt.timedelta(minutes=7 * i + u % 60)).strftime(fmt))
+                for i in range(BENCH_TX_PER_USER)
+                for u in range(BENCH_USERS)
+            ),
+        )
+
+
+def benchmark_indexes():
+    started = time.perf_counter()
+    _bulk_seed()
+    total = BENCH_COINS * BENCH_POINTS_PER_COIN
+    logger.info("Засеяно %d цен и %d транзакций за %.1f c", total, BENCH_USERS * BENCH_TX_PER_USER, time.perf_counter() - started)
+
+    coin = "bench7"
+    now = dt.datetime.utcnow()
+
+    def latest_price():
+        with SessionLocal() as session:
+            session.query(Price.price_usd).filter(Price.coin == coin).order_by(Price.timestamp.desc()).first()
+
+    def raw_history():
+        with SessionLocal() as session:
+            analysis._load_series(session, coin, bar="")
+
+    def gaps():
+        with SessionLocal() as session:
+            _missing_ranges(session, coin, now - dt.timedelta(days=90), now)
+
+    def history():
+        with SessionLocal() as session:
+            session.query(Transaction).filter(Transaction.user_id == 4242).order_by(Transaction.timestamp.desc()).limit(5).all()
+
+    results = {}
+    for name in PRICE_LAYOUTS:
+        _apply_layout(PRICE_LAYOUTS[name])
+        _apply_layout(TX_LAYOUTS[name])
+        results[name] = [_median_ms(f) for f in (latest_price, raw_history, gaps, history)]
+
+    for label, (old, new) in zip(
+        ("последняя цена монеты", "история монеты за 90 дней", "границы истории (бэкфилл)", "/history пользователя"),
+        zip(results["single-column"], results["composite"]),
+    ):
+        logger.info("%-28s одноколоночные индексы %8.2f мс, составной %7.2f мс (x%.0f)", label, old, new, old / new)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM prices WHERE coin LIKE 'bench%'")
+        conn.exec_driver_sql("DELETE FROM transactions WHERE tx_hash LIKE '0xbench%'")
+
+
+if __name__ == "__main__":
+    test_hot_paths_use_indexes()
+    test_redundant_indexes_dropped()
+    benchmark_indexes()
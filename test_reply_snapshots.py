@@ -0,0 +1,132 @@
+import asyncio
+import datetime as dt
+import logging
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'snapshots.db')}")
+
+from db.models import Forecast, Price, SessionLocal  # noqa: E402
+from finance_ai.rollups import rollup_prices  # noqa: E402
+import bot.main as bot_main  # noqa: E402
+from bot import snapshots  # noqa: E402
+
+# bot.main включает DEBUG для всего процесса
+logging.getLogger().setLevel(logging.INFO)
+
+CONCURRENT_USERS = 1_000
+
+
+def seed(history_points: int = 10_000) -> None:
+    now = dt.datetime.utcnow()
+    with SessionLocal() as session:
+        session.query(Forecast).delete()
+        for coin in snapshots.SNAPSHOT_COINS:
+            session.add_all(
+                Price(coin=coin, price_usd=100 + i, timestamp=now - dt.timedelta(minutes=2 * (history_points - i)))
+                for i in range(history_points)
+            )
+            session.add_all(
+                Forecast(coin=coin, target_date=now.date() + dt.timedelta(days=d), price_usd=200 + d)
+                for d in range(1, 8)
+            )
+        session.commit()
+        rollup_prices(session)
+
+
+def fake_update(replies: list[str]) -> SimpleNamespace:
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    return SimpleNamespace(message=SimpleNamespace(reply_text=reply_text))
+
+
+async def legacy_rates_cmd(update, context):
+    """Прежний /rates: запрос последней цены по каждой монете при каждом нажатии."""
+    with SessionLocal() as session:
+        lines = []
+        for coin in snapshots.SNAPSHOT_COINS:
+            latest = session.query(Price).filter(Price.coin == coin).order_by(Price.timestamp.desc()).first()
+            if latest:
+                lines.append(f"{coin.capitalize()}: ${float(latest.price_usd):.2f}")
+        await update.message.reply_text("\n".join(lines))
+
+
+async def legacy_forecast_cmd(update, context):
+    """Прежний /forecast: запрос прогнозов по каждой монете при каждом нажатии."""
+    with SessionLocal() as session:
+        lines = []
+        for coin in snapshots.SNAPSHOT_COINS:
+            forecasts = session.query(Forecast).filter(Forecast.coin == coin).order_by(Forecast.target_date).all()
+            lines.append(f"Прогноз {coin.capitalize()}:")
+            lines.extend(f"{fc.target_date}: ${float(fc.price_usd):.2f}" for fc in forecasts)
+            lines.append("")
+        await update.message.reply_text("\n".join(lines))
+
+
+def run_concurrent(handler, users: int = CONCURRENT_USERS) -> tuple[list[str], float, float]:
+    """Запускает handler для users пользователей разом; возвращает ответы, p50 и p99 задержки (мс).
+
+    Задержка пользователя — от общего старта до его ответа, поэтому
+    в неё входит и время, пока event loop занят чужими запросами к БД."""
+
+    replies: list[str] = []
+
+    async def run():
+        started = time.perf_counter()
+
+        async def one():
+            await handler(fake_update(replies), None)
+            return (time.perf_counter() - started) * 1000
+
+        return sorted(await asyncio.gather(*(one() for _ in range(users))))
+
+    latencies = asyncio.run(run())
+    return replies, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1]
+
+
+def test_handlers_match_legacy_replies():
+    seed(history_points=100)
+    with SessionLocal() as session:
+        snapshots.refresh_rates(session)
+        snapshots.refresh_forecast(session)
+
+    for new, old in ((bot_main.rates_cmd, legacy_rates_cmd), (bot_main.forecast_cmd, legacy_forecast_cmd)):
+        new_replies, old_replies = [], []
+        asyncio.run(new(fake_update(new_replies), None))
+        asyncio.run(old(fake_update(old_replies), None))
+        assert new_replies == old_replies, (new_replies, old_replies)
+
+
+def benchmark_handler_latency():
+    """Время ответа /rates и /forecast при CONCURRENT_USERS одновременных нажатиях."""
+    seed()
+    with SessionLocal() as session:
+        snapshots.refresh_rates(session)
+        snapshots.refresh_forecast(session)
+
+    for name, old, new in (
+        ("/rates", legacy_rates_cmd, bot_main.rates_cmd),
+        ("/forecast", legacy_forecast_cmd, bot_main.forecast_cmd),
+    ):
+        results = {}
+        for label, handler in (("db", old), ("snapshot", new)):
+            replies, p50, p99 = run_concurrent(handler)
+            assert len(replies) == CONCURRENT_USERS
+            results[label] = (p50, p99)
+        logger.info(
+            "%-9s %d пользователей: из БД p50 %.0f мс / p99 %.0f мс, из снимка p50 %.1f мс / p99 %.1f мс",
+            name, CONCURRENT_USERS, *results["db"], *results["snapshot"],
+        )
+
+
+if __name__ == "__main__":
+    test_handlers_match_legacy_replies()
+    benchmark_handler_latency()
@@ -0,0 +1,218 @@
+import datetime as dt
+import logging
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'sentiment.db')}")
+
+from db.models import News, SentimentCache, SessionLocal  # noqa: E402
+from finance_ai import analysis  # noqa: E402
+
+HEADLINES = 256
+BATCH_SIZES = [1, 8, 32, 64]
+# Допустимая доля расхождений квантизованных бэкендов с fp32
+MIN_AGREEMENT = 0.9
+
+# Фиксированный набор для сверки меток бэкендов с fp32
+REFERENCE_HEADLINES = [
+    "Bitcoin hits new all-time high as ETF inflows surge",
+    "Ethereum price slumps after major exchange hack",
+    "SEC delays decision on spot Solana ETF",
+    "Crypto lender files for bankruptcy, freezes withdrawals",
+    "BlackRock increases Bitcoin holdings for third straight week",
+    "Stablecoin issuer reports record quarterly profit",
+    "Regulators fine exchange $100 million over compliance failures",
+    "Bitcoin miners sell reserves as hashprice falls to record low",
+    "Ethereum upgrade goes live without issues on mainnet",
+    "Market liquidations top $1 billion as Bitcoin drops below $60,000",
+    "Visa expands stablecoin settlement to new markets",
+    "DeFi protocol loses $40 million in flash loan exploit",
+    "Bitcoin trades sideways ahead of Fed meeting",
+    "Coinbase shares rally after earnings beat expectations",
+    "Altcoins bleed as traders rotate into Bitcoin",
+    "Country adopts Bitcoin as legal tender",
+    "Crypto fund outflows continue for fifth week",
+    "Exchange token jumps 20% on new listing announcement",
+    "Court rules in favor of Ripple in landmark case",
+    "Analysts expect volatility to stay low this month",
+]
+
+_WORDS = (
+    "Bitcoin Ethereum price rally crash ETF approval SEC lawsuit whales accumulate "
+    "market liquidations surge record high drops below support miners halving "
+    "stablecoin exchange outflows inflows investors fear greed regulators"
+).split()
+
+
+def synthetic_headlines(count: int, prefix: str) -> list[News]:
+    rnd = random.Random(42)
+    return [
+        News(
+            title=" ".join(rnd.choice(_WORDS) for _ in range(rnd.randint(4, 24))),
+            url=f"http://news.local/{prefix}/{i}",
+            published_at=dt.datetime.utcnow(),
+        )
+        for i in range(count)
+    ]
+
+
+@contextmanager
+def stub_pipe(fail_on: str | None = None):
+    """Подменяет finBERT заглушкой: метка по длине заголовка, падение на батче с fail_on.
+
+    Отдаёт список размеров батчей, с которыми вызывалась модель."""
+
+    calls: list[int] = []
+
+    def pipe(texts, batch_size, **kwargs):
+        calls.append(len(texts))
+        if fail_on is not None and any(fail_on in t for t in texts):
+            raise RuntimeError("cannot process")
+        return [{"label": "Positive" if len(t) % 2 else "Negative", "score": 0.75} for t in texts]
+
+    state, previous = analysis._model_state, analysis._SENTIMENT_PIPE
+    analysis._model_state, analysis._SENTIMENT_PIPE = "ready", pipe
+    try:
+        yield calls
+    finally:
+        analysis._model_state, analysis._SENTIMENT_PIPE = state, previous
+
+
+def _unlabeled(session) -> int:
+    return session.query(News).filter(News.sentiment.is_(None)).count()
+
+
+def test_failing_headline_is_isolated():
+    with SessionLocal() as session, stub_pipe(fail_on="POISON") as calls:
+        analysis.analyze_unlabeled_news(session)  # очередь, оставшаяся от других тестов
+        titles = [f"Stub headline {i:03d}" for i in range(40)]
+        titles[5] = "Stub POISONED 005"  # той же длины: порядок в батчах — по id
+        session.add_all(
+            News(title=t, url=f"http://news.local/isolate/{i}", published_at=dt.datetime.utcnow()) for i, t in enumerate(titles)
+        )
+        session.commit()
+
+        # бюджет времени исчерпан — модель не вызывается
+        calls.clear()
+        assert analysis.analyze_unlabeled_news(session, batch_size=8, time_budget=0) == 0
+        assert calls == []
+
+        assert analysis.analyze_unlabeled_news(session, batch_size=8) == 39
+        # батч делится пополам до плохой строки, потом размер снова исходный
+        assert calls == [8, 4, 4, 2, 1, 1, 8, 8, 8, 8, 2], calls
+        assert _unlabeled(session) == 0
+        poison = session.query(News).filter(News.title == titles[5]).one()
+        assert poison.sentiment == analysis.SENTIMENT_FAILED
+
+        # плохая строка ушла из очереди: следующий прогон ничего не делает
+        calls.clear()
+        assert analysis.analyze_unlabeled_news(session, batch_size=8) == 0
+        assert calls == []
+
+
+def test_duplicate_titles_use_cache():
+    variants = ["Bitcoin ETF approved!", "bitcoin etf approved", "BITCOIN, ETF -- approved.", "Ethereum ETF delayed"]
+    with SessionLocal() as session, stub_pipe() as calls:
+        analysis.analyze_unlabeled_news(session)
+        session.add_all(
+            News(title=t, url=f"http://news.local/cache/{i}", published_at=dt.datetime.utcnow()) for i, t in enumerate(variants)
+        )
+        session.commit()
+
+        calls.clear()
+        assert analysis.analyze_unlabeled_news(session) == len(variants)
+        # заголовки, отличающиеся регистром и пунктуацией, — один прогон модели
+        assert calls == [2], calls
+        hashes = {analysis.title_hash(t) for t in variants}
+        assert session.query(SentimentCache).filter(SentimentCache.title_hash.in_(hashes)).count() == 2
+
+        rows = session.query(News).filter(News.url.like("http://news.local/cache/%")).order_by(News.id).all()
+        assert len({(n.sentiment, n.sentiment_score) for n in rows[:3]}) == 1
+        assert all(n.sentiment in ("positive", "negative") and n.sentiment_score == 0.75 for n in rows)
+
+        # те же заголовки позже — из sentiment_cache, без модели
+        session.add_all(
+            News(title=t, url=f"http://news.local/cache/repeat/{i}", published_at=dt.datetime.utcnow())
+            for i, t in enumerate(variants)
+        )
+        session.commit()
+        calls.clear()
+        assert analysis.analyze_unlabeled_news(session) == len(variants)
+        assert calls == []
+        repeat = session.query(News).filter(News.url.like("http://news.local/cache/repeat/%")).order_by(News.id).all()
+        assert [(n.sentiment, n.sentiment_score) for n in repeat] == [(n.sentiment, n.sentiment_score) for n in rows]
+
+
+def _model_ready() -> bool:
+    """Ждёт загрузки finBERT: до неё analyze_unlabeled_news ничего не размечает."""
+    if analysis.wait_for_sentiment_model():
+        return True
+    logger.warning("Модель тональности не загрузилась — пропускаем")
+    return False
+
+
+def test_queue_is_drained():
+    if not _model_ready():
+        return
+    with SessionLocal() as session:
+        session.add_all(synthetic_headlines(analysis.SENTIMENT_BATCH_SIZE * 3 + 1, "drain"))
+        session.commit()
+        analysis.analyze_unlabeled_news(session)
+        assert session.query(News).filter(News.sentiment.is_(None)).count() == 0
+
+
+def benchmark_batch_sizes():
+    if not _model_ready():
+        return
+    for batch_size in BATCH_SIZES:
+        with SessionLocal() as session:
+            session.add_all(synthetic_headlines(HEADLINES, f"bs{batch_size}"))
+            session.commit()
+            started = time.perf_counter()
+            labeled = analysis.analyze_unlabeled_news(session, batch_size=batch_size)
+            elapsed = time.perf_counter() - started
+        logger.info("batch_size=%2d: %d заголовков за %.2f c — %.1f заголовков/с", batch_size, labeled, elapsed, labeled / elapsed)
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def benchmark_backends():
+    """Задержка на заголовок, прирост RSS и совпадение меток с fp32 для каждого бэкенда."""
+    reference = None
+    for backend in analysis.SENTIMENT_BACKENDS:
+        rss_before = _rss_mb()
+        try:
+            pipe = analysis.build_sentiment_pipeline(backend)
+        except Exception as exc:
+            logger.warning("Бэкенд %s недоступен: %s", backend, exc)
+            continue
+        rss = _rss_mb() - rss_before
+
+        started = time.perf_counter()
+        labels = [r["label"].lower() for r in pipe(REFERENCE_HEADLINES, batch_size=1)]
+        latency = (time.perf_counter() - started) / len(REFERENCE_HEADLINES)
+
+        if reference is None:
+            reference = labels  # первый бэкенд — torch fp32
+        agreement = sum(a == b for a, b in zip(labels, reference)) / len(reference)
+        logger.info("%-5s: %.1f мс/заголовок, +%.0f МБ RSS, совпадение с fp32 %.0f%%", backend, latency * 1000, rss, agreement * 100)
+        assert agreement >= MIN_AGREEMENT, backend
+        del pipe
+
+
+if __name__ == "__main__":
+    test_failing_headline_is_isolated()
+    test_duplicate_titles_use_cache()
+    test_queue_is_drained()
+    benchmark_batch_sizes()
+    benchmark_backends()
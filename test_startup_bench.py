@@ -0,0 +1,51 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Импорт bot.main — всё, что происходит до того, как бот может ответить на /start
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import bot.main
+from finance_ai import analysis
+imported = time.perf_counter() - started
+if {eager}:
+    analysis._load_finbert()  # прежнее поведение: модель грузилась при импорте
+print(imported, time.perf_counter() - started, analysis.sentiment_model_state())
+"""
+
+
+def measure(eager: bool) -> tuple[float, float, str]:
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_TOKEN", "0:benchmark")
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}")
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(eager=eager)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    return float(out[-3]), float(out[-2]), out[-1]
+
+
+def test_import_does_not_load_model():
+    _, _, state = measure(eager=False)
+    assert state == "not_loaded"
+
+
+def benchmark_time_to_first_reply():
+    _, before, state = measure(eager=True)
+    after, _, _ = measure(eager=False)
+    logger.info("До первого ответа: раньше %.2f c (finBERT: %s), теперь %.2f c", before, state, after)
+
+
+if __name__ == "__main__":
+    test_import_does_not_load_model()
+    benchmark_time_to_first_reply()
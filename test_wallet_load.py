@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Задержка «медленной» RPC-ноды и число одновременных пользователей
+RPC_DELAY = 0.5
+CONCURRENT_USERS = 10
+# id пользователей /wallet — не пересекаются с другими тестами, если БД общая (pytest)
+USER_IDS = range(30_000, 30_000 + CONCURRENT_USERS)
+# Очередь PBKDF2 в тесте перегрузки и сколько /create одновременно
+KDF_TEST_MAX_PENDING = 2
+KDF_TEST_REQUESTS = 6
+# Уровни параллелизма для бенчмарка вывода средств
+WITHDRAW_CONCURRENCY = [1, 4, 16]
+WITHDRAWS_PER_USER = 2
+# Размеры выборок для бенчмарка batch-запросов балансов
+BATCH_SIZES = [10, 100, 1_000, 10_000]
+# Бэкфилл индексатора: число блоков и транзакций в каждом
+INDEXER_BLOCKS = 5_000
+TXS_PER_BLOCK = 20
+
+
+class SlowRPCHandler(BaseHTTPRequestHandler):
+    """Минимальная JSON-RPC заглушка Ethereum-ноды с искусственной задержкой."""
+
+    delay = RPC_DELAY
+    round_trips = 0
+    head = 0
+    deposit_to: str | None = None  # адрес, на который «приходит» ETH в каждом 10-м блоке
+
+    @classmethod
+    def block(cls, number: int) -> dict:
+        txs = [
+            {"hash": "0x" + secrets.token_hex(32), "to": "0x" + secrets.token_hex(20), "value": hex(10**15)}
+            for _ in range(TXS_PER_BLOCK)
+        ]
+        if cls.deposit_to and number % 10 == 0:
+            txs[0]["to"] = cls.deposit_to
+        return {"number": hex(number), "timestamp": hex(1_700_000_000 + number * 12), "transactions": txs}
+
+    @classmethod
+    def answer(cls, call: dict) -> dict:
+        if call["method"] == "eth_sendRawTransaction":
+            result = "0x" + secrets.token_hex(32)
+        elif call["method"] == "eth_blockNumber":
+            result = hex(cls.head)
+        elif call["method"] == "eth_getBlockByNumber":
+            result = cls.block(int(call["params"][0], 16))
+        else:
+            result = {"eth_getBalance": hex(10**18), "eth_chainId": "0x1"}.get(call["method"], "0x0")
+        return {"jsonrpc": "2.0", "id": call["id"], "result": result}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        SlowRPCHandler.round_trips += 1
+        time.sleep(self.delay)
+        if isinstance(body, list):
+            response = [self.answer(call) for call in body]
+        else:
+            response = self.answer(body)
+        payload = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+# Заглушка поднимается при импорте модуля, до импорта wallet.eth и db.models:
+# они читают ETH_RPC_URL / DATABASE_URL один раз при импорте
+_server = ThreadingHTTPServer(("127.0.0.1", 0), SlowRPCHandler)
+threading.Thread(target=_server.serve_forever, daemon=True).start()
+os.environ["ETH_RPC_URL"] = f"http://127.0.0.1:{_server.server_port}"
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}")
+
+from web3 import AsyncWeb3, Web3  # noqa: E402
+
+import http_client  # noqa: E402
+import wallet.eth as eth  # noqa: E402
+
+
+def start_rpc_server() -> ThreadingHTTPServer:
+    """Направляет wallet.eth на заглушку.
+
+    Модуль мог быть импортирован раньше другим тестом (pytest собирает все файлы
+    в одном процессе) — поэтому подменяем провайдеры и сбрасываем кэш chain id / газа."""
+    url = f"http://127.0.0.1:{_server.server_port}"
+    eth.ETH_RPC_URL = url
+    eth.w3 = Web3(Web3.HTTPProvider(url, session=http_client.get_session()))
+    eth.async_w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(url))
+    eth._chain_id = eth._gas_price = None
+    return _server
+
+
+def test_concurrent_wallet_requests():
+    start_rpc_server()
+
+    from eth_account import Account
+    from db.models import SessionLocal, User
+    from wallet.eth import get_wallet_async
+
+    with SessionLocal() as session:
+        for uid in USER_IDS:
+            session.add(User(telegram_id=uid, address=Account.create().address))
+        session.commit()
+
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(get_wallet_async(uid) for uid in USER_IDS))
+        return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(run())
+
+    serial = RPC_DELAY * CONCURRENT_USERS
+    logger.info("%d запросов /wallet: %.2f c (последовательно было бы ~%.2f c)", CONCURRENT_USERS, elapsed, serial)
+    assert all(r is not None and r.balance_eth == 1 for r in results)
+    # Запросы должны перекрываться, а не выполняться друг за другом
+    assert elapsed < serial / 2
+
+    # Повторный /wallet в том же блоке обслуживается из кэша балансов
+    _, cached_elapsed = asyncio.run(run())
+    assert cached_elapsed < RPC_DELAY
+
+
+def test_kdf_queue_overflow_is_rejected_fast():
+    from wallet.eth import WalletBusyError, create_wallet_async
+
+    async def timed(uid: int):
+        started = time.perf_counter()
+        try:
+            return await create_wallet_async(uid, "pwd"), time.perf_counter() - started
+        except WalletBusyError as exc:
+            return exc, time.perf_counter() - started
+
+    async def run():
+        return await asyncio.gather(*(timed(31_000 + i) for i in range(KDF_TEST_REQUESTS)))
+
+    default, eth.KDF_MAX_PENDING = eth.KDF_MAX_PENDING, KDF_TEST_MAX_PENDING
+    try:
+        results = asyncio.run(run())
+    finally:
+        eth.KDF_MAX_PENDING = default
+    assert eth._kdf_pending == 0
+
+    created = [elapsed for result, elapsed in results if not isinstance(result, WalletBusyError)]
+    busy = [elapsed for result, elapsed in results if isinstance(result, WalletBusyError)]
+    # сверх очереди — сразу «занято, повторите», не дожидаясь PBKDF2
+    assert len(created) == KDF_TEST_MAX_PENDING and len(busy) == KDF_TEST_REQUESTS - KDF_TEST_MAX_PENDING
+    assert max(busy) < min(created) / 10, (busy, created)
+    logger.info(
+        "Очередь PBKDF2 %d: %d отказов за %.1f мс, создание кошелька %.2f c",
+        KDF_TEST_MAX_PENDING, len(busy), max(busy) * 1000, min(created),
+    )
+
+
+def benchmark_withdraw_throughput():
+    """Пропускная способность /withdraw при 1, 4 и 16 одновременных пользователях."""
+    SlowRPCHandler.delay = 0
+    start_rpc_server()
+
+    from eth_account import Account
+    from wallet.eth import create_wallet, send_eth_async
+
+    max_users = max(WITHDRAW_CONCURRENCY)
+    base_id = 10_000
+    for uid in range(base_id, base_id + max_users):
+        create_wallet(uid, "pwd")
+    to_address = Account.create().address
+    # запуск процессов пула PBKDF2 (forkserver) не входит в замер
+    list(eth._get_kdf_pool().map(eth._derive_key, ["warmup"] * eth.KDF_WORKERS, [b"0" * 16] * eth.KDF_WORKERS))
+
+    async def withdraw_loop(uid: int):
+        for _ in range(WITHDRAWS_PER_USER):
+            await send_eth_async(uid, to_address, 0.001, "pwd")
+
+    for users in WITHDRAW_CONCURRENCY:
+        async def run():
+            started = time.perf_counter()
+            await asyncio.gather(*(withdraw_loop(base_id + i) for i in range(users)))
+            return time.perf_counter() - started
+
+        elapsed = asyncio.run(run())
+        total = users * WITHDRAWS_PER_USER
+        logger.info("users=%2d: %d выводов за %.2f c — %.1f tx/s", users, total, elapsed, total / elapsed)
+
+
+def benchmark_batch_balances(rtt: float = 0.005):
+    """Число round-trip'ов и время get_balances для 10…10 000 адресов."""
+    SlowRPCHandler.delay = rtt
+    start_rpc_server()
+
+    from wallet.eth import BALANCE_BATCH_SIZE, get_balances
+
+    for size in BATCH_SIZES:
+        addresses = ["0x" + secrets.token_hex(20) for _ in range(size)]
+        SlowRPCHandler.round_trips = 0
+        started = time.perf_counter()
+        balances = get_balances(addresses)
+        elapsed = time.perf_counter() - started
+        assert len(balances) == size
+        logger.info(
+            "%6d адресов: %3d round-trip (по одному было бы %d), %.3f c, batch=%d",
+            size, SlowRPCHandler.round_trips, size, elapsed, BALANCE_BATCH_SIZE,
+        )
+
+
+def benchmark_indexer_backfill():
+    """Скорость бэкфилла входящих транзакций (блоков в минуту)."""
+    SlowRPCHandler.delay = 0
+    start_rpc_server()
+
+    from db.models import SessionLocal, Transaction
+    import wallet.indexer
+    from wallet.eth import create_wallet
+    from wallet.indexer import index_incoming
+
+    SlowRPCHandler.deposit_to = create_wallet(20_000, "pwd").address
+    wallet.indexer.INDEXER_START_BLOCK = "1"
+    SlowRPCHandler.head = INDEXER_BLOCKS
+
+    with SessionLocal() as session:
+        started = time.perf_counter()
+        scanned = index_incoming(session)
+        elapsed = time.perf_counter() - started
+        incoming = session.query(Transaction).filter(Transaction.user_id == 20_000).count()
+
+    assert scanned == INDEXER_BLOCKS
+    assert incoming == INDEXER_BLOCKS // 10
+    logger.info("Индексатор: %d блоков за %.2f c — %.0f блоков/мин", scanned, elapsed, scanned / elapsed * 60)
+
+    # Повторный запуск продолжает с checkpoint и ничего не сканирует
+    with SessionLocal() as session:
+        assert index_incoming(session) == 0
+
+
+if __name__ == "__main__":
+    test_concurrent_wallet_requests()
+    test_kdf_queue_overflow_is_rejected_fast()
+    benchmark_withdraw_throughput()
+    benchmark_batch_balances()
+    benchmark_indexer_backfill()
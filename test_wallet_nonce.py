@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import tempfile
+
+# Настройка логов
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'nonce.db')}")
+
+from eth_tester import EthereumTester  # noqa: E402
+from web3 import AsyncWeb3, Web3  # noqa: E402
+from web3.providers.eth_tester import AsyncEthereumTesterProvider, EthereumTesterProvider  # noqa: E402
+
+from db.models import SessionLocal, Transaction, insert_ignore  # noqa: E402
+import wallet.eth as eth  # noqa: E402
+from wallet import indexer  # noqa: E402
+
+# Сколько выводов подряд делает один пользователь
+RAPID_WITHDRAWS = 5
+
+
+def setup_chain():
+    """Подключает wallet.eth к локальному eth-tester вместо реальной ноды."""
+    tester = EthereumTester()
+
+    provider = EthereumTesterProvider(tester)
+    async_provider = AsyncEthereumTesterProvider()
+    async_provider.ethereum_tester = tester
+
+    calls: list[str] = []
+    orig_sync, orig_async = provider.make_request, async_provider.make_request
+
+    def counting(method, params):
+        calls.append(method)
+        return orig_sync(method, params)
+
+    async def counting_async(method, params):
+        calls.append(method)
+        return await orig_async(method, params)
+
+    provider.make_request = counting
+    async_provider.make_request = counting_async
+
+    eth.w3 = Web3(provider)
+    eth.async_w3 = AsyncWeb3(async_provider)
+    return tester, calls
+
+
+def fund_wallet(telegram_id: int, tester: EthereumTester) -> str:
+    info = eth.create_wallet(telegram_id, "pwd")
+    tester.send_transaction(
+        {"from": tester.get_accounts()[0], "to": info.address, "value": 10**18, "gas": 21_000}
+    )
+    tester.mine_blocks()
+    return info.address
+
+
+def test_rapid_repeated_withdrawals():
+    tester, calls = setup_chain()
+    address = fund_wallet(1, tester)
+    to_address = tester.get_accounts()[1]
+
+    eth.sample_gas_price()
+    for _ in range(RAPID_WITHDRAWS):
+        calls.clear()
+        eth.send_eth(1, to_address, 0.01, "pwd")
+    # На горячем пути остаётся только eth_sendRawTransaction
+    assert calls == ["eth_sendRawTransaction"], calls
+    assert eth.w3.eth.get_transaction_count(address) == RAPID_WITHDRAWS
+
+
+def test_rapid_repeated_withdrawals_async():
+    tester, _ = setup_chain()
+    address = fund_wallet(2, tester)
+    to_address = tester.get_accounts()[1]
+
+    async def run():
+        # Одновременные выводы одного пользователя получают разные nonce
+        return await asyncio.gather(
+            *(eth.send_eth_async(2, to_address, 0.01, "pwd") for _ in range(RAPID_WITHDRAWS))
+        )
+
+    hashes = asyncio.run(run())
+    assert len(set(hashes)) == RAPID_WITHDRAWS
+    assert eth.w3.eth.get_transaction_count(address) == RAPID_WITHDRAWS
+    logger.info("%d выводов подряд приняты нодой", RAPID_WITHDRAWS)
+
+
+def test_nonce_gap_is_resynced():
+    tester, _ = setup_chain()
+    address = fund_wallet(3, tester)
+    to_address = tester.get_accounts()[1]
+
+    eth.send_eth(3, to_address, 0.01, "pwd")
+    # две следующие принятые нодой транзакции выпали из mempool: локальный счётчик ушёл вперёд
+    eth.nonce_manager.seed(address, 3)
+
+    # сразу после отправки счётчик не трогаем — транзакции могут ещё идти до ноды
+    assert eth.sync_nonces() == 0
+    eth.nonce_manager._reserved_at[address.lower()] -= eth.NONCE_RESYNC_GRACE
+    assert eth.sync_nonces() == 1
+
+    # следующий вывод занимает nonce выпавшей транзакции и попадает в блок
+    eth.send_eth(3, to_address, 0.01, "pwd")
+    assert eth.w3.eth.get_transaction_count(address) == 2
+
+def test_transfer_between_bot_wallets_recorded_twice():
+    tester, _ = setup_chain()
+    fund_wallet(4, tester)
+    recipient = eth.create_wallet(5, "pwd").address
+
+    tx_hash = eth.send_eth(4, recipient, 0.01, "pwd")
+    assert tx_hash.startswith("0x") and len(tx_hash) == 66
+
+    # блок в том виде, в каком его отдаёт JSON-RPC индексатору
+    block = eth.w3.eth.get_block("latest", full_transactions=True)
+    rpc_block = {
+        "timestamp": hex(block["timestamp"]),
+        "transactions": [
+            {"hash": Web3.to_hex(tx["hash"]).upper().replace("0X", "0x"), "to": tx["to"], "value": hex(tx["value"])}
+            for tx in block["transactions"]
+        ],
+    }
+    with SessionLocal() as session:
+        insert_ignore(session, Transaction, indexer._incoming_rows([rpc_block], {recipient.lower(): 5}))
+        session.commit()
+        rows = session.query(Transaction.user_id, Transaction.direction).filter(Transaction.tx_hash == tx_hash)
+        assert sorted(rows) == [(4, "out"), (5, "in")]
+
+
+if __name__ == "__main__":
+    test_rapid_repeated_withdrawals()
+    test_rapid_repeated_withdrawals_async()
+    test_nonce_gap_is_resynced()
+    test_transfer_between_bot_wallets_recorded_twice()
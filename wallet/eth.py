@@ -1,29 +1,74 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import multiprocessing
 import os
 import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Any, Callable, Iterable, Tuple, TypeVar
 
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
-from web3 import Web3
+from web3 import AsyncWeb3, Web3
 from eth_account import Account
 
+import http_client
 from db.models import SessionLocal, User
 
+logger = logging.getLogger(__name__)
+
 backend = default_backend()
 
 # Настройка сети Ethereum
 ETH_RPC_URL = os.getenv("ETH_RPC_URL", "https://rpc.ankr.com/eth")
-w3 = Web3(Web3.HTTPProvider(ETH_RPC_URL))
+# Синхронный провайдер ходит через общий пул соединений http_client
+w3 = Web3(Web3.HTTPProvider(ETH_RPC_URL, session=http_client.get_session()))
+# Асинхронный клиент для хендлеров бота: RPC не блокирует event loop
+async_w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(ETH_RPC_URL))
+
+# Ограниченный пул для синхронных сессий SQLAlchemy
+WALLET_WORKERS = int(os.getenv("WALLET_WORKERS", "4"))
+_executor = ThreadPoolExecutor(max_workers=WALLET_WORKERS, thread_name_prefix="wallet")
+
+# Отдельный пул процессов для PBKDF2: не держит GIL основного процесса бота.
+# KDF_MAX_PENDING ограничивает очередь — сверх неё отвечаем «занято».
+KDF_WORKERS = int(os.getenv("KDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+KDF_MAX_PENDING = int(os.getenv("KDF_MAX_PENDING", "32"))
+_kdf_pool: ProcessPoolExecutor | None = None
+_kdf_pending = 0
+
+# Кэш балансов: запись живёт до нового блока, но не дольше BALANCE_CACHE_TTL.
+# Номер блока опрашивается не чаще раза в BLOCK_POLL_INTERVAL секунд.
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "30"))
+BLOCK_POLL_INTERVAL = float(os.getenv("BLOCK_POLL_INTERVAL", "6"))
+
+# Сколько eth_getBalance упаковываем в один JSON-RPC batch
+BALANCE_BATCH_SIZE = int(os.getenv("BALANCE_BATCH_SIZE", "100"))
+
+# Цена газа обновляется фоновой задачей раз в GAS_PRICE_INTERVAL секунд;
+# значение старше GAS_PRICE_MAX_AGE запрашивается заново прямо при отправке.
+GAS_PRICE_INTERVAL = float(os.getenv("GAS_PRICE_INTERVAL", "30"))
+GAS_PRICE_MAX_AGE = float(os.getenv("GAS_PRICE_MAX_AGE", "120"))
+# Локальный nonce сверяется с нодой той же фоновой задачей; адреса, с которых отправляли
+# последние NONCE_RESYNC_GRACE секунд, не трогаем — их транзакции могут ещё не дойти до mempool
+NONCE_RESYNC_GRACE = float(os.getenv("NONCE_RESYNC_GRACE", "60"))
+
+T = TypeVar("T")
 
 PBKDF2_ITERATIONS = 250_000
 AES_KEY_LENGTH = 32  # 256 бит
 
 
+class WalletBusyError(RuntimeError):
+    """Очередь вывода ключей переполнена — пользователю стоит повторить позже."""
+
+
 def _derive_key(password: str, salt: bytes) -> bytes:
     """Выводим ключ из пароля при помощи PBKDF2-HMAC-SHA256."""
     kdf = PBKDF2HMAC(
@@ -36,22 +81,29 @@ def _derive_key(password: str, salt: bytes) -> bytes:
     return kdf.derive(password.encode())
 
 
+def _encrypt_with_key(private_key: bytes, key: bytes) -> bytes:
+    aesgcm = AESGCM(key)
+    nonce = secrets.token_bytes(12)
+    return nonce + aesgcm.encrypt(nonce, private_key, None)
+
+
+def _decrypt_with_key(ciphertext: bytes, key: bytes) -> bytes:
+    nonce, ct = ciphertext[:12], ciphertext[12:]
+    aesgcm = AESGCM(key)
+    return aesgcm.decrypt(nonce, ct, None)
+
+
 def encrypt_private_key(private_key: bytes, password: str) -> Tuple[bytes, bytes]:
     """Шифруем приватный ключ AES-256-GCM. Возвращает (ciphertext, salt)."""
     salt = secrets.token_bytes(16)
     key = _derive_key(password, salt)
-    aesgcm = AESGCM(key)
-    nonce = secrets.token_bytes(12)
-    ciphertext = nonce + aesgcm.encrypt(nonce, private_key, None)
-    return ciphertext, salt
+    return _encrypt_with_key(private_key, key), salt
 
 
 def decrypt_private_key(ciphertext: bytes, salt: bytes, password: str) -> bytes:
     """Расшифровываем приватный ключ."""
     key = _derive_key(password, salt)
-    nonce, ct = ciphertext[:12], ciphertext[12:]
-    aesgcm = AESGCM(key)
-    return aesgcm.decrypt(nonce, ct, None)
+    return _decrypt_with_key(ciphertext, key)
 
 
 @dataclass
@@ -60,6 +112,60 @@ class WalletInfo:
     balance_eth: float
 
 
+# ---------- Balance cache ---------- #
+
+@dataclass
+class _BalanceEntry:
+    balance_wei: int
+    block: int
+    fetched_at: float
+
+
+_balance_cache: dict[str, _BalanceEntry] = {}
+_latest_block: Tuple[int, float] | None = None  # (номер блока, когда проверяли)
+
+
+def _cached_balance(address: str, block: int) -> int | None:
+    entry = _balance_cache.get(address.lower())
+    if entry is None or entry.block < block:
+        return None
+    if time.monotonic() - entry.fetched_at > BALANCE_CACHE_TTL:
+        return None
+    return entry.balance_wei
+
+
+def _store_balance(address: str, balance_wei: int, block: int) -> None:
+    _balance_cache[address.lower()] = _BalanceEntry(balance_wei, block, time.monotonic())
+
+
+def invalidate_balance(*addresses: str) -> None:
+    """Сбрасывает закэшированный баланс для указанных адресов."""
+    for address in addresses:
+        _balance_cache.pop(address.lower(), None)
+
+
+def _fresh_block() -> int | None:
+    if _latest_block and time.monotonic() - _latest_block[1] < BLOCK_POLL_INTERVAL:
+        return _latest_block[0]
+    return None
+
+
+def _remember_block(block: int) -> int:
+    global _latest_block
+    _latest_block = (block, time.monotonic())
+    return block
+
+
+def _block_number() -> int:
+    block = _fresh_block()
+    return block if block is not None else _remember_block(w3.eth.block_number)
+
+
+async def _block_number_async() -> int:
+    block = _fresh_block()
+    return block if block is not None else _remember_block(await async_w3.eth.block_number)
+
+
 # ---------- High-level API ---------- #
 
 def create_wallet(telegram_id: int, password: str) -> WalletInfo:
@@ -68,68 +174,380 @@ def create_wallet(telegram_id: int, password: str) -> WalletInfo:
     acct = Account.create()
     priv_bytes = acct.key  # bytes
     ciphertext, salt = encrypt_private_key(priv_bytes, password)
+    _save_wallet(telegram_id, acct.address, ciphertext, salt)
 
+    return WalletInfo(address=acct.address, balance_eth=0)
+
+
+def _save_wallet(telegram_id: int, address: str, ciphertext: bytes, salt: bytes) -> None:
     with SessionLocal() as session:
         user = session.get(User, telegram_id)
         if user is None:
             user = User(telegram_id=telegram_id)
             session.add(user)
-        user.address = acct.address
+        user.address = address
         user.encrypted_key = ciphertext
         user.salt = salt
         session.commit()
 
-    return WalletInfo(address=acct.address, balance_eth=0)
 
+# ---------- Chain parameters & nonces ---------- #
 
-def get_wallet(telegram_id: int) -> WalletInfo | None:
+class NonceManager:
+    """Локальный учёт nonce: у ноды спрашиваем один раз, дальше считаем сами.
+
+    Позволяет отправлять несколько транзакций подряд, не дожидаясь, пока
+    предыдущие попадут в блок."""
+
+    def __init__(self) -> None:
+        self._next: dict[str, int] = {}
+        self._reserved_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def known(self, address: str) -> bool:
+        return address.lower() in self._next
+
+    def seed(self, address: str, chain_nonce: int) -> None:
+        """Запоминает nonce ноды (pending), не откатывая уже выданные."""
+        with self._lock:
+            key = address.lower()
+            self._next[key] = max(self._next.get(key, 0), chain_nonce)
+
+    def reserve(self, address: str) -> int:
+        with self._lock:
+            key = address.lower()
+            nonce = self._next[key]
+            self._next[key] = nonce + 1
+            self._reserved_at[key] = time.monotonic()
+            return nonce
+
+    def tracked(self) -> list[str]:
+        with self._lock:
+            return list(self._next)
+
+    def resync(self, address: str, chain_nonce: int, grace: float = NONCE_RESYNC_GRACE) -> int | None:
+        """Приводит локальный счётчик к nonce ноды (pending), если они разошлись.
+
+        Так транзакция, выпавшая из mempool (дешёвый газ, рестарт ноды), не блокирует
+        все следующие выводы с адреса до перезапуска бота. Возвращает прежнее значение
+        счётчика, если оно изменено, иначе None."""
+
+        with self._lock:
+            key = address.lower()
+            local = self._next.get(key)
+            if local is None or local == chain_nonce:
+                return None
+            if time.monotonic() - self._reserved_at.get(key, float("-inf")) < grace:
+                return None
+            self._next[key] = chain_nonce
+            return local
+
+    def reset(self, address: str) -> None:
+        """Забывает адрес — следующий reserve начнётся с nonce ноды."""
+        with self._lock:
+            self._next.pop(address.lower(), None)
+            self._reserved_at.pop(address.lower(), None)
+
+
+nonce_manager = NonceManager()
+
+_chain_id: int | None = None
+_gas_price: Tuple[int, float] | None = None  # (wei, когда получили)
+
+
+def sample_gas_price() -> int:
+    """Запрашивает цену газа у ноды и кэширует её (фоновая задача бота)."""
+    global _gas_price
+    gas_price = w3.eth.gas_price
+    _gas_price = (gas_price, time.monotonic())
+    return gas_price
+
+
+def sync_nonces() -> int:
+    """Сверяет локальные nonce с нодой (фоновая задача бота). Возвращает число исправленных адресов."""
+    fixed = 0
+    for address in nonce_manager.tracked():
+        try:
+            chain_nonce = w3.eth.get_transaction_count(Web3.to_checksum_address(address), "pending")
+        except Exception as exc:
+            logger.warning("Не удалось получить nonce %s: %s", address, exc)
+            continue
+        previous = nonce_manager.resync(address, chain_nonce)
+        if previous is not None:
+            logger.warning("Nonce %s расходился с нодой: %d → %d", address, previous, chain_nonce)
+            fixed += 1
+    return fixed
+
+
+def _cached_gas_price() -> int | None:
+    if _gas_price and time.monotonic() - _gas_price[1] < GAS_PRICE_MAX_AGE:
+        return _gas_price[0]
+    return None
+
+
+def _chain_params() -> Tuple[int, int]:
+    """(chain_id, gas_price) — из кэша, к ноде только при промахе."""
+    global _chain_id
+    if _chain_id is None:
+        _chain_id = w3.eth.chain_id
+    gas_price = _cached_gas_price()
+    return _chain_id, gas_price if gas_price is not None else sample_gas_price()
+
+
+async def _chain_params_async() -> Tuple[int, int]:
+    global _chain_id, _gas_price
+    if _chain_id is None:
+        _chain_id = await async_w3.eth.chain_id
+    gas_price = _cached_gas_price()
+    if gas_price is None:
+        gas_price = await async_w3.eth.gas_price
+        _gas_price = (gas_price, time.monotonic())
+    return _chain_id, gas_price
+
+
+def get_wallet_address(telegram_id: int) -> str | None:
+    """Адрес кошелька пользователя без обращения к RPC-ноде."""
     with SessionLocal() as session:
         user = session.get(User, telegram_id)
-        if user and user.address:
-            balance_wei = w3.eth.get_balance(user.address)
-            return WalletInfo(address=user.address, balance_eth=w3.from_wei(balance_wei, "ether"))
-    return None
+        return user.address if user else None
 
 
-def send_eth(telegram_id: int, to_address: str, amount_eth: float, password: str) -> str:
-    """Подписывает и отправляет транзакцию, возвращает hash."""
+def get_wallet(telegram_id: int) -> WalletInfo | None:
+    address = get_wallet_address(telegram_id)
+    if not address:
+        return None
+
+    block = _block_number()
+    balance_wei = _cached_balance(address, block)
+    if balance_wei is None:
+        balance_wei = w3.eth.get_balance(address, block)
+        _store_balance(address, balance_wei, block)
+    return WalletInfo(address=address, balance_eth=w3.from_wei(balance_wei, "ether"))
+
+
+def _load_user_keys(telegram_id: int) -> Tuple[str, bytes, bytes]:
+    """Возвращает (address, encrypted_key, salt) пользователя."""
 
     with SessionLocal() as session:
         user = session.get(User, telegram_id)
         if not user or not user.encrypted_key:
             raise RuntimeError("Кошелёк не найден. Создайте его командой /createwallet")
+        return user.address, user.encrypted_key, user.salt
+
+
+def _account_from_key(priv_key: bytes, address: str):
+    acct = Account.from_key(priv_key)
+    if acct.address.lower() != address.lower():
+        raise RuntimeError("Адрес кошелька не совпадает.")
+    return acct
+
+
+def _unlock_account(telegram_id: int, password: str):
+    """Загружает пользователя и расшифровывает его ключ. Возвращает Account."""
+
+    address, ciphertext, salt = _load_user_keys(telegram_id)
+    priv_key = decrypt_private_key(ciphertext, salt, password)
+    return _account_from_key(priv_key, address)
+
 
-        priv_key = decrypt_private_key(user.encrypted_key, user.salt, password)
-        acct = Account.from_key(priv_key)
-        if acct.address.lower() != user.address.lower():
-            raise RuntimeError("Адрес кошелька не совпадает.")
-
-        nonce = w3.eth.get_transaction_count(acct.address)
-        value = w3.to_wei(amount_eth, "ether")
-        gas_price = w3.eth.gas_price
-        tx = {
-            "to": Web3.to_checksum_address(to_address),
-            "value": value,
-            "gas": 21_000,
-            "gasPrice": gas_price,
-            "nonce": nonce,
-            "chainId": w3.eth.chain_id,
-        }
-
-        signed = acct.sign_transaction(tx)
-        tx_hash = w3.eth.send_raw_transaction(signed.rawTransaction)
-
-        # Записываем txn в БД
-        from db.models import Transaction  # локальный импорт, чтобы избежать циклов
+def normalize_tx_hash(tx_hash) -> str:
+    """Хэш транзакции в едином виде для БД: 0x + hex в нижнем регистре.
 
+    HexBytes.hex() в web3 6 и 7 отличается префиксом, а JSON-RPC отдаёт строку с 0x."""
+    return Web3.to_hex(hexstr=tx_hash).lower() if isinstance(tx_hash, str) else Web3.to_hex(tx_hash)
+
+
+def _record_outgoing(telegram_id: int, tx_hash: str, amount_eth: float) -> None:
+    """Записывает исходящую транзакцию в БД."""
+    from db.models import Transaction  # локальный импорт, чтобы избежать циклов
+
+    with SessionLocal() as session:
         session.add(
             Transaction(
                 user_id=telegram_id,
-                tx_hash=tx_hash.hex(),
+                tx_hash=tx_hash,
                 direction="out",
                 amount_eth=amount_eth,
             )
         )
         session.commit()
 
-    return tx_hash.hex() 
\ No newline at end of file
+
+def _build_tx(to_address: str, amount_eth: float, nonce: int, gas_price: int, chain_id: int) -> dict:
+    return {
+        "to": Web3.to_checksum_address(to_address),
+        "value": Web3.to_wei(amount_eth, "ether"),
+        "gas": 21_000,
+        "gasPrice": gas_price,
+        "nonce": nonce,
+        "chainId": chain_id,
+    }
+
+
+def rpc_batch(calls: list[Tuple[str, list]]) -> list[dict]:
+    """Отправляет вызовы [(method, params), ...] одним JSON-RPC batch.
+
+    Ответы возвращаются в порядке вызовов (нода может перемешать их)."""
+
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+        for i, (method, params) in enumerate(calls)
+    ]
+    # rpc_batch используется только для чтений — запрос можно безопасно повторить
+    resp = http_client.post(ETH_RPC_URL, json=payload, timeout=30, retry=True)
+    resp.raise_for_status()
+    return sorted(resp.json(), key=lambda item: item["id"])
+
+
+def get_balances(addresses: Iterable[str], chunk_size: int = BALANCE_BATCH_SIZE) -> dict[str, int]:
+    """Балансы (wei) для множества адресов: один JSON-RPC batch на chunk_size адресов.
+
+    Все запросы идут к одному блоку, результаты попадают в кэш балансов."""
+
+    addresses = list(addresses)
+    balances: dict[str, int] = {}
+    if not addresses:
+        return balances
+
+    block = _block_number()
+    for start in range(0, len(addresses), chunk_size):
+        chunk = addresses[start : start + chunk_size]
+        responses = rpc_batch([("eth_getBalance", [address, hex(block)]) for address in chunk])
+        for address, item in zip(chunk, responses):
+            if "result" not in item:
+                logger.warning("eth_getBalance failed for %s: %s", address, item.get("error"))
+                continue
+            balance_wei = int(item["result"], 16)
+            balances[address] = balance_wei
+            _store_balance(address, balance_wei, block)
+    return balances
+
+
+def refresh_all_balances(chunk_size: int = BALANCE_BATCH_SIZE) -> dict[str, int]:
+    """Обновляет кэш балансов для всех кошельков из таблицы users."""
+
+    with SessionLocal() as session:
+        addresses = [a for (a,) in session.query(User.address).filter(User.address.isnot(None))]
+    balances = get_balances(addresses, chunk_size)
+    logger.info("Обновлены балансы %d кошельков", len(balances))
+    return balances
+
+
+def _raw_tx(signed) -> bytes:
+    # web3/eth-account >= 0.13 переименовали rawTransaction -> raw_transaction
+    return getattr(signed, "raw_transaction", None) or signed.rawTransaction
+
+
+def send_eth(telegram_id: int, to_address: str, amount_eth: float, password: str) -> str:
+    """Подписывает и отправляет транзакцию, возвращает hash."""
+
+    acct = _unlock_account(telegram_id, password)
+
+    if not nonce_manager.known(acct.address):
+        nonce_manager.seed(acct.address, w3.eth.get_transaction_count(acct.address, "pending"))
+    chain_id, gas_price = _chain_params()
+    tx = _build_tx(
+        to_address,
+        amount_eth,
+        nonce=nonce_manager.reserve(acct.address),
+        gas_price=gas_price,
+        chain_id=chain_id,
+    )
+    signed = acct.sign_transaction(tx)
+    try:
+        tx_hash = w3.eth.send_raw_transaction(_raw_tx(signed))
+    except Exception:
+        nonce_manager.reset(acct.address)
+        raise
+    invalidate_balance(acct.address, tx["to"])
+
+    tx_hash = normalize_tx_hash(tx_hash)
+    _record_outgoing(telegram_id, tx_hash, amount_eth)
+    return tx_hash
+
+
+# ---------- Async API (для хендлеров бота) ---------- #
+
+async def _run_blocking(func: Callable[..., T], *args: Any) -> T:
+    """Выполняет синхронную функцию (crypto / БД) в ограниченном пуле потоков."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+def _get_kdf_pool() -> ProcessPoolExecutor:
+    global _kdf_pool
+    if _kdf_pool is None:
+        # forkserver, а не fork: процесс бота многопоточный (планировщик, event loop),
+        # и fork в момент, когда чужой поток держит блокировку (logging и т.п.), вешает дочерний
+        _kdf_pool = ProcessPoolExecutor(max_workers=KDF_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    return _kdf_pool
+
+
+async def _derive_key_async(password: str, salt: bytes) -> bytes:
+    """PBKDF2 в пуле процессов. При переполненной очереди — WalletBusyError."""
+    global _kdf_pending
+    if _kdf_pending >= KDF_MAX_PENDING:
+        raise WalletBusyError("Сервис перегружен, повторите попытку через несколько секунд.")
+
+    _kdf_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_kdf_pool(), _derive_key, password, salt)
+    finally:
+        _kdf_pending -= 1
+
+
+async def create_wallet_async(telegram_id: int, password: str) -> WalletInfo:
+    acct = Account.create()
+    salt = secrets.token_bytes(16)
+    key = await _derive_key_async(password, salt)
+    ciphertext = _encrypt_with_key(acct.key, key)
+    await _run_blocking(_save_wallet, telegram_id, acct.address, ciphertext, salt)
+    return WalletInfo(address=acct.address, balance_eth=0)
+
+
+async def get_wallet_address_async(telegram_id: int) -> str | None:
+    return await _run_blocking(get_wallet_address, telegram_id)
+
+
+async def get_wallet_async(telegram_id: int) -> WalletInfo | None:
+    address = await get_wallet_address_async(telegram_id)
+    if not address:
+        return None
+
+    block = await _block_number_async()
+    balance_wei = _cached_balance(address, block)
+    if balance_wei is None:
+        balance_wei = await async_w3.eth.get_balance(address, block)
+        _store_balance(address, balance_wei, block)
+    return WalletInfo(address=address, balance_eth=async_w3.from_wei(balance_wei, "ether"))
+
+
+async def send_eth_async(telegram_id: int, to_address: str, amount_eth: float, password: str) -> str:
+    """Асинхронный аналог send_eth: RPC через AsyncWeb3, PBKDF2 — в пуле процессов."""
+
+    address, ciphertext, salt = await _run_blocking(_load_user_keys, telegram_id)
+    key = await _derive_key_async(password, salt)
+    acct = _account_from_key(_decrypt_with_key(ciphertext, key), address)
+
+    if not nonce_manager.known(acct.address):
+        nonce_manager.seed(acct.address, await async_w3.eth.get_transaction_count(acct.address, "pending"))
+    chain_id, gas_price = await _chain_params_async()
+    tx = _build_tx(
+        to_address,
+        amount_eth,
+        nonce=nonce_manager.reserve(acct.address),
+        gas_price=gas_price,
+        chain_id=chain_id,
+    )
+    signed = acct.sign_transaction(tx)
+    try:
+        tx_hash = await async_w3.eth.send_raw_transaction(_raw_tx(signed))
+    except Exception:
+        nonce_manager.reset(acct.address)
+        raise
+    invalidate_balance(acct.address, tx["to"])
+
+    tx_hash = normalize_tx_hash(tx_hash)
+    await _run_blocking(_record_outgoing, telegram_id, tx_hash, amount_eth)
+    return tx_hash
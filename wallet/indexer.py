@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+from decimal import Decimal
+
+from db.models import Checkpoint, SessionLocal, Transaction, User, insert_ignore
+from wallet import eth
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "incoming_tx_block"
+# Сколько блоков запрашиваем одним JSON-RPC batch
+INDEXER_BATCH_BLOCKS = int(os.getenv("INDEXER_BATCH_BLOCKS", "50"))
+# С какого блока начинать при первом запуске (по умолчанию — с текущей головы)
+INDEXER_START_BLOCK = os.getenv("INDEXER_START_BLOCK")
+
+
+def _watched_addresses(session: SessionLocal) -> dict[str, int]:
+    """{address.lower(): telegram_id} для всех кошельков бота."""
+    rows = session.query(User.address, User.telegram_id).filter(User.address.isnot(None))
+    return {address.lower(): telegram_id for address, telegram_id in rows}
+
+
+def _fetch_blocks(start: int, end: int) -> list[dict]:
+    """Блоки [start, end] с полными транзакциями одним batch-запросом."""
+    responses = eth.rpc_batch([("eth_getBlockByNumber", [hex(n), True]) for n in range(start, end + 1)])
+    blocks = []
+    for number, item in zip(range(start, end + 1), responses):
+        if item.get("result") is None:
+            raise RuntimeError(f"Block {number} unavailable: {item.get('error')}")
+        blocks.append(item["result"])
+    return blocks
+
+
+def _incoming_rows(blocks: list[dict], watched: dict[str, int]) -> list[dict]:
+    rows = []
+    for block in blocks:
+        timestamp = dt.datetime.utcfromtimestamp(int(block["timestamp"], 16))
+        for tx in block["transactions"]:
+            user_id = watched.get((tx.get("to") or "").lower())
+            value = int(tx["value"], 16)
+            if user_id is None or value == 0:
+                continue
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "tx_hash": eth.normalize_tx_hash(tx["hash"]),
+                    "direction": "in",
+                    "amount_eth": Decimal(value) / Decimal(10**18),
+                    "timestamp": timestamp,
+                }
+            )
+    return rows
+
+
+def index_incoming(session: SessionLocal, max_blocks: int | None = None) -> int:
+    """Сканирует новые блоки и записывает входящие переводы на кошельки бота.
+
+    Продолжает с сохранённого checkpoint; возвращает число обработанных блоков."""
+
+    head = eth.w3.eth.block_number
+    checkpoint = session.get(Checkpoint, CHECKPOINT_NAME)
+    if checkpoint is None:
+        start = int(INDEXER_START_BLOCK) if INDEXER_START_BLOCK else head
+        checkpoint = Checkpoint(name=CHECKPOINT_NAME, value=start - 1)
+        session.add(checkpoint)
+
+    end = head if max_blocks is None else min(head, checkpoint.value + max_blocks)
+    watched = _watched_addresses(session)
+    scanned = 0
+
+    while checkpoint.value < end:
+        start = checkpoint.value + 1
+        batch_end = min(start + INDEXER_BATCH_BLOCKS - 1, end)
+        rows = _incoming_rows(_fetch_blocks(start, batch_end), watched)
+
+        insert_ignore(session, Transaction, rows)
+        checkpoint.value = batch_end
+        session.commit()
+
+        if rows:
+            credited = {row["user_id"] for row in rows}
+            eth.invalidate_balance(*(a for a, uid in watched.items() if uid in credited))
+            logger.info("Входящих транзакций: %d (блоки %d–%d)", len(rows), start, batch_end)
+        scanned += batch_end - start + 1
+
+    return scanned